@@ -4,3 +4,4 @@
 
 __version__ = "0.1.0"
 from biollante_rodan import BiollanteRodan      # noqa
+from biollante_batch_rodan import BiollanteBatchRodan      # noqa
@@ -0,0 +1,173 @@
+# Copyright (C) 2020 Juliette Regimbal
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Compare the throughput (fitness evaluations per second) of the
+NumPy GA engine with gamera's GAOptimization.
+
+    python bench_ga_engine.py [training.xml] [--generations N]
+        [--population N] [--threads N] [--weighting]
+
+Without a training file, a synthetic data set is used and only the
+NumPy engine is measured. gamera is only needed for the comparison;
+when it is missing the report says so instead of timing it. The
+NumPy engine scores genomes with the k and distance of gamera's
+classifier for the training file (gamera's defaults without one,
+or without gamera), and reports the genomes it looked up in its
+fitness cache apart from those it evaluated. The report (a JSON
+list, one entry per engine) is the only output.
+"""
+
+from __future__ import division, print_function, unicode_literals
+
+import argparse
+import feature_matrix
+import ga_engine
+import json
+import knn_fitness
+import numpy as np
+import sys
+import time
+
+
+# kNNNonInteractive's k and distance for a file without settings.
+GAMERA_K = 1
+GAMERA_DISTANCE = knn_fitness.DISTANCE_CITY_BLOCK
+
+
+def synthetic(glyphs=2000, classes=20, features=64, seed=0):
+    rng = np.random.RandomState(seed)
+    centers = rng.uniform(-5.0, 5.0, (classes, features))
+    labels = rng.randint(0, classes, glyphs)
+    return rng.normal(centers[labels], 2.0), labels
+
+
+def config(args):
+    op_mode = ga_engine.OPMODE_WEIGHTING if args.weighting \
+        else ga_engine.OPMODE_SELECTION
+    if args.weighting:
+        crossover = [{"method": "hypercube",
+                      "parameters": {"min": 0.0, "max": 1.0, "alpha": 0.0}}]
+        mutation = [{"method": "gauss", "parameters": {
+            "min": 0.0, "max": 1.0, "sigma": 0.1, "rate": 0.5
+        }}]
+    else:
+        crossover = [{"method": "nPoint", "parameters": {"n": 1}}]
+        mutation = [{"method": "binary",
+                     "parameters": {"rate": 0.05, "normalize": True}}]
+    return ga_engine.GAConfig(
+        {"opMode": op_mode, "popSize": args.population,
+         "crossRate": 0.95, "mutRate": 0.05},
+        {"method": "rank", "parameters": {"pressure": 2.0, "exponent": 1.0}},
+        {"method": "generational", "parameters": {}},
+        mutation,
+        crossover,
+        [{"method": "maxGenerations", "parameters": {"n": args.generations}}],
+        seed=args.seed
+    )
+
+
+def bench_numpy(features, labels, args, k=GAMERA_K,
+                distance_type=GAMERA_DISTANCE):
+    c = config(args)
+    optimizer = ga_engine.NumpyGAOptimization(
+        ga_engine.LeaveOneOutFitness(
+            knn_fitness.normalize(features), labels, k, distance_type,
+            c.opMode
+        ),
+        features.shape[1], c, args.threads
+    )
+    start = time.time()
+    optimizer.run()
+    elapsed = time.time() - start
+    evaluated = optimizer.evaluations - optimizer.cache_hits
+    return {"engine": "numpy", "seconds": elapsed,
+            "k": k, "distanceType": distance_type,
+            "evaluations": evaluated,
+            "cacheHits": optimizer.cache_hits,
+            "evaluationsPerSecond": evaluated / elapsed,
+            "bestFitness": optimizer.bestFitness,
+            "seed": optimizer.seed}
+
+
+def bench_gamera(path, args):
+    from gamera import knn, knnga
+    from gamera.core import init_gamera
+
+    init_gamera()
+    classifier = knn.kNNNonInteractive(path)
+    base = knnga.GABaseSetting()
+    base.opMode = knnga.GA_WEIGHTING if args.weighting \
+        else knnga.GA_SELECTION
+    base.popSize = args.population
+    base.crossRate = 0.95
+    base.mutRate = 0.05
+    selection = knnga.GASelection()
+    selection.setRankSelection(2.0, 1.0)
+    crossover = knnga.GACrossover()
+    mutation = knnga.GAMutation()
+    if args.weighting:
+        crossover.setHypercubeCrossover(
+            classifier.num_features, 0.0, 1.0, 0.0
+        )
+        mutation.setGaussMutation(classifier.num_features, 0.0, 1.0, 0.1, 0.5)
+    else:
+        crossover.setNPointCrossover(1)
+        mutation.setBinaryMutation(0.05, True)
+    replacement = knnga.GAReplacement()
+    replacement.setGenerationalReplacement()
+    stop_criteria = knnga.GAStopCriteria()
+    stop_criteria.setMaxGenerations(args.generations)
+
+    optimizer = knnga.GAOptimization(
+        classifier, base, selection, crossover, mutation, replacement,
+        stop_criteria, knnga.GAParallelization(True, args.threads)
+    )
+    start = time.time()
+    optimizer.startCalculation()
+    while optimizer.status:
+        time.sleep(0.1)
+    elapsed = time.time() - start
+    # gamera does not count evaluations; assume one per individual.
+    evaluations = (optimizer.generation + 1) * args.population
+    return {"engine": "gamera", "seconds": elapsed,
+            "k": int(classifier.num_k),
+            "distanceType": int(classifier.distance_type),
+            "evaluations": evaluations,
+            "evaluationsPerSecond": evaluations / elapsed,
+            "bestFitness": optimizer.bestFitness}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("training", nargs="?")
+    parser.add_argument("--generations", type=int, default=20)
+    parser.add_argument("--population", type=int, default=50)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--weighting", action="store_true")
+    # The same seed gives the NumPy engine the same run with any
+    # number of threads, so timings compare like with like.
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results = []
+    k, distance_type = GAMERA_K, GAMERA_DISTANCE
+    if args.training is None:
+        features, labels = synthetic()
+    else:
+        matrix = feature_matrix.FeatureMatrix.from_xml(args.training)
+        features, labels = np.asarray(matrix.features), matrix.labels
+        try:
+            results.append(bench_gamera(args.training, args))
+            # Score the same classifier.
+            k, distance_type = results[-1]["k"], results[-1]["distanceType"]
+        except ImportError as e:
+            print("gamera is not available; skipping GAOptimization.",
+                  file=sys.stderr)
+            results.append({"engine": "gamera", "skipped": str(e)})
+    results.append(bench_numpy(features, labels, args, k, distance_type))
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
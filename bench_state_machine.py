@@ -0,0 +1,326 @@
+# Copyright (C) 2020 Juliette Regimbal
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Drive the Biollante job through its states end to end on generated
+training data and report each transition's latency, the bytes of
+job settings Rodan persists after it and the I/O it performs.
+
+    python bench_state_machine.py [--glyphs N] [--classes N]
+        [--generations N] [--population N] [--engine gamera|numpy]
+        [--baseline PATH] [--save-baseline] [--tolerance F]
+
+Rodan and celery are replaced by a minimal runtime (job settings
+round-tripped through JSON, WAITING_FOR_INPUT merged into them) and
+a temporary resource store; gamera is needed. The run fails if a
+transition is slower, persists more or reads or writes more than the
+stored baseline (beyond the tolerance). Without a baseline at the
+default path the report is only printed; a --baseline given
+explicitly must exist.
+"""
+
+from __future__ import division, print_function, unicode_literals
+
+import argparse
+import json
+import logging
+import numpy as np
+import os
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "bench_state_machine_baseline.json")
+# Relative increase of a metric tolerated before it is a regression,
+# and absolute slack for timings too short to compare relatively.
+TOLERANCE = 0.25
+SECONDS_SLACK = 0.05
+METRICS = ["seconds", "settingsBytes", "contextBytes", "readBytes",
+           "writtenBytes"]
+
+STATE_NAMES = {None: "NEW", 0: "INIT", 1: "NOT_OPTIMIZING",
+               2: "OPTIMIZING", 3: "FINISHING", 4: "CONDENSING"}
+
+
+class RodanTask(object):
+    """
+    The parts of rodan.jobs.base.RodanTask the job relies on.
+    """
+
+    class WAITING_FOR_INPUT(object):
+        def __init__(self, settings_update={}):
+            self.settings_update = settings_update
+
+    class ManualPhaseException(Exception):
+        pass
+
+
+def install_runtime():
+    """
+    Make biollante_rodan importable without Rodan (and celery).
+    """
+    base = types.ModuleType(str("rodan.jobs.base"))
+    base.RodanTask = RodanTask
+    for name in ["rodan", "rodan.jobs"]:
+        sys.modules.setdefault(str(name), types.ModuleType(str(name)))
+    sys.modules[str("rodan.jobs.base")] = base
+    try:
+        import celery.utils.log  # noqa: F401
+    except ImportError:
+        log = types.ModuleType(str("celery.utils.log"))
+        log.get_task_logger = logging.getLogger
+        for name in ["celery", "celery.utils"]:
+            sys.modules.setdefault(str(name), types.ModuleType(str(name)))
+        sys.modules[str("celery.utils.log")] = log
+
+
+class ResourceStore(object):
+    """
+    Resources of one run in a temporary directory, in the form
+    Rodan passes them to run_my_task.
+    """
+
+    def __init__(self):
+        self.directory = tempfile.mkdtemp(prefix="biollante-bench-")
+
+    def resource(self, name):
+        return {
+            "resource_path": os.path.join(self.directory, name),
+            "resource_type": "application/gamera+xml"
+        }
+
+    def close(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def io_counters():
+    """
+    Bytes read and written by this process so far (Linux only).
+    """
+    try:
+        with open("/proc/self/io") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(fields["rchar"]), int(fields["wchar"])
+    except (IOError, OSError, KeyError, ValueError):
+        return None
+
+
+def generate_training_data(path, glyphs=300, classes=10, size=16, seed=0):
+    """
+    Write a gamera training set of noisy copies of one random
+    binary prototype per class.
+    """
+    from gamera import gamera_xml
+    from gamera.core import Dim, Image, ONEBIT, Point, init_gamera
+
+    init_gamera()
+    rng = np.random.RandomState(seed)
+    prototypes = rng.uniform(size=(classes, size, size)) < 0.4
+    images = []
+    for i in range(glyphs):
+        c = i % classes
+        pixels = prototypes[c] ^ (rng.uniform(size=(size, size)) < 0.05)
+        image = Image(Point(0, 0), Dim(size, size), ONEBIT)
+        for y, x in zip(*np.nonzero(pixels)):
+            image.set(Point(int(x), int(y)), 1)
+        image.classify_manual([(1.0, "class%d" % c)])
+        images.append(image)
+    gamera_xml.WriteXMLFile(
+        glyphs=images, with_features=True
+    ).write_filename(path)
+
+
+def default_settings(job_class):
+    """
+    The job's settings as Rodan creates them from its schema.
+    """
+    return dict(
+        (name, schema["default"])
+        for name, schema in job_class.settings["properties"].items()
+        if "default" in schema
+    )
+
+
+def start_input(generations=5, population=20):
+    """
+    A selection run as the interface submits it.
+    """
+    return {
+        "method": "start",
+        "base": {"opMode": 0, "popSize": population,
+                 "crossRate": 0.95, "mutRate": 0.05, "seed": 0},
+        "selection": {"method": "rank",
+                      "parameters": {"pressure": 2.0, "exponent": 1.0}},
+        "replacement": {"method": "generational", "parameters": {}},
+        "mutation": [{"method": "binary",
+                      "parameters": {"rate": 0.05, "normalize": True}}],
+        "crossover": [{"method": "nPoint", "parameters": {"n": 1}}],
+        "stop_criteria": [{"method": "maxGenerations",
+                           "parameters": {"n": generations}}]
+    }
+
+
+def drive(make_job, inputs, settings, outputs, user_input):
+    """
+    Run the job from INIT to FINISHING as Rodan would: a new job
+    object for every call, WAITING_FOR_INPUT updates and validated
+    user input merged into the settings, and the settings persisted
+    as JSON in between. Returns the measured transitions.
+    """
+    transitions = []
+
+    def transition(name, call):
+        before = settings.get("@state")
+        io = io_counters()
+        start = time.time()
+        result = call(make_job())
+        elapsed = time.time() - start
+        after_io = io_counters()
+        context = None
+        if isinstance(result, tuple):
+            # get_my_interface: (template, context)
+            context = json.dumps(result[1])
+        update = getattr(result, "settings_update", result)
+        if isinstance(update, dict):
+            settings.update(update)
+        persisted = json.dumps(settings)
+        settings.clear()
+        settings.update(json.loads(persisted))
+        transitions.append({
+            "name": name,
+            "from": STATE_NAMES.get(before, before),
+            "to": STATE_NAMES.get(settings.get("@state")),
+            "seconds": elapsed,
+            "settingsBytes": len(persisted.encode("utf-8")),
+            "contextBytes": None if context is None
+            else len(context.encode("utf-8")),
+            "readBytes": None if io is None else after_io[0] - io[0],
+            "writtenBytes": None if io is None else after_io[1] - io[1]
+        })
+        return result
+
+    transition("init", lambda job: job.run_my_task(inputs, settings, outputs))
+    transition("interface",
+               lambda job: job.get_my_interface(inputs, settings))
+    transition("start", lambda job: job.validate_my_user_input(
+        inputs, settings, user_input
+    ))
+    transition("optimize",
+               lambda job: job.run_my_task(inputs, settings, outputs))
+    transition("results",
+               lambda job: job.get_my_interface(inputs, settings))
+    transition("finish", lambda job: job.validate_my_user_input(
+        inputs, settings, {"method": "finish"}
+    ))
+    result = transition(
+        "write", lambda job: job.run_my_task(inputs, settings, outputs)
+    )
+    assert result is True, "The job did not finish: %r" % (result,)
+    return transitions
+
+
+def benchmark(args):
+    install_runtime()
+    import biollante_rodan
+
+    # Optimizations are checked every POLL_INTERVAL seconds; keep
+    # the idle time at the end of the run short.
+    biollante_rodan.POLL_INTERVAL = args.poll_interval
+    store = ResourceStore()
+    try:
+        inputs = {"kNN Training Data": [store.resource("training.xml")]}
+        outputs = {"GA Optimized Classifier": [store.resource("out.xml")]}
+        generate_training_data(
+            inputs["kNN Training Data"][0]["resource_path"],
+            args.glyphs, args.classes
+        )
+        settings = default_settings(biollante_rodan.BiollanteRodan)
+        settings["GA Engine"] = args.engine
+        settings["Max. Threads"] = args.threads
+        transitions = drive(
+            biollante_rodan.BiollanteRodan, inputs, settings, outputs,
+            start_input(args.generations, args.population)
+        )
+        output_bytes = os.path.getsize(
+            outputs["GA Optimized Classifier"][0]["resource_path"]
+        )
+    finally:
+        store.close()
+    return {
+        "glyphs": args.glyphs,
+        "classes": args.classes,
+        "engine": args.engine,
+        "generations": args.generations,
+        "population": args.population,
+        "threads": args.threads,
+        "transitions": transitions,
+        "totalSeconds": sum(t["seconds"] for t in transitions),
+        "outputBytes": output_bytes
+    }
+
+
+def regressions(report, baseline, tolerance=TOLERANCE,
+                seconds_slack=SECONDS_SLACK):
+    """
+    Describe every metric of a transition that exceeds its value
+    in the baseline by more than the tolerance.
+    """
+    found = []
+    expected = dict((t["name"], t) for t in baseline["transitions"])
+    for t in report["transitions"]:
+        if t["name"] not in expected:
+            continue
+        for metric in METRICS:
+            old, new = expected[t["name"]].get(metric), t[metric]
+            if old is None or new is None:
+                continue
+            limit = old * (1 + tolerance)
+            if metric == "seconds":
+                limit += seconds_slack
+            if new > limit:
+                found.append("%s: %s %s > %s (baseline %s)" % (
+                    t["name"], metric, new, limit, old
+                ))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--glyphs", type=int, default=300)
+    parser.add_argument("--classes", type=int, default=10)
+    parser.add_argument("--generations", type=int, default=5)
+    parser.add_argument("--population", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=2)
+    parser.add_argument("--engine", choices=["gamera", "numpy"],
+                        default="gamera")
+    parser.add_argument("--poll-interval", type=float, default=0.1)
+    parser.add_argument("--baseline")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    path = args.baseline or BASELINE_PATH
+    report = benchmark(args)
+    print(json.dumps(report, indent=2, sort_keys=True))
+    if args.save_baseline:
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        return 0
+    if not os.path.exists(path):
+        print("No baseline at %s; run with --save-baseline." % path)
+        # Asked to compare with it: nothing to compare is a failure.
+        return 1 if args.baseline else 0
+    with open(path) as f:
+        baseline = json.load(f)
+    found = regressions(report, baseline, args.tolerance)
+    for line in found:
+        print("Regression: %s" % line)
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,286 @@
+# Copyright (C) 2020 Juliette Regimbal
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import unicode_literals
+
+from biollante_rodan import BiollanteRodan, MAX_TRAINING_RESOURCES
+from gamera import knnga
+from multiprocessing.pool import ThreadPool
+from time import sleep, time
+
+import budget
+import copy
+import ga_engine
+import json
+import knnga_util as util
+import profiling
+import scheduler
+import threading
+
+
+# Seconds between checks on the running optimizations.
+POLL_INTERVAL = 5
+# Entries of the serialized configuration (see knnga_dict).
+CONFIG_KEYS = ["@base", "@selection", "@replacement", "@mutation",
+               "@crossover", "@stop_criteria"]
+
+
+class BiollanteBatchRodan(BiollanteRodan):
+    name = "Biollante Batch"
+    author = "Juliette Regimbal"
+    description = "Non-interactive GA Optimizer for many kNN Classifiers"
+    settings = copy.deepcopy(BiollanteRodan.settings)
+    settings["title"] = "Biollante Batch Settings"
+    # Only meaningful while interacting with the job.
+    for key in ("Profile Optimization", "Max. Estimated Hours",
+                "Max. Peak Memory (MB)", "Incremental Generations",
+                "Cache Neighbor Lists"):
+        settings["properties"].pop(key)
+    enabled = True
+    category = "Optimization"
+    interactive = False
+
+    input_port_types = [
+        {
+            # Each resource is optimized on its own.
+            "name": "kNN Training Data",
+            "minimum": 1,
+            "maximum": MAX_TRAINING_RESOURCES,
+            "resource_types": ["application/gamera+xml"]
+        },
+        {
+            # The "@base", "@selection", ... settings of a Biollante
+            # job, as knnga_util serializes them.
+            "name": "GA Configuration",
+            "minimum": 1,
+            "maximum": 1,
+            "resource_types": ["application/json"]
+        }
+    ]
+    output_port_types = [
+        {
+            # One per training resource, in the same order.
+            "name": "GA Optimized Classifier",
+            "minimum": 1,
+            "maximum": MAX_TRAINING_RESOURCES,
+            "resource_types": ["application/gamera+xml"]
+        }
+    ]
+
+    def run_my_task(self, inputs, settings, outputs):
+        self.profiler = profiling.PhaseProfiler(
+            self.logger, {"job": "batch"}
+        )
+        with open(inputs["GA Configuration"][0]["resource_path"]) as f:
+            config = json.load(f)
+        missing = [key for key in CONFIG_KEYS if key not in config]
+        assert not missing, "Configuration lacks %s" % ", ".join(missing)
+        self.load_from_settings(config)
+        # The job's settings with the GA configuration, as an
+        # interactive job has them while optimizing.
+        settings = dict(settings)
+        settings.update(config)
+
+        resources = inputs["kNN Training Data"]
+        paths = [r["resource_path"]
+                 for r in outputs["GA Optimized Classifier"]]
+        assert len(paths) == len(resources), \
+            "%d outputs for %d training resources" % (
+                len(paths), len(resources)
+            )
+
+        lease = scheduler.CoreLease(settings.get("Max. Threads", 4))
+        with self.profiler.phase("schedule"):
+            cores = lease.acquire()
+        self.logger.info(json.dumps(lease.status(), sort_keys=True))
+        # Aggregate throughput over latency: as many optimizations
+        # at once as there are cores, each with its share of them.
+        slots = scheduler.split_cores(len(resources), cores)
+        total = float(sum(slots))
+        lock = threading.Lock()
+
+        if settings.get("@seed") is None and \
+                settings.get("GA Engine") == "numpy":
+            # One seed for the batch, recorded to repeat it.
+            settings["@seed"] = ga_engine.random_seed()
+
+        def optimize(i):
+            with lock:
+                threads = slots.pop()
+            # Each resource draws from its own stream of the seed,
+            # whichever worker runs it and whenever.
+            resource_settings = dict(settings)
+            resource_settings["@stream"] = i
+            try:
+                return self.optimize_resource(
+                    {"kNN Training Data": [resources[i]]},
+                    resource_settings, paths[i], max(threads, 1),
+                    threads / total
+                )
+            finally:
+                with lock:
+                    slots.append(threads)
+
+        pool = ThreadPool(len(slots))
+        try:
+            with self.profiler.phase("optimize"):
+                pending = pool.map_async(optimize, range(len(resources)))
+                while not pending.ready():
+                    pending.wait(POLL_INTERVAL)
+                    # Leases without a heartbeat are taken for
+                    # abandoned by other jobs.
+                    lease.renew()
+                results = pending.get()
+        finally:
+            pool.close()
+            pool.join()
+            lease.release()
+        self.logger.info(json.dumps({
+            "resources": len(resources),
+            "cores": cores,
+            "workers": len(slots),
+            "seed": settings.get("@seed"),
+            "results": results
+        }, sort_keys=True))
+        return True
+
+    def test_my_task(self, testcase):
+        import bench_state_machine
+
+        global POLL_INTERVAL
+        # Don't wait long after the short test runs end.
+        poll_interval, POLL_INTERVAL = POLL_INTERVAL, 0.1
+        store = bench_state_machine.ResourceStore()
+        try:
+            inputs = {
+                "kNN Training Data": [store.resource("a.xml"),
+                                      store.resource("b.xml")],
+                "GA Configuration": [store.resource("config.json")]
+            }
+            outputs = {"GA Optimized Classifier": [
+                store.resource("a-out.xml"), store.resource("b-out.xml")
+            ]}
+            for seed, r in enumerate(inputs["kNN Training Data"]):
+                bench_state_machine.generate_training_data(
+                    r["resource_path"], 60, 4, seed=seed
+                )
+            self.profiler = profiling.PhaseProfiler()
+            self.setup_optimizer(
+                bench_state_machine.start_input(2, 10),
+                self.load_classifier(
+                    {"kNN Training Data": inputs["kNN Training Data"][:1]}
+                ).num_features
+            )
+            with open(inputs["GA Configuration"][0]["resource_path"],
+                      "w") as f:
+                json.dump(self.knnga_dict(), f)
+            settings = bench_state_machine.default_settings(type(self))
+            testcase.assertTrue(self.run_my_task(inputs, settings, outputs))
+            for r in outputs["GA Optimized Classifier"]:
+                with open(r["resource_path"]) as f:
+                    testcase.assertTrue(f.read())
+        finally:
+            POLL_INTERVAL = poll_interval
+            store.close()
+
+    def optimize_resource(self, inputs, settings, path, threads,
+                          share=1.0):
+        """
+        Optimize the classifier of one training resource on threads
+        cores and write its settings to path. share is the fraction
+        of the process's CPU time that is this optimization's.
+        """
+        start = time()
+        classifier = self.load_classifier(inputs)
+        settings = dict(settings)
+        settings["@settings"] = self.dump_settings(classifier)
+        numpy_engine = settings.get("GA Engine") == "numpy"
+        if numpy_engine:
+            matrix = self.training_matrix(
+                inputs, settings, self.feature_layout(classifier)
+            )
+        try:
+            stop_reason, optimizer = self.run_optimizer(
+                classifier, matrix if numpy_engine else None, settings,
+                threads, share
+            )
+        finally:
+            if numpy_engine:
+                matrix.close()
+        with open(path, "w") as f:
+            f.write(self.dump_settings(classifier))
+        return {
+            "resource": inputs["kNN Training Data"][0]["resource_path"],
+            "generation": optimizer.generation,
+            "bestFitness": optimizer.bestFitness,
+            "stopReason": stop_reason,
+            "threads": threads,
+            "seconds": time() - start
+        }
+
+    def run_optimizer(self, classifier, matrix, settings, threads,
+                      share=1.0):
+        """
+        Run the configured engine (the NumPy one if a training
+        matrix is given) until it stops or the budget is spent,
+        leaving the best solution in the classifier. The budget is
+        charged share of the process's CPU time. Returns the
+        budget's stop reason and the optimizer.
+        """
+        if matrix is not None:
+            parameters = ga_engine.ParameterGenes(
+                self.base.opMode,
+                settings.get("Max. k", 0),
+                settings.get("Optimize Distance", False)
+            )
+            fitness = self.fitness_function(
+                classifier, matrix, parameters, settings
+            )
+            optimizer = self.numpy_optimizer(
+                classifier, fitness, settings,
+                self.genome_threads(fitness, threads)
+            )
+        else:
+            # Operator objects of their own for each optimization.
+            optimizer = knnga.GAOptimization(
+                classifier,
+                util.json_to_base(settings["@base"]),
+                util.SerializableSelection.fromJSON(
+                    settings["@selection"]
+                ).selection,
+                util.SerializableCrossover.fromJSON(
+                    settings["@crossover"]
+                ).crossover,
+                util.SerializableMutation.fromJSON(
+                    settings["@mutation"]
+                ).mutation,
+                util.SerializableReplacement.fromJSON(
+                    settings["@replacement"]
+                ).replacement,
+                util.SerializableStopCriteria.fromJSON(
+                    settings["@stop_criteria"]
+                ).sc,
+                knnga.GAParallelization(True, threads)
+            )
+
+        start_cpu = profiling.cpu_seconds()
+        monitor = budget.BudgetMonitor(self.stop_criteria.methods)
+        stop_reason = None
+        optimizer.startCalculation()
+        while optimizer.status:
+            sleep(POLL_INTERVAL)
+            if stop_reason is None and monitor:
+                # CPU time is the whole batch's: charge this
+                # optimization its share of the cores.
+                stop_reason = monitor.update(
+                    optimizer.bestFitness,
+                    (profiling.cpu_seconds() - start_cpu) * share
+                )
+                if stop_reason is not None:
+                    optimizer.stopCalculation()
+
+        if matrix is not None:
+            if optimizer.error is not None:
+                raise optimizer.error
+            self.apply_genome(classifier, optimizer.best, parameters)
+        return stop_reason, optimizer
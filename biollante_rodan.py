@@ -4,13 +4,28 @@
 from __future__ import unicode_literals
 
 from celery.utils.log import get_task_logger
-from gamera import knn, knnga
+from gamera import gamera_xml, knn, knnga
 from rodan.jobs.base import RodanTask
 from tempfile import NamedTemporaryFile as NTF
 from time import sleep
 
+import budget
+import classifier_bundle
+import cost_estimate
+import cross_validation
+import feature_matrix
+import ga_engine
+import incremental
 import json
+import knn_fitness
 import knnga_util as util
+import numpy as np
+import optimization_report
+import profiling
+import progress
+import prototype_selection
+import scheduler
+import shared_store
 import shutil
 
 
@@ -18,6 +33,12 @@ STATE_INIT = 0
 STATE_NOT_OPTIMIZING = 1
 STATE_OPTIMIZING = 2
 STATE_FINISHING = 3
+STATE_CONDENSING = 4
+
+# Seconds between checks on a running optimization.
+POLL_INTERVAL = 30
+# Most training resources merged into one training set.
+MAX_TRAINING_RESOURCES = 100
 
 
 class BiollanteRodan(RodanTask):
@@ -25,7 +46,137 @@ class BiollanteRodan(RodanTask):
     author = "Juliette Regimbal"
     description = "GA Optimizer for kNN Classifiers"
     settings = {
-        "job_queue": "Python2"  # This is due to using gamera
+        "title": "Biollante Settings",
+        "type": "object",
+        "job_queue": "Python2",  # This is due to using gamera
+        "properties": {
+            "Memory Budget (MB)": {
+                "type": "integer",
+                "minimum": 0,
+                "default": feature_matrix.DEFAULT_MEMORY_BUDGET // 2 ** 20,
+                "description": "Training matrices larger than this are "
+                               "memory-mapped instead of held in RAM."
+            },
+            "Matrix Precision": {
+                "type": "string",
+                "enum": sorted(feature_matrix.PRECISIONS),
+                "default": feature_matrix.DEFAULT_PRECISION
+            },
+            "Max. Threads": {
+                "type": "integer",
+                "minimum": 1,
+                "default": 4,
+                "description": "Cores requested from the host's scheduler. "
+                               "Concurrent jobs share the host's cores."
+            },
+            "Max. Estimated Hours": {
+                "type": "number",
+                "minimum": 0,
+                "default": 0,
+                "description": "Optimizations estimated to take longer "
+                               "are rejected (0 for no limit)."
+            },
+            "Max. Peak Memory (MB)": {
+                "type": "integer",
+                "minimum": 0,
+                "default": 0,
+                "description": "Optimizations estimated to need more "
+                               "memory are rejected (0 for no limit)."
+            },
+            "Kernel Memory (MB)": {
+                "type": "integer",
+                "minimum": 1,
+                "default": knn_fitness.DEFAULT_MAX_BYTES // 2 ** 20,
+                "description": "NumPy engine only: memory each thread's "
+                               "neighbor search may use for distances."
+            },
+            "GA Engine": {
+                "type": "string",
+                "enum": ["gamera", "numpy"],
+                "default": "gamera",
+                "description": "gamera's knnga, or the NumPy engine "
+                               "operating on the whole population."
+            },
+            "Grouped Genome": {
+                "type": "boolean",
+                "default": False,
+                "description": "NumPy engine only: one gene per feature "
+                               "family instead of one per dimension."
+            },
+            "Refinement Generations": {
+                "type": "integer",
+                "minimum": 0,
+                "default": 0,
+                "description": "Grouped weighting only: generations of "
+                               "per-dimension refinement afterwards."
+            },
+            "Incremental Generations": {
+                "type": "integer",
+                "minimum": 1,
+                "default": 20,
+                "description": "NumPy engine only: most generations of "
+                               "an incremental run's refinement."
+            },
+            "Cache Neighbor Lists": {
+                "type": "boolean",
+                "default": False,
+                "description": "NumPy engine only: keep the optimized "
+                               "classifier's neighbor lists on this worker "
+                               "for a later incremental run (one more pass "
+                               "over the training data). Incremental runs "
+                               "always keep them."
+            },
+            "Max. k": {
+                "type": "integer",
+                "minimum": 0,
+                "default": 0,
+                "description": "NumPy engine only: also choose k from 1 "
+                               "to this value (0 keeps the classifier's)."
+            },
+            "Optimize Distance": {
+                "type": "boolean",
+                "default": False,
+                "description": "NumPy engine only: also choose the "
+                               "distance type."
+            },
+            "Deduplicate Glyphs": {
+                "type": "boolean",
+                "default": False,
+                "description": "NumPy engine and condensation: merge "
+                               "glyphs of the same class with (nearly) "
+                               "equal features, weighted by their count."
+            },
+            "Deduplication Resolution": {
+                "type": "number",
+                "minimum": 0,
+                "default": feature_matrix.DEFAULT_DEDUP_RESOLUTION,
+                "description": "Standard deviations within which features "
+                               "are equal (0 merges identical glyphs only)."
+            },
+            "Restart Diversity": {
+                "type": "number",
+                "minimum": 0,
+                "maximum": 1,
+                "default": 0,
+                "description": "NumPy engine only: restart when the mean "
+                               "distance between individuals per gene "
+                               "falls below this (0 never restarts)."
+            },
+            "Restart Strategy": {
+                "type": "string",
+                "enum": [ga_engine.RESTART_RESEED, ga_engine.RESTART_MUTATION],
+                "default": ga_engine.RESTART_RESEED,
+                "description": "Replace the worse half of the population "
+                               "with random genomes, or double the "
+                               "mutation rates until diversity recovers."
+            },
+            "Profile Optimization": {
+                "type": "boolean",
+                "default": False,
+                "description": "NumPy engine only: capture a cProfile "
+                               "of the optimization in the job's results."
+            }
+        }
     }
     enabled = True
     category = "Optimization"
@@ -37,14 +188,31 @@ class BiollanteRodan(RodanTask):
     mutation = None
     crossover = None
     stop_criteria = None
+    fitness = None
+    seed = None
     optimizer = None
+    profiler = None
 
     logger = get_task_logger(__name__)
 
     input_port_types = [
         {
+            # Several resources are merged, in order, into one set.
             "name": "kNN Training Data",
             "minimum": 1,
+            "maximum": MAX_TRAINING_RESOURCES,
+            "resource_types": ["application/gamera+xml"]
+        },
+        {
+            # Incremental runs start from a previous optimization.
+            "name": "Previous Optimized Classifier",
+            "minimum": 0,
+            "maximum": 1,
+            "resource_types": ["application/gamera+xml"]
+        },
+        {
+            "name": "Previous kNN Training Data",
+            "minimum": 0,
             "maximum": 1,
             "resource_types": ["application/gamera+xml"]
         }
@@ -55,6 +223,20 @@ class BiollanteRodan(RodanTask):
             "minimum": 1,
             "maximum": 1,
             "resource_types": ["application/gamera+xml"]
+        },
+        {
+            # For classification without gamera (see classifier_bundle).
+            "name": "Compact Classifier",
+            "minimum": 0,
+            "maximum": 1,
+            "resource_types": [classifier_bundle.RESOURCE_TYPE]
+        },
+        {
+            # The input and optimized classifiers compared.
+            "name": "Optimization Report",
+            "minimum": 0,
+            "maximum": 1,
+            "resource_types": ["application/json"]
         }
     ]
 
@@ -67,26 +249,85 @@ class BiollanteRodan(RodanTask):
             "mutation": json.loads(settings["@mutation"]),
             "crossover": json.loads(settings["@crossover"]),
             "stop_criteria": json.loads(settings["@stop_criteria"]),
-            "optimizer": settings["@results"]
+            "fitness": json.loads(settings.get("@fitness") or
+                                  cross_validation.SerializableFitness()
+                                  .toJSON()),
+            "optimizer": settings["@results"],
+            # Recorded in the results: the progress file is in the
+            # temporary directory of whichever worker optimized.
+            # None until the first optimization.
+            "progress": (settings["@results"] or {}).get("progress"),
+            "seed": settings.get("@seed"),
+            "condensation": settings.get("@condensation_results"),
+            "estimate": settings.get("@estimate")
         }
         return "index.html", context
 
     def validate_my_user_input(self, inputs, settings, user_input):
         assert settings["@state"] == STATE_NOT_OPTIMIZING, \
             "Must not be optimizing! State is %s" % str(settings["@state"])
+        self.profiler = profiling.PhaseProfiler(
+            self.logger, {"method": user_input["method"]}
+        )
 
         # Start the optimization process
         if user_input["method"] == "start":
             try:
-                self.setup_optimizer(user_input, settings["@num_features"])
+                with self.profiler.phase("setup_optimizer"):
+                    self.setup_optimizer(
+                        user_input,
+                        settings["@num_features"]
+                    )
             except Exception as e:
                 raise self.ManualPhaseException(str(e))
 
-            d = self.knnga_dict()
+            cost = self.estimate_cost(settings)
+            if cost["suggestion"] is not None:
+                raise self.ManualPhaseException(self.over_budget(cost))
+
+            with self.profiler.phase("serialize"):
+                d = self.knnga_dict()
             d["@state"] = STATE_OPTIMIZING
             d["@settings"] = settings["@settings"]
+            d["@estimate"] = cost
+            # The output is the optimized settings, not a reduced set.
+            d["@prototypes"] = None
+            d["@profile"] = self.profile(settings, "validate")
             return d
 
+        # Estimate the cost of a configuration without starting it.
+        elif user_input["method"] == "estimate":
+            try:
+                with self.profiler.phase("setup_optimizer"):
+                    self.setup_optimizer(
+                        user_input,
+                        settings["@num_features"]
+                    )
+            except Exception as e:
+                raise self.ManualPhaseException(str(e))
+
+            with self.profiler.phase("serialize"):
+                d = self.knnga_dict()
+            # Keep the results of any previous optimization.
+            del d["@results"]
+            d["@state"] = STATE_NOT_OPTIMIZING
+            d["@settings"] = settings["@settings"]
+            d["@estimate"] = self.estimate_cost(settings)
+            return d
+
+        # Reduce the training set to a subset of prototype glyphs.
+        elif user_input["method"] == "condense":
+            condensation = prototype_selection.SerializableCondensation \
+                .from_dict(user_input["condensation"])
+            if condensation.method is None:
+                raise self.ManualPhaseException("No condensation method")
+            return {
+                "@state": STATE_CONDENSING,
+                "@settings": settings["@settings"],
+                "@condensation": condensation.toJSON(),
+                "@profile": self.profile(settings, "validate")
+            }
+
         # Save the latest classifier version and finsh job.
         elif user_input["method"] == "finish":
             return {
@@ -101,27 +342,33 @@ class BiollanteRodan(RodanTask):
         if "@state" not in settings:
             settings["@state"] = STATE_INIT
 
+        self.profiler = profiling.PhaseProfiler(
+            self.logger, {"state": settings["@state"]}
+        )
+
         if settings["@state"] == STATE_INIT:
             self.logger.info("State: Init")
 
-            with NTF(suffix=".xml") as temp:
-                self.logger.info(temp.name)
-                # Gamera fails to load files without xml extension.
-                shutil.copy2(
-                    inputs["kNN Training Data"][0]["resource_path"],
-                    temp.name
-                )
-                classifier = knn.kNNNonInteractive(temp.name)
-
-            with NTF() as temp:
-                classifier.save_settings(temp.name)
-                temp.flush()
-                temp.seek(0)
-                settings["@settings"] = temp.read()
+            classifier = self.load_classifier(inputs)
+            if inputs.get("Previous Optimized Classifier"):
+                # Continue from the previous selections and weights.
+                with self.profiler.phase("load_previous"):
+                    with NTF(suffix=".xml") as temp:
+                        shutil.copy2(
+                            inputs["Previous Optimized Classifier"][0]
+                            ["resource_path"],
+                            temp.name
+                        )
+                        classifier.load_settings(temp.name)
+            with self.profiler.phase("save_settings"):
+                settings["@settings"] = self.dump_settings(classifier)
+            # Kept to report on the optimization at the end.
+            settings["@original_settings"] = settings["@settings"]
 
             # Preserve the number of features for certain kinds
             # of operations the GA optimizer might perform.
             settings["@num_features"] = classifier.num_features
+            settings["@num_glyphs"] = len(classifier.get_glyphs())
 
             self.base = knnga.GABaseSetting()
             self.selection = util.SerializableSelection()
@@ -129,6 +376,8 @@ class BiollanteRodan(RodanTask):
             self.mutation = util.SerializableMutation()
             self.crossover = util.SerializableCrossover()
             self.stop_criteria = util.SerializableStopCriteria()
+            self.fitness = cross_validation.SerializableFitness()
+            self.seed = None
 
             settings["@state"] = STATE_NOT_OPTIMIZING
 
@@ -136,85 +385,392 @@ class BiollanteRodan(RodanTask):
             self.logger.info("State: Not Optimizing")
 
             # Create set of parameters for template
-            d = self.knnga_dict()
+            with self.profiler.phase("serialize"):
+                if "@base" in settings:
+                    # Re-entered with the configuration of an estimate.
+                    self.load_from_settings(settings)
+                d = self.knnga_dict()
+            if "@results" in settings:
+                d["@results"] = settings["@results"]
             d["@state"] = STATE_NOT_OPTIMIZING
             d["@settings"] = settings["@settings"]
+            d["@profile"] = self.profile(settings, "init")
             return self.WAITING_FOR_INPUT(d)
 
         elif settings["@state"] == STATE_OPTIMIZING:
             self.logger.info("State: Optimizing")
-            self.load_from_settings(settings)
+            with self.profiler.phase("deserialize"):
+                self.load_from_settings(settings)
 
-            # Load data
-            with NTF(suffix=".xml") as temp:
-                shutil.copy2(
-                    inputs["kNN Training Data"][0]["resource_path"],
-                    temp.name
-                )
-                classifier = knn.kNNNonInteractive(temp.name)
+            # Wait for a fair share of the host's cores.
+            lease = scheduler.CoreLease(settings.get("Max. Threads", 4))
+            with self.profiler.phase("schedule"):
+                cores = lease.acquire()
+            self.logger.info(json.dumps(lease.status(), sort_keys=True))
 
-            # Load selection and weights
-            with NTF(suffix=".xml") as temp:
-                temp.write(settings["@settings"])
-                temp.flush()
-                classifier.load_settings(temp.name)
+            numpy_engine = settings.get("GA Engine") == "numpy"
+            # Shared with other jobs until closed.
+            matrix = None
+            try:
+                if numpy_engine:
+                    # Only the settings are needed; the training data
+                    # is shared through a FeatureMatrix.
+                    classifier = self.load_settings_classifier(settings)
+                    matrix = self.training_matrix(
+                        inputs, settings, self.feature_layout(classifier)
+                    )
+                    parameters = ga_engine.ParameterGenes(
+                        self.base.opMode,
+                        settings.get("Max. k", 0),
+                        settings.get("Optimize Distance", False)
+                    )
+                    with self.profiler.phase("fitness"):
+                        fitness = self.fitness_function(
+                            classifier, matrix, parameters, settings
+                        )
+                    self.optimizer = self.numpy_optimizer(
+                        classifier, fitness, settings,
+                        self.genome_threads(fitness, cores)
+                    )
+                    self.optimizer.profile = settings.get(
+                        "Profile Optimization", False
+                    )
+                    incremental_results = None
+                    if inputs.get("Previous Optimized Classifier"):
+                        with self.profiler.phase("warm_start"):
+                            incremental_results = self.warm_start(
+                                classifier, matrix, fitness, inputs, settings
+                            )
+                else:
+                    if settings.get("Grouped Genome", False) or \
+                            settings.get("Max. k", 0) or \
+                            settings.get("Optimize Distance", False) or \
+                            settings.get("Restart Diversity", 0):
+                        self.logger.warning(
+                            "Grouped genomes, parameter genes and restarts "
+                            "need the NumPy engine; ignored."
+                        )
+                    if self.seed is not None:
+                        self.logger.warning(
+                            "gamera's GA cannot be seeded; seed ignored."
+                        )
+                    if inputs.get("Previous Optimized Classifier"):
+                        self.logger.warning(
+                            "gamera's GA runs its full stop criteria; "
+                            "Incremental Generations ignored."
+                        )
+                    if settings.get("Profile Optimization", False):
+                        # Its threads run native code cProfile cannot see.
+                        self.logger.warning(
+                            "gamera's GA cannot be profiled; no cProfile "
+                            "captured."
+                        )
+                    if self.fitness.method != \
+                            cross_validation.FITNESS_LEAVE_ONE_OUT:
+                        self.logger.warning(
+                            "gamera scores leave-one-out; fitness method "
+                            "%s ignored." % self.fitness.method
+                        )
+                    # Load data with its selection and weights
+                    classifier = self.load_classifier(inputs, settings)
+                    self.optimizer = knnga.GAOptimization(
+                        classifier,
+                        self.base,
+                        self.selection.selection,
+                        self.crossover.crossover,
+                        self.mutation.mutation,
+                        self.replacement.replacement,
+                        self.stop_criteria.sc,
+                        knnga.GAParallelization(True, cores)
+                    )
 
-            self.optimizer = knnga.GAOptimization(
-                classifier,
-                self.base,
-                self.selection.selection,
-                self.crossover.crossover,
-                self.mutation.mutation,
-                self.replacement.replacement,
-                self.stop_criteria.sc,
-                knnga.GAParallelization(True, 4)
-            )
+                    assert isinstance(self.optimizer, knnga.GAOptimization), \
+                        "Optimizer is %s" % str(type(self.optimizer))
 
-            assert isinstance(self.optimizer, knnga.GAOptimization), \
-                "Optimizer is %s" % str(type(self.optimizer))
+                with self.profiler.phase("optimize"):
+                    try:
+                        self.optimizer.startCalculation()
+                    except Exception as e:
+                        self.logger.error(e)
+                        self.logger.error("Failed to start optimizing!")
+                        return False
 
-            try:
-                self.optimizer.startCalculation()
-            except Exception as e:
-                self.logger.error(e)
-                self.logger.error("Failed to start optimizing!")
-                return False
+                    # Wait for optimization to finish
+                    path = progress.create_progress_file()
+                    self.logger.info("Progress: %s" % path)
+                    tracker = progress.ProgressTracker(
+                        self.stop_criteria.methods,
+                        self.base.popSize,
+                        path
+                    )
+                    monitor = budget.BudgetMonitor(
+                        self.stop_criteria.methods,
+                        start_cpu=profiling.cpu_seconds()
+                    )
+                    stop_reason = None
+                    while self.optimizer.status:
+                        remaining = monitor.remaining()
+                        sleep(POLL_INTERVAL if remaining is None
+                              else min(POLL_INTERVAL, max(remaining, 1)))
+                        self.logger.info(self.optimizer.monitorString)
+                        # gamera's thread count is fixed once started, so
+                        # for it renewing only keeps the lease alive and
+                        # reports the current share.
+                        cores = lease.renew()
+                        if numpy_engine:
+                            self.optimizer.threads = self.genome_threads(
+                                fitness, cores
+                            )
+                        diversities = getattr(
+                            self.optimizer, "diversities", None
+                        )
+                        tracker.update(
+                            self.optimizer.generation,
+                            self.optimizer.bestFitness,
+                            getattr(self.optimizer, "evaluations", None),
+                            scheduling=lease.status(),
+                            diversity=diversities[-1] if diversities else None
+                        )
+                        if stop_reason is None and monitor:
+                            stop_reason = monitor.update(
+                                self.optimizer.bestFitness,
+                                profiling.cpu_seconds()
+                            )
+                            if stop_reason is not None:
+                                # The classifier keeps the best solution
+                                # found so far once the GA is stopped.
+                                self.logger.info(
+                                    "Budget exhausted: %s" % stop_reason
+                                )
+                                self.optimizer.stopCalculation()
+                    # Free the cores for other jobs as soon as possible.
+                    lease.release()
+                    tracker.update(
+                        self.optimizer.generation,
+                        self.optimizer.bestFitness,
+                        finished=True
+                    )
 
-            # Wait for optimization to finish
-            while self.optimizer.status:
-                sleep(30000)    # 30 seconds
-                self.logger.info(self.optimizer.monitorString)
+                if numpy_engine:
+                    if self.optimizer.error is not None:
+                        self.logger.error(self.optimizer.error)
+                        self.logger.error("Optimization failed!")
+                        return False
+                    self.apply_genome(
+                        classifier, self.optimizer.best, parameters
+                    )
+                    # Lets the next incremental run update these neighbor
+                    # lists instead of computing them from scratch.
+                    if settings.get("Cache Neighbor Lists", False) or \
+                            inputs.get("Previous Optimized Classifier"):
+                        with self.profiler.phase("cache_neighbors"):
+                            self.save_neighbors(
+                                matrix, fitness, self.optimizer.best,
+                                inputs, settings
+                            )
+            finally:
+                if self.optimizer is not None and self.optimizer.status:
+                    # Failed while it runs: it must not outlive the
+                    # training data.
+                    self.optimizer.stopCalculation()
+                lease.release()
+                if matrix is not None:
+                    matrix.close()
 
             # This is necessary since the classifier object isn't persistent
-            settings = self.knnga_dict()
+            previous = settings
+            with self.profiler.phase("serialize"):
+                settings = self.knnga_dict()
 
-            with NTF() as temp:
-                classifier.save_settings(temp.name)
-                temp.flush()
-                temp.seek(0)
-                settings["@settings"] = temp.read()
+            with self.profiler.phase("save_settings"):
+                settings["@settings"] = self.dump_settings(classifier)
 
             settings["@state"] = STATE_NOT_OPTIMIZING
+            settings["@results"]["progress"] = tracker.latest
+            settings["@results"]["stopReason"] = stop_reason
+            if numpy_engine and incremental_results is not None:
+                settings["@results"]["incremental"] = incremental_results
+            if numpy_engine:
+                # Repeats the run, with any number of threads.
+                settings["@results"]["seed"] = self.optimizer.seed
+                settings["@results"]["diversity"] = [
+                    round(d, 4) for d in self.optimizer.diversities
+                ]
+                settings["@results"]["restarts"] = self.optimizer.restarts
+            settings["@profile"] = self.profile(previous, "optimizing")
+            if getattr(self.optimizer, "profile_stats", None):
+                settings["@profile"]["cProfile"] = \
+                    self.optimizer.profile_stats
             return self.WAITING_FOR_INPUT(settings)
 
+        elif settings["@state"] == STATE_CONDENSING:
+            self.logger.info("State: Condensing")
+            self.load_from_settings(settings)
+            condensation = prototype_selection.SerializableCondensation \
+                .fromJSON(settings["@condensation"])
+
+            classifier = self.load_settings_classifier(settings)
+            with self.profiler.phase("matrix"):
+                matrix = self.training_matrix(
+                    inputs, settings, self.feature_layout(classifier)
+                )
+                matrix.normalize()
+            with self.profiler.phase("condense"):
+                keep, summary = prototype_selection.condense(
+                    matrix.features,
+                    matrix.labels,
+                    self.feature_weights(classifier),
+                    classifier.num_k,
+                    condensation,
+                    classifier.distance_type,
+                    self.kernel_bytes(settings)
+                )
+            if matrix.rows is not None:
+                # Prototypes index the glyphs, not deduplicated rows.
+                keep = matrix.rows[keep]
+            matrix.close()
+            self.logger.info(summary)
+
+            d = self.knnga_dict()
+            d["@results"] = settings.get("@results")
+            d["@state"] = STATE_NOT_OPTIMIZING
+            d["@settings"] = settings["@settings"]
+            d["@condensation"] = settings["@condensation"]
+            d["@prototypes"] = keep.tolist()
+            d["@condensation_results"] = summary
+            d["@profile"] = self.profile(settings, "condensing")
+            return self.WAITING_FOR_INPUT(d)
+
         else:   # Finish
             self.logger.info("State: Finishing")
-            with open(
-                outputs["GA Optimized Classifier"][0]["resource_path"], 'w'
-            ) as f:
-                f.write(settings["@settings"])
+            if outputs.get("Compact Classifier"):
+                with self.profiler.phase("write_bundle"):
+                    self.write_bundle(
+                        inputs, settings,
+                        outputs["Compact Classifier"][0]["resource_path"]
+                    )
+            if outputs.get("Optimization Report"):
+                with self.profiler.phase("write_report"):
+                    self.write_report(
+                        inputs, settings,
+                        outputs["Optimization Report"][0]["resource_path"]
+                    )
+            path = outputs["GA Optimized Classifier"][0]["resource_path"]
+            if settings.get("@prototypes") is not None:
+                # Write the reduced training set instead of the settings.
+                glyphs = self.load_classifier(inputs, settings).get_glyphs()
+                prototypes = [glyphs[i] for i in settings["@prototypes"]]
+                with self.profiler.phase("write_output"):
+                    gamera_xml.WriteXMLFile(
+                        glyphs=prototypes,
+                        with_features=True
+                    ).write_filename(path)
+                return True
+
+            with self.profiler.phase("write_output"):
+                with open(path, 'w') as f:
+                    f.write(settings["@settings"])
             return True
 
     def my_error_information(self, exc, traceback):
         raise NotImplementedError
 
     def test_my_task(self, testcase):
-        # inputs = {}
-        # outputs = {}
-        # self.run_my_task(inputs, {}, outputs)
-        # result = outputs['out'][0]['resource_path']
-        # testcase.assertEqual(result, 'what you expect it to test')
-        raise NotImplementedError
+        # Runs the job end to end the way bench_state_machine does.
+        import bench_state_machine
+
+        global POLL_INTERVAL
+        # Don't wait long after the short test run ends.
+        poll_interval, POLL_INTERVAL = POLL_INTERVAL, 0.1
+        store = bench_state_machine.ResourceStore()
+        try:
+            inputs = {"kNN Training Data": [store.resource("training.xml")]}
+            outputs = {
+                "GA Optimized Classifier": [store.resource("out.xml")],
+                "Compact Classifier": [store.resource("out.npz")],
+                "Optimization Report": [store.resource("report.json")]
+            }
+            bench_state_machine.generate_training_data(
+                inputs["kNN Training Data"][0]["resource_path"], 60, 4
+            )
+            # The interface renders before anything was optimized.
+            settings = bench_state_machine.default_settings(type(self))
+            settings.update(
+                self.run_my_task(inputs, dict(settings), outputs)
+                .settings_update
+            )
+            template, context = self.get_my_interface(inputs, settings)
+            testcase.assertIsNone(context["optimizer"])
+            testcase.assertIsNone(context["progress"])
+            transitions = bench_state_machine.drive(
+                lambda: self,
+                inputs,
+                bench_state_machine.default_settings(type(self)),
+                outputs,
+                bench_state_machine.start_input(2, 10)
+            )
+            testcase.assertEqual(transitions[-1]["to"], "FINISHING")
+            with open(outputs["GA Optimized Classifier"][0]
+                      ["resource_path"]) as f:
+                testcase.assertTrue(f.read())
+            bundle = classifier_bundle.ClassifierBundle.load(
+                outputs["Compact Classifier"][0]["resource_path"]
+            )
+            testcase.assertEqual(len(bundle), 60)
+            with open(outputs["Optimization Report"][0]
+                      ["resource_path"]) as f:
+                report = json.load(f)
+            testcase.assertEqual(report["glyphs"], 60)
+            testcase.assertEqual(len(report["before"]["confusion"]), 4)
+        finally:
+            POLL_INTERVAL = poll_interval
+            store.close()
+
+    def estimate_cost(self, settings):
+        """
+        Estimate the runtime and peak memory of the configured
+        optimization, with a cheaper configuration if it is over
+        the operator's budget.
+        """
+        base = json.loads(util.base_to_json(self.base))
+        with self.profiler.phase("estimate"):
+            cost = cost_estimate.estimate(
+                settings.get("@num_glyphs", 0),
+                settings["@num_features"],
+                base,
+                self.stop_criteria.methods,
+                settings.get("Max. Threads", 4),
+                cost_estimate.load_calibration(),
+                settings.get("GA Engine", "gamera"),
+                settings.get(
+                    "Matrix Precision", feature_matrix.DEFAULT_PRECISION
+                ),
+                kernel_bytes=self.kernel_bytes(settings),
+                fitness=self.fitness
+            )
+        cost["hours"] = None if cost["seconds"] is None \
+            else cost["seconds"] / 3600.0
+        cost["peakMB"] = cost["peakBytes"] / 2.0 ** 20
+        cost["suggestion"] = cost_estimate.suggest(
+            cost,
+            base,
+            settings.get("Max. Estimated Hours", 0) * 3600,
+            settings.get("Max. Peak Memory (MB)", 0) * 2 ** 20
+        )
+        self.logger.info(json.dumps(cost, sort_keys=True))
+        return cost
+
+    def over_budget(self, cost):
+        """
+        Explain why an optimization was rejected and what to try.
+        """
+        runtime = "an unbounded runtime" if cost["hours"] is None \
+            else "%.1f hours" % cost["hours"]
+        advice = ", ".join(
+            "%s = %s" % (k, v) for k, v in sorted(cost["suggestion"].items())
+        )
+        return "Estimated %s and %d MB of memory exceed the budget. " \
+            "Try %s." % (runtime, cost["peakMB"], advice)
 
     def knnga_dict(self):
         """
@@ -228,12 +784,443 @@ class BiollanteRodan(RodanTask):
             "@mutation": self.mutation.toJSON(),
             "@crossover": self.crossover.toJSON(),
             "@stop_criteria": self.stop_criteria.toJSON(),
+            "@fitness": self.fitness.toJSON(),
+            "@seed": self.seed,
             "@results": None if self.optimizer is None else {
                 "generation": self.optimizer.generation,
                 "bestFitness": self.optimizer.bestFitness,
             }
         }
 
+    def training_paths(self, inputs):
+        """
+        Paths of the training resources, in the order they are merged.
+        """
+        return [r["resource_path"] for r in inputs["kNN Training Data"]]
+
+    def load_classifier(self, inputs, settings=None):
+        """
+        Load the training data, merging all training resources, with
+        the selections and weights stored in the job's settings if
+        they are given.
+        """
+        classifier = None
+        for path in self.training_paths(inputs):
+            with NTF(suffix=".xml") as temp:
+                # Gamera fails to load files without xml extension.
+                with self.profiler.phase("copy"):
+                    shutil.copy2(path, temp.name)
+                with self.profiler.phase("parse"):
+                    if classifier is None:
+                        classifier = knn.kNNNonInteractive(temp.name)
+                    else:
+                        classifier.merge_from_xml_filename(temp.name)
+
+        if settings is not None:
+            with self.profiler.phase("load_settings"):
+                with NTF(suffix=".xml") as temp:
+                    temp.write(settings["@settings"])
+                    temp.flush()
+                    classifier.load_settings(temp.name)
+        return classifier
+
+    def dump_settings(self, classifier):
+        """
+        Return the classifier's settings XML.
+        """
+        with NTF() as temp:
+            classifier.save_settings(temp.name)
+            temp.flush()
+            temp.seek(0)
+            return temp.read()
+
+    def profile(self, settings, name):
+        """
+        Return the job's phase breakdown with the phases
+        recorded by the current profiler stored under name.
+        """
+        profile = dict(settings.get("@profile") or {})
+        profile[name] = self.profiler.summary()
+        return profile
+
+    def load_settings_classifier(self, settings, key="@settings"):
+        """
+        Load the stored selections and weights (those under key)
+        into a classifier without any training data.
+        """
+        classifier = knn.kNNNonInteractive()
+        with self.profiler.phase("load_settings"):
+            with NTF(suffix=".xml") as temp:
+                temp.write(settings[key])
+                temp.flush()
+                classifier.load_settings(temp.name)
+        return classifier
+
+    def feature_layout(self, classifier):
+        """
+        (name, length) of each feature, in the classifier's order.
+        """
+        weights = classifier.get_weights_by_features()
+        return [
+            (name, len(weights[name]))
+            for name, function in classifier.feature_functions[0]
+        ]
+
+    def feature_values(self, classifier):
+        """
+        The weights and selections of every feature, in the
+        classifier's feature order.
+        """
+        order = [name for name, function in classifier.feature_functions[0]]
+        weights = classifier.get_weights_by_features()
+        selections = classifier.get_selections_by_features()
+        return np.concatenate(
+            [np.asarray(weights[name], dtype=np.float64) for name in order]
+        ), np.concatenate(
+            [np.asarray(selections[name], dtype=np.float64) for name in order]
+        )
+
+    def feature_weights(self, classifier):
+        """
+        Effective weight of every feature: its weight if it is
+        selected, and zero otherwise.
+        """
+        weights, selections = self.feature_values(classifier)
+        return weights * selections
+
+    def numpy_optimizer(self, classifier, fitness, settings, cores):
+        """
+        Set up the NumPy engine, with one gene per feature family
+        if the genome is grouped and the fitness' parameter genes
+        after the feature genes. Ungrouped selections are packed.
+        """
+        num_genes = fitness.features.shape[1] + len(fitness.parameters)
+        config = ga_engine.GAConfig.from_settings(settings)
+        if not settings.get("Grouped Genome", False):
+            # Selections are stored as bits, 64 to a word.
+            engine = ga_engine.PackedGAOptimization \
+                if self.base.opMode == ga_engine.OPMODE_SELECTION \
+                else ga_engine.NumpyGAOptimization
+            return engine(fitness, num_genes, config, cores)
+        groups = ga_engine.FeatureGroups(
+            self.feature_layout(classifier), len(fitness.parameters)
+        )
+        self.logger.info("Grouped genome: %d genes for %d features" % (
+            len(groups), groups.num_features
+        ))
+        return ga_engine.GroupedGAOptimization(
+            fitness, groups, config, cores,
+            refine_generations=settings.get("Refinement Generations", 0)
+        )
+
+    def kernel_bytes(self, settings):
+        """
+        Memory the distance kernels may use at once, in bytes.
+        """
+        return settings.get(
+            "Kernel Memory (MB)", knn_fitness.DEFAULT_MAX_BYTES // 2 ** 20
+        ) * 2 ** 20
+
+    def fitness_function(self, classifier, matrix, parameters, settings):
+        """
+        The NumPy engine's fitness for the configured method. The
+        splits of cross-validation are drawn once per run.
+        """
+        weights, selections = self.feature_values(classifier)
+        max_bytes = self.kernel_bytes(settings)
+        splits = cross_validation.splits(self.fitness, matrix.labels)
+        if splits is None:
+            return ga_engine.LeaveOneOutFitness(
+                matrix.features, matrix.labels, classifier.num_k,
+                classifier.distance_type, self.base.opMode, weights,
+                selections, parameters, max_bytes, matrix.counts
+            )
+        self.logger.info("Fitness: %s over %d splits" % (
+            self.fitness.method, len(splits)
+        ))
+        return ga_engine.CrossValidationFitness(
+            matrix.features, matrix.labels, classifier.num_k,
+            classifier.distance_type, self.base.opMode, splits, weights,
+            selections, parameters, max_bytes, counts=matrix.counts
+        )
+
+    def genome_threads(self, fitness, cores):
+        """
+        Threads evaluating genomes. Cross-validation runs its splits
+        on the rest of the cores, so both together use about cores.
+        """
+        cores = max(cores, 1)
+        if not isinstance(fitness, ga_engine.CrossValidationFitness):
+            return cores
+        fitness.threads = min(cores, len(fitness.splits))
+        return max(cores // fitness.threads, 1)
+
+    def warm_start(self, classifier, matrix, fitness, inputs, settings):
+        """
+        Seed the NumPy engine with the previous classifier's genome
+        and cap its run at the incremental budget. If the neighbor
+        lists of the previous training data are cached, they are
+        updated for the glyphs that changed to score the seed.
+        """
+        weights, selections = self.feature_values(classifier)
+        genome = np.concatenate([
+            selections if self.base.opMode == ga_engine.OPMODE_SELECTION
+            else weights,
+            fitness.parameters.encode({
+                "k": classifier.num_k,
+                "distance": classifier.distance_type
+            })
+        ])
+        self.optimizer.config.stop_criteria.append({
+            "method": "maxGenerations",
+            "parameters": {"n": settings.get("Incremental Generations", 20)}
+        })
+
+        groups = getattr(self.optimizer, "groups", None)
+        results = {"cached": False}
+        if groups is not None:
+            genome = groups.collapse(genome)
+            if self.base.opMode == ga_engine.OPMODE_SELECTION:
+                genome = np.round(genome)
+            self.optimizer.warm_start(genome)
+            return results
+        # Cached neighbor lists only score leave-one-out of glyphs.
+        if not inputs.get("Previous kNN Training Data") or \
+                matrix.counts is not None or \
+                self.fitness.method != cross_validation.FITNESS_LEAVE_ONE_OUT:
+            self.optimizer.warm_start(genome)
+            return results
+
+        layout = self.feature_layout(classifier)
+        precision = settings.get(
+            "Matrix Precision", feature_matrix.DEFAULT_PRECISION
+        )
+        cache = incremental.NeighborCache().load(shared_store.content_key(
+            inputs["Previous kNN Training Data"][0]["resource_path"],
+            layout, precision
+        ))
+        w = fitness.weights(genome)
+        k, distance_type = fitness.decode(genome)
+        max_k = max(fitness.k, fitness.parameters.max_k)
+        if not incremental.NeighborCache.usable(
+            cache, w, distance_type, max_k, matrix.mean, matrix.std
+        ):
+            self.logger.info("No usable cached neighbor lists")
+            self.optimizer.warm_start(genome)
+            return results
+
+        keys = incremental.glyph_keys(self.training_paths(inputs), layout)
+        nearest, dist, results = incremental.NeighborCache.update(
+            cache, keys, matrix.features, w, max_k, distance_type,
+            self.kernel_bytes(settings)
+        )
+        results["cached"] = True
+        results["seedFitness"] = knn_fitness.leave_one_out_accuracies(
+            matrix.labels, nearest, [k]
+        )[0]
+        self.logger.info(json.dumps(results, sort_keys=True))
+        self.optimizer.warm_start(genome, results["seedFitness"])
+        return results
+
+    def save_neighbors(self, matrix, fitness, genome, inputs, settings):
+        """
+        Cache the neighbor lists of the training data under
+        the optimized genome for a later incremental run.
+        """
+        if matrix.counts is not None:
+            # The lists of deduplicated rows are not those of glyphs.
+            return
+        path = self.training_paths(inputs)
+        layout = matrix.layout
+        precision = settings.get(
+            "Matrix Precision", feature_matrix.DEFAULT_PRECISION
+        )
+        w = fitness.weights(genome)
+        k, distance_type = fitness.decode(genome)
+        nearest, dist = incremental.neighbor_lists(
+            matrix.features, w, max(fitness.k, fitness.parameters.max_k),
+            distance_type, max_bytes=self.kernel_bytes(settings)
+        )
+        incremental.NeighborCache().save(
+            shared_store.content_key(path, layout, precision),
+            incremental.glyph_keys(path, layout),
+            nearest, dist, w, distance_type, matrix.mean, matrix.std
+        )
+
+    def apply_genome(self, classifier, genome, parameters):
+        """
+        Store the NumPy engine's best genome in the classifier as
+        its selections or weights, depending on the operation mode,
+        and the k and distance type chosen by its parameter genes.
+        """
+        values = {}
+        start = 0
+        for name, length in self.feature_layout(classifier):
+            values[name] = genome[start:start + length]
+            start += length
+
+        if self.base.opMode == ga_engine.OPMODE_SELECTION:
+            classifier.set_selections_by_features(dict(
+                (name, [int(v > 0.5) for v in part])
+                for name, part in values.items()
+            ))
+        else:
+            classifier.set_weights_by_features(dict(
+                (name, part.tolist()) for name, part in values.items()
+            ))
+
+        # Saved with the rest of the settings by dump_settings.
+        chosen = parameters.decode(genome[start:])
+        if "k" in chosen:
+            classifier.num_k = chosen["k"]
+        if "distance" in chosen:
+            classifier.distance_type = chosen["distance"]
+        if chosen:
+            self.logger.info("Chosen parameters: %s" % json.dumps(chosen))
+
+    def training_matrix(self, inputs, settings, layout):
+        """
+        Attach to the host's shared, normalized copy of the training
+        data, building it if no other job has. It is kept in shared
+        memory, or memory-mapped from disk if it does not fit in the
+        configured memory budget. All training resources are streamed
+        into it, deduplicated if configured. Close it when done.
+        """
+        path = self.training_paths(inputs)
+        count, file_layout = feature_matrix.scan_xml(path)
+        num_features = sum(length for name, length in layout)
+        budget = settings.get(
+            "Memory Budget (MB)",
+            feature_matrix.DEFAULT_MEMORY_BUDGET // 2 ** 20
+        ) * 2 ** 20
+        precision = settings.get(
+            "Matrix Precision",
+            feature_matrix.DEFAULT_PRECISION
+        )
+        mode = feature_matrix.choose_mode(
+            count, num_features, budget, precision
+        )
+        store = shared_store.SharedMatrixStore(
+            shared_store.SHM_DIRECTORY if mode == feature_matrix.MODE_RAM
+            else shared_store.DISK_DIRECTORY
+        )
+        dedup = None
+        if settings.get("Deduplicate Glyphs", False):
+            dedup = {"resolution": settings.get(
+                "Deduplication Resolution",
+                feature_matrix.DEFAULT_DEDUP_RESOLUTION
+            )}
+        key = shared_store.content_key(path, layout, precision, dedup)
+        self.logger.info(json.dumps({
+            "resources": len(path),
+            "glyphs": count,
+            "features": num_features,
+            "precision": precision,
+            "bytes": feature_matrix.estimate_bytes(
+                count, num_features, precision
+            ),
+            "budget": budget,
+            "mode": mode,
+            "store": store.directory,
+            "key": key
+        }))
+
+        def build():
+            if set(layout) <= set(file_layout):
+                matrix = feature_matrix.FeatureMatrix.from_xml(
+                    path, layout, count, precision,
+                    feature_matrix.MODE_MMAP, store.directory
+                )
+            else:
+                # Some features must be generated by gamera from
+                # the images.
+                glyphs = self.load_classifier(inputs, settings).get_glyphs()
+                matrix = feature_matrix.FeatureMatrix.from_glyphs(
+                    glyphs, layout, precision,
+                    feature_matrix.MODE_MMAP, store.directory
+                )
+            if dedup is None:
+                return matrix
+            with self.profiler.phase("deduplicate"):
+                deduplicated = feature_matrix.deduplicate(
+                    matrix, dedup["resolution"],
+                    feature_matrix.MODE_MMAP, store.directory
+                )
+            matrix.close()
+            self.logger.info("Deduplicated %d glyphs to %d rows" % (
+                count, len(deduplicated)
+            ))
+            return deduplicated
+
+        return store.attach(key, build)
+
+    def write_bundle(self, inputs, settings, path):
+        """
+        Write the optimized classifier as a compact bundle: the
+        training glyphs (the prototypes if the set was condensed)
+        under the stored selections, weights, k and distance.
+        """
+        classifier = self.load_settings_classifier(settings)
+        matrix = self.training_matrix(
+            inputs, settings, self.feature_layout(classifier)
+        )
+        try:
+            matrix.normalize()
+            rows = None
+            if settings.get("@prototypes") is not None:
+                rows = np.asarray(settings["@prototypes"], dtype=np.int64)
+                if matrix.rows is not None:
+                    # Prototypes index the glyphs, not deduplicated rows.
+                    rows = np.flatnonzero(np.isin(matrix.rows, rows))
+            bundle = classifier_bundle.ClassifierBundle.from_matrix(
+                matrix, self.feature_weights(classifier), classifier.num_k,
+                classifier.distance_type, rows
+            )
+        finally:
+            matrix.close()
+        bundle.save(path)
+        self.logger.info("Compact classifier: %d rows, %d of %d features" % (
+            len(bundle), len(bundle.active), bundle.num_features
+        ))
+
+    def write_report(self, inputs, settings, path):
+        """
+        Write a JSON report comparing the classifier loaded at
+        STATE_INIT with the optimized one on the training data:
+        leave-one-out accuracy, per-class confusion, active
+        features and batch classification throughput.
+        """
+        classifiers = [
+            self.load_settings_classifier(settings, key)
+            for key in ["@original_settings", "@settings"]
+            # Jobs started before the original settings were kept
+            # compare the optimized classifier with itself.
+            if key in settings
+        ]
+        classifier = classifiers[-1]
+        max_bytes = self.kernel_bytes(settings)
+        matrix = self.training_matrix(
+            inputs, settings, self.feature_layout(classifier)
+        )
+        try:
+            matrix.normalize()
+            before, after = [
+                (self.feature_weights(c), c.num_k, c.distance_type)
+                for c in (classifiers[0], classifier)
+            ]
+            report = optimization_report.compare(
+                matrix, before, after, max_bytes
+            )
+        finally:
+            matrix.close()
+        report["results"] = settings.get("@results")
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        self.logger.info("Accuracy %.4f -> %.4f, %.1fx throughput" % (
+            report["before"]["accuracy"], report["after"]["accuracy"],
+            report["speedup"]
+        ))
+
     def load_from_settings(self, settings):
         self.base = util.json_to_base(settings["@base"])
         self.selection = util.SerializableSelection.fromJSON(
@@ -251,6 +1238,13 @@ class BiollanteRodan(RodanTask):
         self.stop_criteria = util.SerializableStopCriteria.fromJSON(
             settings["@stop_criteria"]
         )
+        # Settings saved before fitness methods were configurable
+        # score leave-one-out.
+        self.fitness = cross_validation.SerializableFitness.fromJSON(
+            settings["@fitness"]
+        ) if "@fitness" in settings \
+            else cross_validation.SerializableFitness()
+        self.seed = settings.get("@seed")
 
     def setup_optimizer(self, options, num_features):
         """
@@ -275,13 +1269,23 @@ class BiollanteRodan(RodanTask):
         stop_criteria = util.SerializableStopCriteria.from_dict(
             options["stop_criteria"]
         )
+        fitness = cross_validation.SerializableFitness.from_dict(
+            options.get("fitness", {
+                "method": cross_validation.FITNESS_LEAVE_ONE_OUT
+            })
+        )
+        # Entered with the base settings; None draws a seed.
+        seed = options["base"].get("seed")
+        seed = None if seed in (None, "") else int(seed)
 
         assert selection.method is not None, "No selection method"
         assert replacement.method is not None, "No replacement method"
         assert len(mutation.methods) > 0, "No mutation methods"
         assert len(crossover.methods) > 0, "No crossover methods"
         assert len(stop_criteria.methods) > 0, "No stop criteria"
+        assert seed is None or seed >= 0, "Seed must not be negative"
 
         self.base, self.selection, self.replacement, self.mutation, \
-            self.crossover, self.stop_criteria = base, selection,   \
-            replacement, mutation, crossover, stop_criteria
+            self.crossover, self.stop_criteria, self.fitness, self.seed = \
+            base, selection, replacement, mutation, crossover, \
+            stop_criteria, fitness, seed
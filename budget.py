@@ -0,0 +1,90 @@
+# Copyright (C) 2020 Juliette Regimbal
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import division, unicode_literals
+
+import time
+
+
+# Stop criteria enforced by BudgetMonitor rather than by the GA.
+BUDGET_METHODS = ("maxWallClock", "deadline", "improvementRate")
+
+
+class BudgetMonitor(object):
+    """
+    Check the wall-clock and throughput stop criteria of a
+    serialized stop criteria list against a running optimization.
+    """
+
+    def __init__(self, stop_criteria, start=None, start_cpu=0.0):
+        self.criteria = dict(
+            (c["method"], c["parameters"]) for c in stop_criteria
+            if c["method"] in BUDGET_METHODS
+        )
+        if "improvementRate" in self.criteria:
+            p = self.criteria["improvementRate"]
+            if p["rate"] <= 0:
+                raise ValueError(
+                    "Improvement rate must be positive: %r" % p["rate"]
+                )
+            if p["window"] <= 0:
+                raise ValueError(
+                    "Rate window must be positive: %r" % p["window"]
+                )
+        self.start = time.time() if start is None else start
+        self.start_cpu = start_cpu
+        # (CPU minutes, best fitness) samples for the improvement rate.
+        self.history = []
+
+    def __bool__(self):
+        return len(self.criteria) > 0
+
+    __nonzero__ = __bool__
+
+    def update(self, best_fitness, cpu_seconds, now=None):
+        """
+        Record a sample. Returns the name of the exhausted
+        criterion, or None if the optimization may continue.
+        """
+        now = time.time() if now is None else now
+        cpu_minutes = (cpu_seconds - self.start_cpu) / 60.0
+        self.history.append((cpu_minutes, best_fitness))
+
+        if "maxWallClock" in self.criteria:
+            limit = self.criteria["maxWallClock"]["seconds"]
+            if now - self.start >= limit:
+                return "maxWallClock"
+
+        if "deadline" in self.criteria:
+            if now >= self.criteria["deadline"]["timestamp"]:
+                return "deadline"
+
+        if "improvementRate" in self.criteria:
+            p = self.criteria["improvementRate"]
+            window_start = cpu_minutes - p["window"]
+            if window_start >= 0:
+                # Fitness at the latest sample at least a window ago.
+                past = [i for i, (m, f) in enumerate(self.history)
+                        if m <= window_start]
+                if past:
+                    # Older samples are no longer needed.
+                    del self.history[:past[-1]]
+                    then, fitness = self.history[0]
+                    rate = (best_fitness - fitness) / (cpu_minutes - then)
+                    if rate < p["rate"]:
+                        return "improvementRate"
+        return None
+
+    def remaining(self, now=None):
+        """
+        Seconds left before a time limit is reached, if any.
+        """
+        now = time.time() if now is None else now
+        limits = []
+        if "maxWallClock" in self.criteria:
+            limits.append(
+                self.start + self.criteria["maxWallClock"]["seconds"]
+            )
+        if "deadline" in self.criteria:
+            limits.append(self.criteria["deadline"]["timestamp"])
+        return max(min(limits) - now, 0.0) if limits else None
@@ -0,0 +1,169 @@
+# Copyright (C) 2020 Juliette Regimbal
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+A compact form of an optimized classifier for downstream
+classification without gamera: the training matrix restricted to
+the selected features and pre-scaled by their weights, so that the
+classifier's weighted distance is a plain distance between rows,
+the labels and k. Feature vectors in the classifier's layout are
+normalized and scaled the same way before they are classified.
+Rows of a deduplicated matrix keep their counts and vote as the
+glyphs they stand for, as they did in the optimization.
+"""
+
+from __future__ import division, unicode_literals
+
+import feature_matrix
+import json
+import knn_fitness
+import numpy as np
+
+
+BUNDLE_VERSION = 2
+# Versions load can read (version 1 bundles have no counts).
+READABLE_VERSIONS = (1, 2)
+RESOURCE_TYPE = "application/octet-stream"
+
+
+class ClassifierBundle(object):
+    """
+    Pre-scaled float32 training rows (one column per active
+    feature) with integer labels, and the affine map (scale and
+    offset of the active columns) taking raw feature vectors to
+    the same space. counts, if given, are the glyphs each row
+    stands for.
+    """
+
+    def __init__(self, features, labels, class_names, layout, active,
+                 scale, offset, k, distance_type, counts=None):
+        self.features = features
+        self.labels = labels
+        self.counts = counts
+        self.class_names = list(class_names)
+        self.layout = list(layout)
+        self.active = active
+        self.scale = scale
+        self.offset = offset
+        self.k = k
+        self.distance_type = distance_type
+
+    def __len__(self):
+        return self.features.shape[0]
+
+    @property
+    def num_features(self):
+        return sum(length for name, length in self.layout)
+
+    @staticmethod
+    def from_matrix(matrix, weights, k, distance_type, rows=None):
+        """
+        Bundle the rows (all by default) of a normalized
+        FeatureMatrix under the classifier's effective weights.
+        """
+        active = np.flatnonzero(weights)
+        w = np.asarray(weights, dtype=np.float64)[active]
+        # Scaled rows give the weighted distance: w |x - y| for city
+        # block, w (x - y)^2 under euclidean distances.
+        w = w if distance_type == knn_fitness.DISTANCE_CITY_BLOCK \
+            else np.sqrt(w)
+        rows = np.arange(len(matrix)) if rows is None else np.asarray(rows)
+        features = np.empty((len(rows), len(active)), dtype=np.float32)
+        for start in range(0, len(rows), feature_matrix.CHUNK_ROWS):
+            chunk = rows[start:start + feature_matrix.CHUNK_ROWS]
+            features[start:start + len(chunk)] = \
+                matrix.features[chunk][:, active] * w
+        scale = w / matrix.std[active]
+        return ClassifierBundle(
+            features,
+            matrix.labels[rows].astype(np.int32),
+            matrix.class_names,
+            matrix.layout,
+            active,
+            scale.astype(np.float32),
+            (matrix.mean[active] * scale).astype(np.float32),
+            int(k),
+            int(distance_type),
+            None if matrix.counts is None
+            else matrix.counts[rows].astype(np.uint32)
+        )
+
+    def transform(self, queries):
+        """
+        Map raw feature vectors (rows in the bundle's layout)
+        into the space of the training rows.
+        """
+        queries = np.asarray(queries)
+        assert queries.shape[1] == self.num_features, \
+            "Expected %d features, got %d" % (
+                self.num_features, queries.shape[1]
+            )
+        q = queries[:, self.active].astype(np.float32)
+        q *= self.scale
+        q -= self.offset
+        return q
+
+    def predict(self, queries, max_bytes=knn_fitness.DEFAULT_MAX_BYTES):
+        """
+        Class index of every raw feature vector.
+        """
+        q = self.transform(queries)
+        k = min(self.k, len(self))
+        # Distances are only ranked, so euclidean needs no roots.
+        distance_type = knn_fitness.DISTANCE_CITY_BLOCK \
+            if self.distance_type == knn_fitness.DISTANCE_CITY_BLOCK \
+            else knn_fitness.DISTANCE_FAST_EUCLIDEAN
+        nearest = knn_fitness.nearest_neighbors(
+            q, self.features, np.ones(len(self.active), dtype=np.float32),
+            k, distance_type, max_bytes=max_bytes
+        )
+        if self.counts is None:
+            return knn_fitness.vote(
+                self.labels[nearest], len(self.class_names)
+            )
+        return knn_fitness.weighted_vote(
+            self.labels[nearest], self.counts[nearest].astype(np.int64),
+            len(self.class_names), self.k
+        )
+
+    def classify(self, queries, max_bytes=knn_fitness.DEFAULT_MAX_BYTES):
+        """
+        Class name of every raw feature vector.
+        """
+        return [self.class_names[i] for i in self.predict(queries, max_bytes)]
+
+    def save(self, path):
+        """
+        Write the bundle as an uncompressed .npz archive (to path
+        exactly, whatever its extension).
+        """
+        meta = {
+            "version": BUNDLE_VERSION,
+            "classNames": self.class_names,
+            "layout": self.layout,
+            "k": self.k,
+            "distanceType": self.distance_type
+        }
+        arrays = {} if self.counts is None else {"counts": self.counts}
+        with open(path, "wb") as f:
+            np.savez(
+                f, features=self.features, labels=self.labels,
+                active=self.active, scale=self.scale, offset=self.offset,
+                meta=np.frombuffer(
+                    json.dumps(meta).encode("utf-8"), dtype=np.uint8
+                ),
+                **arrays
+            )
+
+    @staticmethod
+    def load(path):
+        with np.load(path) as f:
+            meta = json.loads(f["meta"].tobytes().decode("utf-8"))
+            assert meta["version"] in READABLE_VERSIONS, \
+                "Unsupported bundle version %s" % meta["version"]
+            return ClassifierBundle(
+                f["features"], f["labels"], meta["classNames"],
+                [tuple(x) for x in meta["layout"]], f["active"],
+                f["scale"], f["offset"], meta["k"], meta["distanceType"],
+                f["counts"] if "counts" in f.files else None
+            )
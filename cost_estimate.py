@@ -0,0 +1,198 @@
+# Copyright (C) 2020 Juliette Regimbal
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import division, unicode_literals
+
+from tempfile import gettempdir
+
+import cross_validation
+import feature_matrix
+import json
+import knn_fitness
+import numpy as np
+import os
+import time
+
+
+# The host's calibration is measured once and kept for a day.
+CALIBRATION_PATH = os.path.join(gettempdir(), "biollante-calibration.json")
+CALIBRATION_TTL = 24 * 3600
+CALIBRATION_GLYPHS = 400
+CALIBRATION_FEATURES = 32
+CALIBRATION_REPEATS = 3
+
+# Bytes per pair of glyphs held by one leave-one-out evaluation:
+# float32 distances, a float32 temporary and int64 partition indices.
+# The neighbor search caps this at its memory limit.
+PAIR_BYTES = 16
+# gamera holds its training data as doubles.
+GAMERA_FEATURE_BYTES = 8
+
+
+def _time_evaluation(features, labels, repeats):
+    w = np.ones(features.shape[1])
+    best = None
+    for _ in range(repeats):
+        start = time.time()
+        knn_fitness.leave_one_out_accuracy(
+            features, labels, w, 1, knn_fitness.DISTANCE_EUCLIDEAN
+        )
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def calibrate(glyphs=CALIBRATION_GLYPHS, features=CALIBRATION_FEATURES,
+              repeats=CALIBRATION_REPEATS):
+    """
+    Time leave-one-out evaluations on synthetic data to fit
+    seconds = glyphs^2 * (pairFeature * features + pair).
+    """
+    rng = np.random.RandomState(0)
+    data = rng.normal(size=(glyphs, features)).astype(np.float32)
+    labels = rng.randint(0, 10, glyphs)
+    wide = _time_evaluation(data, labels, repeats)
+    narrow = _time_evaluation(data[:, :1], labels, repeats)
+    pairs = glyphs * glyphs
+    pair_feature = max(wide - narrow, 0.0) / (pairs * (features - 1))
+    return {
+        "time": time.time(),
+        "pairFeature": pair_feature,
+        "pair": max(narrow / pairs - pair_feature, 0.0),
+    }
+
+
+def load_calibration(path=CALIBRATION_PATH, now=None):
+    """
+    The host's calibration, measured again if it is missing
+    or older than CALIBRATION_TTL.
+    """
+    now = time.time() if now is None else now
+    try:
+        with open(path) as f:
+            calibration = json.load(f)
+        if now - calibration["time"] < CALIBRATION_TTL:
+            return calibration
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+    calibration = calibrate()
+    with open(path, "w") as f:
+        json.dump(calibration, f)
+    return calibration
+
+
+def evaluation_bound(base, stop_criteria):
+    """
+    Most fitness evaluations before a stop criterion is met, and
+    whether that number is certain (steady state only gives the
+    earliest stop). None if no criterion bounds the run.
+    """
+    bounds = []
+    for criterion in stop_criteria:
+        m = criterion["method"]
+        p = criterion["parameters"]
+        if m == "maxFitnessEvals":
+            bounds.append((p["n"], True))
+        elif m == "maxGenerations":
+            bounds.append((base["popSize"] * (p["n"] + 1), True))
+        elif m == "steadyState":
+            bounds.append((base["popSize"] * (
+                p["minGens"] + p["noChangeGens"] + 1
+            ), False))
+    if not bounds:
+        return None, False
+    certain = [n for n, c in bounds if c]
+    if certain:
+        return min(certain), True
+    return min(n for n, c in bounds), False
+
+
+def time_bound(stop_criteria, now=None):
+    """
+    Seconds before a wall-clock criterion stops the run, if any.
+    """
+    now = time.time() if now is None else now
+    bounds = []
+    for criterion in stop_criteria:
+        p = criterion["parameters"]
+        if criterion["method"] == "maxWallClock":
+            bounds.append(p["seconds"])
+        elif criterion["method"] == "deadline":
+            bounds.append(max(p["timestamp"] - now, 0.0))
+    return min(bounds) if bounds else None
+
+
+def estimate(num_glyphs, num_features, base, stop_criteria, threads,
+             calibration, engine="gamera",
+             precision=feature_matrix.DEFAULT_PRECISION, now=None,
+             kernel_bytes=knn_fitness.DEFAULT_MAX_BYTES, fitness=None):
+    """
+    Estimated runtime (seconds) and peak memory (bytes) of an
+    optimization. Selections start with half of the features
+    active, so selection runs are costed at half the features.
+    fitness (a SerializableFitness) scales the NumPy engine's cost
+    to its splits.
+    """
+    threads = max(threads, 1)
+    active = num_features / 2.0 if base["opMode"] == 0 else num_features
+    fitness = cross_validation.SerializableFitness() \
+        if fitness is None or engine != "numpy" else fitness
+    per_evaluation = num_glyphs * num_glyphs * (
+        calibration["pairFeature"] * active + calibration["pair"]
+    ) * cross_validation.pair_fraction(fitness)
+    evaluations, certain = evaluation_bound(base, stop_criteria)
+    limit = time_bound(stop_criteria, now)
+    seconds = None if evaluations is None \
+        else evaluations * per_evaluation / threads
+    if limit is not None and (seconds is None or limit < seconds):
+        seconds, certain = limit, True
+
+    if engine == "numpy":
+        matrix = feature_matrix.estimate_bytes(
+            num_glyphs, num_features, precision
+        ) * (1 + cross_validation.matrix_copies(fitness))
+        per_thread = min(num_glyphs * num_glyphs * PAIR_BYTES,
+                         kernel_bytes)
+    else:
+        matrix = num_glyphs * num_features * GAMERA_FEATURE_BYTES
+        per_thread = num_glyphs * GAMERA_FEATURE_BYTES
+    population = base["popSize"] * num_features * 8
+    return {
+        "glyphs": num_glyphs,
+        "features": num_features,
+        "threads": threads,
+        "evaluations": evaluations,
+        "secondsPerEvaluation": per_evaluation,
+        "seconds": seconds,
+        "bounded": seconds is not None,
+        "certain": certain,
+        "bytesPerThread": per_thread,
+        "peakBytes": matrix + threads * per_thread + population,
+    }
+
+
+def suggest(cost, base, budget_seconds=None, budget_bytes=None):
+    """
+    A cheaper configuration fitting the budget, or None if the
+    cost is within it. Runtime is cut by capping fitness
+    evaluations (and the population with them) or wall-clock time;
+    memory by running fewer threads, or by condensing the
+    training set if even one thread does not fit.
+    """
+    suggestion = {}
+    if budget_seconds and (cost["seconds"] is None or
+                           cost["seconds"] > budget_seconds):
+        evaluations = int(budget_seconds * cost["threads"] / max(
+            cost["secondsPerEvaluation"], 1e-9
+        ))
+        # Leave room for at least ten generations.
+        suggestion["popSize"] = max(min(base["popSize"], evaluations // 10), 2)
+        suggestion["maxFitnessEvals"] = evaluations
+        suggestion["maxWallClock"] = int(budget_seconds)
+    if budget_bytes and cost["peakBytes"] > budget_bytes:
+        shared = cost["peakBytes"] - cost["threads"] * cost["bytesPerThread"]
+        threads = (budget_bytes - shared) // cost["bytesPerThread"]
+        suggestion["threads"] = int(max(threads, 1))
+        if threads < 1:
+            suggestion["condense"] = True
+    return suggestion or None
@@ -0,0 +1,153 @@
+# Copyright (C) 2020 Juliette Regimbal
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import division, unicode_literals
+
+import json
+import numpy as np
+
+
+FITNESS_LEAVE_ONE_OUT = "leaveOneOut"
+FITNESS_K_FOLD = "kFold"
+FITNESS_HOLDOUT = "holdout"
+
+DEFAULT_FOLDS = 5
+DEFAULT_FRACTION = 0.2
+DEFAULT_ROTATIONS = 1
+DEFAULT_SEED = 0
+
+
+class SerializableFitness:
+    """
+    How the NumPy engine scores a genome: leave-one-out (as
+    gamera does), stratified k-fold cross-validation, or held-out
+    glyphs, drawn again with the next seed for each rotation.
+    """
+
+    def __init__(self):
+        self.method = FITNESS_LEAVE_ONE_OUT
+        self.parameters = {}
+
+    def __eq__(self, other):
+        if isinstance(other, self.__class__):
+            return self.__dict__ == other.__dict__
+        else:
+            return False
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def setLeaveOneOut(self):
+        self.method = FITNESS_LEAVE_ONE_OUT
+        self.parameters = {}
+
+    def setKFold(self, folds=DEFAULT_FOLDS, seed=DEFAULT_SEED):
+        self.method = FITNESS_K_FOLD
+        self.parameters = {"folds": folds, "seed": seed}
+
+    def setHoldout(self, fraction=DEFAULT_FRACTION,
+                   rotations=DEFAULT_ROTATIONS, seed=DEFAULT_SEED):
+        self.method = FITNESS_HOLDOUT
+        self.parameters = {
+            "fraction": fraction, "rotations": rotations, "seed": seed
+        }
+
+    def toJSON(self):
+        return json.dumps(self.__dict__)
+
+    @staticmethod
+    def fromJSON(jsonString):
+        d = json.loads(jsonString)
+        return SerializableFitness.from_dict(d)
+
+    @staticmethod
+    def from_dict(d):
+        p = d.get("parameters", {})
+        e = SerializableFitness()
+        seed = int(p.get("seed", DEFAULT_SEED))
+
+        if d["method"] == FITNESS_K_FOLD:
+            folds = int(p.get("folds", DEFAULT_FOLDS))
+            assert folds >= 2, "k-fold needs at least 2 folds"
+            e.setKFold(folds, seed)
+        elif d["method"] == FITNESS_HOLDOUT:
+            fraction = float(p.get("fraction", DEFAULT_FRACTION))
+            rotations = int(p.get("rotations", DEFAULT_ROTATIONS))
+            assert 0.0 < fraction < 1.0, "Holdout fraction must be in (0, 1)"
+            assert rotations >= 1, "Holdout needs at least 1 rotation"
+            e.setHoldout(fraction, rotations, seed)
+        elif d["method"] != FITNESS_LEAVE_ONE_OUT:
+            raise ValueError("Unknown fitness method: %s" % d["method"])
+        return e
+
+
+def stratified_folds(labels, num_folds, seed=DEFAULT_SEED):
+    """
+    The fold of every glyph. The glyphs of each class are shuffled
+    and dealt to the folds in turn, continuing where the previous
+    class stopped, so folds differ in size and class counts by at
+    most one.
+    """
+    rng = np.random.RandomState(seed)
+    folds = np.empty(len(labels), dtype=np.int64)
+    dealt = 0
+    for c in np.unique(labels):
+        rows = rng.permutation(np.flatnonzero(labels == c))
+        folds[rows] = (dealt + np.arange(len(rows))) % num_folds
+        dealt += len(rows)
+    return folds
+
+
+def holdout(labels, fraction, seed=DEFAULT_SEED):
+    """
+    A stratified mask of held-out glyphs: about fraction of each
+    class, keeping at least one glyph of every class for reference.
+    """
+    rng = np.random.RandomState(seed)
+    mask = np.zeros(len(labels), dtype=bool)
+    for c in np.unique(labels):
+        rows = rng.permutation(np.flatnonzero(labels == c))
+        n = min(int(round(fraction * len(rows))), len(rows) - 1)
+        mask[rows[:n]] = True
+    return mask
+
+
+def splits(fitness, labels):
+    """
+    (test rows, reference rows) of every split a fitness method
+    scores genomes on, or None for leave-one-out.
+    """
+    p = fitness.parameters
+    if fitness.method == FITNESS_K_FOLD:
+        folds = stratified_folds(labels, p["folds"], p["seed"])
+        masks = [folds == f for f in range(p["folds"])]
+    elif fitness.method == FITNESS_HOLDOUT:
+        masks = [holdout(labels, p["fraction"], p["seed"] + r)
+                 for r in range(p["rotations"])]
+    else:
+        return None
+    return [(np.flatnonzero(m), np.flatnonzero(~m)) for m in masks if m.any()]
+
+
+def pair_fraction(fitness):
+    """
+    Distances computed by one evaluation relative to leave-one-out.
+    """
+    p = fitness.parameters
+    if fitness.method == FITNESS_K_FOLD:
+        return (p["folds"] - 1) / p["folds"]
+    elif fitness.method == FITNESS_HOLDOUT:
+        return p["rotations"] * p["fraction"] * (1 - p["fraction"])
+    return 1.0
+
+
+def matrix_copies(fitness):
+    """
+    Copies of the training matrix held by the gathered splits.
+    """
+    p = fitness.parameters
+    if fitness.method == FITNESS_K_FOLD:
+        return p["folds"]
+    elif fitness.method == FITNESS_HOLDOUT:
+        return p["rotations"]
+    return 0
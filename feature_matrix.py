@@ -0,0 +1,398 @@
+# Copyright (C) 2020 Juliette Regimbal
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import division, unicode_literals
+
+from itertools import chain
+from tempfile import mkstemp
+
+import numpy as np
+import os
+
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:     # Removed in Python 3.9
+    from xml.etree import ElementTree
+
+
+MODE_RAM = "ram"
+MODE_MMAP = "mmap"
+MODE_SHARED = "shared"
+
+PRECISIONS = {
+    "float32": np.float32,
+    "float16": np.float16,
+}
+DEFAULT_PRECISION = "float32"
+DEFAULT_MEMORY_BUDGET = 2048 * 1024 * 1024     # 2 GiB
+
+# Rows processed at a time when filling or normalizing a matrix.
+CHUNK_ROWS = 4096
+
+# Quantization step of deduplication, in standard deviations of
+# each feature. At 0 only identical glyphs are merged.
+DEFAULT_DEDUP_RESOLUTION = 0.01
+
+
+def label_dtype(num_classes):
+    """
+    Smallest integer type that can label num_classes classes.
+    """
+    if num_classes <= np.iinfo(np.uint8).max:
+        return np.uint8
+    elif num_classes <= np.iinfo(np.uint16).max:
+        return np.uint16
+    return np.uint32
+
+
+def estimate_bytes(num_glyphs, num_features, precision=DEFAULT_PRECISION):
+    """
+    Bytes needed to hold a feature matrix and its labels.
+    """
+    itemsize = np.dtype(PRECISIONS[precision]).itemsize
+    return num_glyphs * (num_features * itemsize + 4)
+
+
+def choose_mode(num_glyphs, num_features, budget=DEFAULT_MEMORY_BUDGET,
+                precision=DEFAULT_PRECISION):
+    """
+    Hold the matrix in RAM if it fits in the memory budget,
+    otherwise back it by a memory-mapped file.
+    """
+    if estimate_bytes(num_glyphs, num_features, precision) <= budget:
+        return MODE_RAM
+    return MODE_MMAP
+
+
+def _glyph_id(glyph):
+    for element in glyph.iter("id"):
+        return element.get("name")
+    return None
+
+
+def _glyph_features(glyph):
+    features = glyph.find("features")
+    if features is None:
+        return []
+    return [
+        (f.get("name"), [float(x) for x in f.text.split()])
+        for f in features.findall("feature")
+    ]
+
+
+def _iter_glyphs(path):
+    """
+    Stream (class name, [(feature name, values)]) from a
+    gamera XML file without building glyph objects.
+    """
+    context = ElementTree.iterparse(path, events=("start", "end"))
+    root = None
+    for event, element in context:
+        if root is None:
+            root = element
+        if event == "end" and element.tag == "glyph":
+            yield _glyph_id(element), _glyph_features(element)
+            element.clear()
+            root.clear()
+
+
+def _paths(path):
+    return list(path) if isinstance(path, (list, tuple)) else [path]
+
+
+def _iter_files(paths):
+    return chain.from_iterable(_iter_glyphs(p) for p in paths)
+
+
+def scan_xml(path):
+    """
+    Return the number of glyphs in a gamera XML file (or a list of
+    files, read in turn) and the (name, length) layout of the
+    features of its first glyph.
+    """
+    count = 0
+    layout = None
+    for name, features in _iter_files(_paths(path)):
+        if layout is None:
+            layout = [(f, len(values)) for f, values in features]
+        count += 1
+    return count, layout or []
+
+
+class FeatureMatrix(object):
+    """
+    Contiguous training features (one row per glyph) with small
+    integer class labels. Features are float32 or float16 and are
+    held in RAM, in a memory-mapped file, or in a read-only shared
+    store (see shared_store) that calls release when closed. A
+    deduplicated matrix also has the number of glyphs each row
+    stands for (counts) and the glyph it was taken from (rows).
+    """
+
+    def __init__(self, features, labels, class_names, layout, path=None,
+                 mode=None, release=None, counts=None, rows=None):
+        self.features = features
+        self.labels = labels
+        self.class_names = list(class_names)
+        self.layout = list(layout)
+        self.path = path
+        self.mode = mode or (MODE_RAM if path is None else MODE_MMAP)
+        self.release = release
+        self.counts = counts
+        self.rows = rows
+        self.mean = None
+        self.std = None
+
+    def __len__(self):
+        return self.features.shape[0]
+
+    @property
+    def num_features(self):
+        return self.features.shape[1]
+
+    @property
+    def feature_names(self):
+        return [name for name, length in self.layout]
+
+    @property
+    def nbytes(self):
+        extra = 0 if self.counts is None \
+            else self.counts.nbytes + self.rows.nbytes
+        return self.features.nbytes + self.labels.nbytes + extra
+
+    @property
+    def num_glyphs(self):
+        """
+        Glyphs of the training data, counting merged duplicates.
+        """
+        return len(self) if self.counts is None else int(self.counts.sum())
+
+    def feature_slices(self):
+        """
+        Map each feature name to its columns in the matrix.
+        """
+        slices = {}
+        start = 0
+        for name, length in self.layout:
+            slices[name] = slice(start, start + length)
+            start += length
+        return slices
+
+    def statistics(self):
+        """
+        Mean and standard deviation of every feature over all
+        glyphs (rows weighted by their counts), in chunks of rows.
+        """
+        n = len(self)
+        total = np.zeros(self.num_features)
+        squares = np.zeros(self.num_features)
+        for start in range(0, n, CHUNK_ROWS):
+            chunk = self.features[start:start + CHUNK_ROWS] \
+                .astype(np.float64)
+            if self.counts is None:
+                total += chunk.sum(axis=0)
+                squares += (chunk * chunk).sum(axis=0)
+            else:
+                w = self.counts[start:start + CHUNK_ROWS]
+                total += w.dot(chunk)
+                squares += w.dot(chunk * chunk)
+        mean = total / self.num_glyphs
+        std = np.sqrt(np.maximum(
+            squares / self.num_glyphs - mean * mean, 0.0
+        ))
+        std[std == 0] = 1.0
+        return mean, std
+
+    def normalize(self):
+        """
+        Normalize the features in place (as gamera's kNN does),
+        accumulating the statistics in chunks of rows. This does
+        nothing if the features are already normalized.
+        """
+        if self.mean is not None:
+            return self
+        n = len(self)
+        mean, std = self.statistics()
+        for start in range(0, n, CHUNK_ROWS):
+            chunk = self.features[start:start + CHUNK_ROWS]
+            chunk[...] = (chunk - mean) / std
+        self.mean, self.std = mean, std
+        return self
+
+    def close(self):
+        """
+        Release the features, removing any backing file
+        this matrix owns.
+        """
+        if self.release is not None:
+            self.features = None
+            self.release()
+            self.release = None
+        elif self.mode == MODE_MMAP:
+            del self.features
+            os.remove(self.path)
+            self.path = None
+        self.features = None
+
+    @staticmethod
+    def _allocate(num_glyphs, num_features, precision, mode, directory):
+        shape = (num_glyphs, num_features)
+        if mode == MODE_RAM:
+            return np.empty(shape, dtype=PRECISIONS[precision]), None
+        fd, path = mkstemp(suffix=".npy", dir=directory)
+        os.close(fd)
+        features = np.lib.format.open_memmap(
+            path, mode="w+", dtype=PRECISIONS[precision], shape=shape
+        )
+        return features, path
+
+    @staticmethod
+    def from_xml(path, layout=None, count=None, precision=DEFAULT_PRECISION,
+                 mode=MODE_RAM, directory=None):
+        """
+        Build a matrix by streaming a gamera XML file, or the glyphs
+        of a list of files one after the other. Features are ordered
+        by layout, a list of (name, length) pairs (by default that of
+        the first glyph). The files are scanned first unless both
+        layout and the glyph count are given.
+        """
+        if layout is None or count is None:
+            count, file_layout = scan_xml(path)
+            layout = file_layout if layout is None else layout
+        num_features = sum(length for name, length in layout)
+        features, mmap_path = FeatureMatrix._allocate(
+            count, num_features, precision, mode, directory
+        )
+
+        offsets = {}
+        start = 0
+        for name, length in layout:
+            offsets[name] = (start, length)
+            start += length
+
+        ids = {}
+        labels = np.empty(count, dtype=np.uint32)
+        row = np.zeros(num_features)
+        glyphs = _iter_files(_paths(path))
+        for i, (class_name, glyph_features) in enumerate(glyphs):
+            found = 0
+            for name, values in glyph_features:
+                if name in offsets:
+                    start, length = offsets[name]
+                    if len(values) != length:
+                        raise ValueError(
+                            "Feature %s of glyph %d has %d values, "
+                            "expected %d" % (name, i, len(values), length)
+                        )
+                    row[start:start + length] = values
+                    found += 1
+            if found != len(layout):
+                raise ValueError("Glyph %d is missing features" % i)
+            features[i] = row
+            labels[i] = ids.setdefault(class_name, len(ids))
+
+        return FeatureMatrix._with_sorted_classes(
+            features, labels, ids, layout, mmap_path
+        )
+
+    @staticmethod
+    def from_glyphs(glyphs, layout, precision=DEFAULT_PRECISION,
+                    mode=MODE_RAM, directory=None):
+        """
+        Build a matrix from gamera glyph objects whose
+        features are already ordered by layout.
+        """
+        num_features = sum(length for name, length in layout)
+        features, mmap_path = FeatureMatrix._allocate(
+            len(glyphs), num_features, precision, mode, directory
+        )
+        ids = {}
+        labels = np.empty(len(glyphs), dtype=np.uint32)
+        for i, glyph in enumerate(glyphs):
+            features[i] = glyph.features
+            labels[i] = ids.setdefault(glyph.get_main_id(), len(ids))
+        return FeatureMatrix._with_sorted_classes(
+            features, labels, ids, layout, mmap_path
+        )
+
+    @staticmethod
+    def _with_sorted_classes(features, labels, ids, layout, path):
+        class_names = sorted(ids)
+        remap = np.empty(len(ids), dtype=np.uint32)
+        for new, name in enumerate(class_names):
+            remap[ids[name]] = new
+        labels = remap[labels].astype(label_dtype(len(class_names)))
+        return FeatureMatrix(features, labels, class_names, layout, path)
+
+
+def _mix(x):
+    """
+    splitmix64's finalizer, elementwise on uint64 arrays.
+    """
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xbf58476d1ce4e5b9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94d049bb133111eb)
+    return x ^ (x >> np.uint64(31))
+
+
+def glyph_hashes(matrix, resolution=DEFAULT_DEDUP_RESOLUTION):
+    """
+    A 64-bit hash of every row's class and features quantized to
+    resolution standard deviations (their exact values at 0).
+    Glyphs of the same class within a quantization cell share a
+    hash; close glyphs on either side of a cell boundary do not.
+    """
+    mean, std = matrix.statistics()
+    salt = _mix(np.arange(1, matrix.num_features + 1, dtype=np.uint64))
+    hashes = np.empty(len(matrix), dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for start in range(0, len(matrix), CHUNK_ROWS):
+            chunk = matrix.features[start:start + CHUNK_ROWS] \
+                .astype(np.float64)
+            if resolution > 0:
+                q = np.floor((chunk - mean) / (std * resolution) + 0.5) \
+                    .astype(np.int64).view(np.uint64)
+            else:
+                # Adding 0.0 turns -0.0 into 0.0.
+                q = (chunk + 0.0).view(np.uint64)
+            h = _mix(q ^ salt).sum(axis=1, dtype=np.uint64)
+            labels = matrix.labels[start:start + CHUNK_ROWS]
+            hashes[start:start + len(chunk)] = _mix(
+                h ^ labels.astype(np.uint64)
+            )
+    return hashes
+
+
+def deduplicate(matrix, resolution=DEFAULT_DEDUP_RESOLUTION, mode=MODE_RAM,
+                directory=None):
+    """
+    A matrix with one row per distinct glyph hash (see glyph_hashes),
+    the first glyph of each, counting the glyphs it stands for.
+    Rows keep the order of the training data.
+    """
+    hashes = glyph_hashes(matrix, resolution)
+    unique, first, inverse = np.unique(
+        hashes, return_index=True, return_inverse=True
+    )
+    weights = np.ones(len(matrix), dtype=np.uint32) \
+        if matrix.counts is None else matrix.counts
+    counts = np.bincount(inverse, weights=weights, minlength=len(unique))
+    order = np.argsort(first)
+    keep = first[order]
+
+    precision = dict(
+        (np.dtype(t), name) for name, t in PRECISIONS.items()
+    )[matrix.features.dtype]
+    features, path = FeatureMatrix._allocate(
+        len(keep), matrix.num_features, precision, mode, directory
+    )
+    for start in range(0, len(keep), CHUNK_ROWS):
+        features[start:start + CHUNK_ROWS] = \
+            matrix.features[keep[start:start + CHUNK_ROWS]]
+    rows = keep if matrix.rows is None else matrix.rows[keep]
+    return FeatureMatrix(
+        features, matrix.labels[keep], matrix.class_names, matrix.layout,
+        path, counts=counts[order].astype(np.uint32),
+        rows=rows.astype(np.int64)
+    )
@@ -0,0 +1,1277 @@
+# Copyright (C) 2020 Juliette Regimbal
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import division, unicode_literals
+
+from multiprocessing.pool import ThreadPool
+
+import hashlib
+import json
+import knn_fitness
+import numpy as np
+import os
+import profiling
+import threading
+
+
+# Operation modes, numbered as gamera.knnga.GA_SELECTION/GA_WEIGHTING.
+OPMODE_SELECTION = 0
+OPMODE_WEIGHTING = 1
+
+# Fraction of the population bred each generation by steady-state
+# (SSGA) replacement; generational replacement breeds a full population.
+SSGA_OFFSPRING_RATE = 0.1
+# Evaluated genomes remembered so clones are not evaluated twice.
+CACHE_SIZE = 10000
+# Neighbor lists remembered so genomes differing only in k share them.
+NEIGHBOR_CACHE_SIZE = 64
+# Distances the GA chooses from. Fast euclidean ranks neighbors
+# exactly like euclidean, so it is not a separate choice.
+DISTANCE_CHOICES = (knn_fitness.DISTANCE_CITY_BLOCK,
+                    knn_fitness.DISTANCE_EUCLIDEAN)
+
+# What the GA does when the population's diversity collapses:
+# replace the worse part of the population with random genomes, or
+# raise the mutation rates until diversity recovers.
+RESTART_RESEED = "reseed"
+RESTART_MUTATION = "mutation"
+# Fraction of the population a reseed replaces; the better rest
+# (the elites) is kept.
+RESEED_FRACTION = 0.5
+# Factor the mutation rates (and gaussian mutation's sigma) are
+# raised by on each restart.
+MUTATION_BOOST = 2.0
+# Generations a restart is given to take effect before the next.
+RESTART_COOLDOWN = 5
+
+
+def random_seed():
+    """
+    A seed drawn from the operating system, recorded so that an
+    unseeded run can be repeated.
+    """
+    return int(np.frombuffer(os.urandom(4), dtype="<u4")[0])
+
+
+def make_rng(seed, stream=0):
+    """
+    Random stream number stream of a seed. Streams are independent
+    of each other, so each worker of a batch can draw from its own
+    whatever the order the workers run in. The state is seeded from
+    a digest of both numbers (SeedSequence needs NumPy 1.17, which
+    has no Python 2 release).
+    """
+    digest = hashlib.sha256(
+        ("%d:%d" % (seed, stream)).encode("utf-8")
+    ).digest()
+    return np.random.RandomState(np.frombuffer(digest, dtype="<u4"))
+
+
+class GAConfig(object):
+    """
+    GA settings parsed from the JSON written by knnga_util
+    (the "@base", "@selection", ... entries of the job's settings),
+    without depending on gamera.
+    """
+
+    def __init__(self, base, selection, replacement, mutation, crossover,
+                 stop_criteria, restart=None, seed=None, stream=0):
+        self.opMode = base["opMode"]
+        self.popSize = base["popSize"]
+        self.crossRate = base["crossRate"]
+        self.mutRate = base["mutRate"]
+        self.selection = selection
+        self.replacement = replacement
+        self.mutation = mutation
+        self.crossover = crossover
+        self.stop_criteria = stop_criteria
+        # {"threshold", "strategy"}: restart below this relative
+        # diversity (see NumpyGAOptimization.relative_diversity).
+        self.restart = restart or {"threshold": 0.0,
+                                   "strategy": RESTART_RESEED}
+        # Seed of the GA's random numbers (None draws one) and the
+        # stream of it this run uses.
+        self.seed = seed
+        self.stream = stream
+
+    @staticmethod
+    def from_settings(settings):
+        return GAConfig(*[json.loads(settings[key]) for key in (
+            "@base", "@selection", "@replacement", "@mutation",
+            "@crossover", "@stop_criteria"
+        )], restart={
+            "threshold": settings.get("Restart Diversity", 0.0),
+            "strategy": settings.get("Restart Strategy", RESTART_RESEED)
+        }, seed=settings.get("@seed"), stream=settings.get("@stream", 0))
+
+
+# Selection: each function returns n parent indices.
+
+def _fitness_proportional(fitness):
+    total = fitness.sum()
+    if total <= 0:
+        return np.full(len(fitness), 1.0 / len(fitness))
+    return fitness / total
+
+
+def select_random(rng, fitness, n):
+    return rng.randint(0, len(fitness), n)
+
+
+def select_roulette(rng, fitness, n):
+    p = _fitness_proportional(np.maximum(fitness, 0.0))
+    return rng.choice(len(fitness), n, p=p)
+
+
+def select_roulette_scaled(rng, fitness, n, pressure):
+    # Linear scaling so the best gets pressure times the average.
+    avg, best = fitness.mean(), fitness.max()
+    if best > avg:
+        a = (pressure - 1.0) * avg / (best - avg)
+        scaled = np.maximum(a * fitness + avg * (1.0 - a), 0.0)
+    else:
+        scaled = np.ones(len(fitness))
+    return rng.choice(len(fitness), n, p=_fitness_proportional(scaled))
+
+
+def select_rank(rng, fitness, n, pressure, exponent):
+    size = len(fitness)
+    ranks = np.empty(size)
+    ranks[np.argsort(fitness, kind="mergesort")] = np.arange(size)
+    scaled = ranks / max(size - 1, 1)
+    value = (2.0 - pressure) + 2.0 * (pressure - 1.0) * scaled ** exponent
+    value = np.maximum(value, 0.0)
+    return rng.choice(size, n, p=_fitness_proportional(value))
+
+
+def select_stochastic_universal(rng, fitness, n):
+    p = _fitness_proportional(np.maximum(fitness, 0.0))
+    pointers = (rng.uniform() + np.arange(n)) / n
+    indices = np.searchsorted(np.cumsum(p), pointers)
+    return np.minimum(indices, len(fitness) - 1)
+
+
+def select_tournament(rng, fitness, n, tSize):
+    entrants = rng.randint(0, len(fitness), (n, tSize))
+    return entrants[np.arange(n), fitness[entrants].argmax(axis=1)]
+
+
+def select(rng, selection, fitness, n):
+    m = selection["method"]
+    p = selection["parameters"]
+    if m == "rank":
+        return select_rank(rng, fitness, n, p.get("pressure", 2.0),
+                           p.get("exponent", 1.0))
+    elif m == "roulette":
+        return select_roulette(rng, fitness, n)
+    elif m == "roulette_scaled":
+        return select_roulette_scaled(rng, fitness, n,
+                                      p.get("pressure", 2.0))
+    elif m == "stochiastic":
+        return select_stochastic_universal(rng, fitness, n)
+    elif m == "tournament":
+        return select_tournament(rng, fitness, n, p.get("tSize", 3))
+    return select_random(rng, fitness, n)
+
+
+# Crossover: each function takes (m, L) parent arrays a and b and
+# returns the two (m, L) arrays of children.
+
+def _mix(a, b, mask):
+    return np.where(mask, a, b), np.where(mask, b, a)
+
+
+def crossover_n_point(rng, a, b, n):
+    m, length = a.shape
+    n = max(1, min(n, length - 1))
+    # Each cut flips which parent the following genes come from.
+    cuts = np.zeros((m, length), dtype=np.int64)
+    points = rng.randint(1, length, (m, n)) if length > 1 \
+        else np.zeros((m, n), dtype=np.int64)
+    np.add.at(cuts, (np.repeat(np.arange(m), n), points.ravel()), 1)
+    return _mix(a, b, np.cumsum(cuts, axis=1) % 2 == 0)
+
+
+def crossover_uniform(rng, a, b, preference):
+    return _mix(a, b, rng.uniform(size=a.shape) < preference)
+
+
+def crossover_sbx(rng, a, b, low, high, eta):
+    u = rng.uniform(size=a.shape)
+    beta = np.where(
+        u <= 0.5,
+        (2.0 * u) ** (1.0 / (eta + 1.0)),
+        (1.0 / (2.0 * (1.0 - u) + 1e-12)) ** (1.0 / (eta + 1.0))
+    )
+    c1 = 0.5 * ((1.0 + beta) * a + (1.0 - beta) * b)
+    c2 = 0.5 * ((1.0 - beta) * a + (1.0 + beta) * b)
+    return np.clip(c1, low, high), np.clip(c2, low, high)
+
+
+def crossover_blend(rng, a, b, low, high, alpha, per_gene):
+    # Segment crossover uses one factor per pair, hypercube one per gene.
+    shape = a.shape if per_gene else (a.shape[0], 1)
+    f = -alpha + (1.0 + 2.0 * alpha) * rng.uniform(size=shape)
+    c1 = f * a + (1.0 - f) * b
+    c2 = (1.0 - f) * a + f * b
+    return np.clip(c1, low, high), np.clip(c2, low, high)
+
+
+def crossover(rng, op, a, b):
+    m = op["method"]
+    p = op["parameters"]
+    if m == "nPoint":
+        return crossover_n_point(rng, a, b, p["n"])
+    elif m == "uniform":
+        return crossover_uniform(rng, a, b, p.get("preference", 0.5))
+    elif m == "sbx":
+        return crossover_sbx(rng, a, b, p["min"], p["max"],
+                             p.get("eta", 1.0))
+    elif m == "segment":
+        return crossover_blend(rng, a, b, p["min"], p["max"],
+                               p.get("alpha", 0.0), False)
+    elif m == "hypercube":
+        return crossover_blend(rng, a, b, p["min"], p["max"],
+                               p.get("alpha", 0.0), True)
+    raise ValueError("Unknown crossover method: %s" % m)
+
+
+# Mutation: each function mutates and returns an (m, L) array.
+
+def _permute(x, index):
+    return x[np.arange(x.shape[0])[:, np.newaxis], index]
+
+
+def _two_positions(rng, m, length):
+    i = rng.randint(0, length, m)[:, np.newaxis]
+    j = rng.randint(0, length, m)[:, np.newaxis]
+    return i, j, np.arange(length)[np.newaxis, :]
+
+
+def mutate_binary(rng, x, rate, normalize):
+    # As in EO, a normalized rate is spread over the whole genome.
+    p = rate / x.shape[1] if normalize else rate
+    flip = rng.uniform(size=x.shape) < p
+    return np.where(flip, 1.0 - x, x)
+
+
+def mutate_gauss(rng, x, low, high, sigma, rate):
+    mutate = rng.uniform(size=x.shape) < rate
+    noise = rng.normal(0.0, sigma, x.shape)
+    return np.clip(np.where(mutate, x + noise, x), low, high)
+
+
+def mutate_swap(rng, x):
+    i, j, pos = _two_positions(rng, *x.shape)
+    index = np.where(pos == i, j, np.where(pos == j, i, pos))
+    return _permute(x, index)
+
+
+def mutate_shift(rng, x):
+    # Move the gene at i to position j, shifting those in between.
+    i, j, pos = _two_positions(rng, *x.shape)
+    index = np.where(
+        pos == j, i,
+        np.where((i < j) & (pos >= i) & (pos < j), pos + 1,
+                 np.where((i > j) & (pos > j) & (pos <= i), pos - 1, pos))
+    )
+    return _permute(x, index)
+
+
+def mutate_inversion(rng, x):
+    i, j, pos = _two_positions(rng, *x.shape)
+    lo, hi = np.minimum(i, j), np.maximum(i, j)
+    inside = (pos >= lo) & (pos <= hi)
+    return _permute(x, np.where(inside, lo + hi - pos, pos))
+
+
+def mutate(rng, op, x):
+    m = op["method"]
+    p = op["parameters"]
+    if m == "binary":
+        return mutate_binary(rng, x, p.get("rate", 0.05),
+                             p.get("normalize", True))
+    elif m == "gauss":
+        return mutate_gauss(rng, x, p["min"], p["max"], p["sigma"],
+                            p["rate"])
+    elif m == "swap":
+        return mutate_swap(rng, x)
+    elif m == "shift":
+        return mutate_shift(rng, x)
+    elif m == "inversion":
+        return mutate_inversion(rng, x)
+    raise ValueError("Unknown mutation method: %s" % m)
+
+
+class ParameterGenes(object):
+    """
+    Genes appended to the feature genome to choose k (1 to max_k)
+    and, optionally, the distance type. In selection mode each
+    choice is encoded in binary over several genes; in weighting
+    mode it is one gene whose value in [0, 1] picks a choice.
+    """
+
+    def __init__(self, op_mode, max_k=0, distances=False):
+        self.op_mode = op_mode
+        self.choices = []
+        if max_k > 1:
+            self.choices.append(("k", list(range(1, max_k + 1))))
+        if distances:
+            self.choices.append(("distance", list(DISTANCE_CHOICES)))
+        self.lengths = [
+            int(np.ceil(np.log2(len(values))))
+            if op_mode == OPMODE_SELECTION else 1
+            for name, values in self.choices
+        ]
+
+    def __len__(self):
+        return sum(self.lengths)
+
+    @property
+    def max_k(self):
+        return dict(self.choices).get("k", [0])[-1]
+
+    def decode(self, genes):
+        """
+        The parameters chosen by genes, as a dictionary.
+        """
+        chosen = {}
+        start = 0
+        for (name, values), length in zip(self.choices, self.lengths):
+            g = genes[start:start + length]
+            start += length
+            if self.op_mode == OPMODE_SELECTION:
+                # Codes beyond the last choice wrap around, so no
+                # choice gets more than one code more than another.
+                index = int((g > 0.5).dot(2 ** np.arange(length)))
+                index %= len(values)
+            else:
+                index = min(int(np.clip(g[0], 0.0, 1.0) * len(values)),
+                            len(values) - 1)
+            chosen[name] = values[index]
+        return chosen
+
+    def encode(self, chosen):
+        """
+        Genes choosing the given parameters (the first choice
+        of any parameter not given or not available).
+        """
+        genes = []
+        for (name, values), length in zip(self.choices, self.lengths):
+            value = chosen.get(name)
+            index = values.index(value) if value in values else 0
+            if self.op_mode == OPMODE_SELECTION:
+                genes.extend((index >> np.arange(length)) & 1)
+            else:
+                genes.append((index + 0.5) / len(values))
+        return np.array(genes, dtype=np.float64)
+
+
+class WorkerPool(object):
+    """
+    A ThreadPool kept from one map to the next, so a run does not
+    start new threads every generation. It is rebuilt only when
+    the number of threads changes, and its threads end on close.
+    """
+
+    def __init__(self):
+        self._pool = None
+        self._threads = 0
+        self._lock = threading.Lock()
+
+    def map(self, func, items, threads):
+        if threads <= 1 or len(items) <= 1:
+            return [func(item) for item in items]
+        with self._lock:
+            if self._threads != threads:
+                self._close()
+                self._pool = ThreadPool(threads)
+                self._threads = threads
+            pool = self._pool
+        return pool.map(func, items)
+
+    def _close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+        self._pool = None
+        self._threads = 0
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+
+def close_fitness(fitness):
+    """
+    End any threads a fitness function keeps (those without
+    a close method keep none).
+    """
+    close = getattr(fitness, "close", None)
+    if close is not None:
+        close()
+
+
+class LeaveOneOutFitness(object):
+    """
+    Score genomes by the leave-one-out accuracy of a kNN classifier
+    over a (normalized) training matrix. In selection mode genomes
+    are selections of the classifier's weights; in weighting mode
+    they are weights of the classifier's selected features. If
+    parameter genes are given, they follow the feature genes and
+    override k and the distance type. counts weights the glyphs of
+    a deduplicated training matrix by the glyphs they stand for.
+    """
+
+    def __init__(self, features, labels, k, distance_type, op_mode,
+                 weights=None, selections=None, parameters=None,
+                 max_bytes=knn_fitness.DEFAULT_MAX_BYTES, counts=None):
+        self.features = features
+        self.labels = labels
+        self.counts = counts
+        self.k = k
+        self.distance_type = distance_type
+        self.op_mode = op_mode
+        ones = np.ones(features.shape[1])
+        self.base_weights = ones if weights is None else weights
+        self.base_selections = ones if selections is None else selections
+        self.parameters = ParameterGenes(op_mode) \
+            if parameters is None else parameters
+        # Memory each evaluation's neighbor search may use.
+        self.max_bytes = max_bytes
+        self._neighbors = {}
+        self._lock = threading.Lock()
+
+    def weights(self, genome):
+        genome = genome[:self.features.shape[1]]
+        if self.op_mode == OPMODE_SELECTION:
+            return self.base_weights * (genome > 0.5)
+        return genome * self.base_selections
+
+    def decode(self, genome):
+        """
+        The k and distance type a genome is scored with.
+        """
+        chosen = self.parameters.decode(genome[self.features.shape[1]:])
+        return (chosen.get("k", self.k),
+                chosen.get("distance", self.distance_type))
+
+    def neighbors(self, w, distance_type):
+        """
+        Sorted leave-one-out neighbor lists, long enough for any k
+        the genome may choose, shared by genomes differing only in k.
+        """
+        k = max(self.k, self.parameters.max_k)
+        if not self.parameters.max_k:
+            return knn_fitness.leave_one_out_neighbors(
+                self.features, w, k, distance_type, self.max_bytes
+            )
+        key = (w.tobytes(), distance_type)
+        with self._lock:
+            nearest = self._neighbors.get(key)
+        if nearest is None:
+            nearest = knn_fitness.leave_one_out_neighbors(
+                self.features, w, k, distance_type, self.max_bytes
+            )
+            with self._lock:
+                if len(self._neighbors) >= NEIGHBOR_CACHE_SIZE:
+                    self._neighbors.clear()
+                self._neighbors[key] = nearest
+        return nearest
+
+    def __call__(self, genome):
+        w = self.weights(genome)
+        if not np.any(w):
+            return 0.0
+        k, distance_type = self.decode(genome)
+        return knn_fitness.leave_one_out_accuracies(
+            self.labels, self.neighbors(w, distance_type), [k], self.counts
+        )[0]
+
+
+class CrossValidationFitness(LeaveOneOutFitness):
+    """
+    Score genomes by the accuracy of a kNN classifier on held-out
+    glyphs instead of leave-one-out. splits are the (test rows,
+    reference rows) of each fold or holdout; their glyphs are
+    gathered once, and the splits of a genome are classified in
+    parallel on up to threads threads.
+    """
+
+    def __init__(self, features, labels, k, distance_type, op_mode,
+                 splits, weights=None, selections=None, parameters=None,
+                 max_bytes=knn_fitness.DEFAULT_MAX_BYTES, threads=1,
+                 counts=None):
+        super(CrossValidationFitness, self).__init__(
+            features, labels, k, distance_type, op_mode, weights,
+            selections, parameters, max_bytes, counts
+        )
+        self.num_classes = int(labels.max()) + 1
+        weighted = counts is not None
+        counts = np.ones(len(labels)) if counts is None else counts
+        # Reference counts weight the votes of deduplicated rows.
+        self.splits = [
+            (features[test], labels[test], counts[test],
+             features[reference], labels[reference],
+             counts[reference] if weighted else None)
+            for test, reference in splits
+        ]
+        self.num_tests = sum(float(s[2].sum()) for s in self.splits)
+        self.threads = threads
+        self._pool = WorkerPool()
+
+    def close(self):
+        """
+        End the threads classifying splits.
+        """
+        self._pool.close()
+
+    def correct(self, split, w, k, distance_type):
+        """
+        Number (total count) of test glyphs of a split its
+        reference classifies correctly.
+        """
+        test, test_labels, test_counts, reference, reference_labels, \
+            reference_counts = split
+        nearest = knn_fitness.nearest_neighbors(
+            test, reference, w, k, distance_type, max_bytes=self.max_bytes
+        )
+        if reference_counts is None:
+            predicted = knn_fitness.vote(
+                reference_labels[nearest], self.num_classes
+            )
+        else:
+            predicted = knn_fitness.weighted_vote(
+                reference_labels[nearest], reference_counts[nearest],
+                self.num_classes, k
+            )
+        return float(test_counts.dot(predicted == test_labels))
+
+    def __call__(self, genome):
+        w = self.weights(genome)
+        if not np.any(w):
+            return 0.0
+        k, distance_type = self.decode(genome)
+
+        def score(split):
+            return self.correct(split, w, k, distance_type)
+
+        correct = self._pool.map(
+            score, self.splits, min(self.threads, len(self.splits))
+        )
+        return sum(correct) / self.num_tests
+
+
+def mean_pairwise_distance(population):
+    """
+    Mean L1 distance between pairs of rows, which is the Hamming
+    distance for genomes of zeros and ones. Sorting each gene's
+    values gives the sum over all pairs without comparing them.
+    """
+    m = len(population)
+    if m < 2:
+        return 0.0
+    # The k-th smallest value is larger than k others and smaller
+    # than m - 1 - k others.
+    coefficients = 2.0 * np.arange(m) - (m - 1)
+    total = coefficients.dot(np.sort(population, axis=0)).sum()
+    return float(total / (m * (m - 1) / 2))
+
+
+class NumpyGAOptimization(object):
+    """
+    A NumPy genetic algorithm with the operators serialized by
+    knnga_util. Each operator acts on the whole population array
+    at once. It mirrors the interface of gamera.knnga.GAOptimization
+    (startCalculation, stopCalculation, status, generation,
+    bestFitness, monitorString) so the job can poll either one.
+    All random numbers are drawn by the GA itself, never by the
+    threads evaluating genomes, so a seeded run gives the same
+    result with any number of threads.
+    """
+
+    def __init__(self, fitness, num_features, config, threads=1, rng=None):
+        self.fitness = fitness
+        self.num_features = num_features
+        self.config = config
+        self.threads = threads
+        self.seed = None
+        if rng is None:
+            self.seed = random_seed() if config.seed is None \
+                else config.seed
+            rng = make_rng(self.seed, config.stream)
+        self.rng = rng
+        self.population = None
+        self.scores = None
+        self.generation = 0
+        # Genomes scored, including those looked up in the cache.
+        self.evaluations = 0
+        self.cache_hits = 0
+        self.bestFitness = 0.0
+        self.best = None
+        self.last_improvement = 0
+        self.mutation_rate = config.mutRate
+        # Factor the mutation operators' own rates are raised by.
+        self.mutation_boost = 1.0
+        # Relative diversity after each generation, and restarts.
+        self.diversities = []
+        self.restarts = []
+        self.status = False
+        self._stop = False
+        self._thread = None
+        self._cache = {}
+        self._pool = WorkerPool()
+        self._warm_start = None
+        self.error = None
+        # Whether startCalculation profiles the run, and the
+        # cProfile report once it ends.
+        self.profile = False
+        self.profile_stats = None
+
+    @property
+    def monitorString(self):
+        return "Generation: %d, evaluations: %d, best fitness: %f" % (
+            self.generation, self.evaluations, self.bestFitness
+        )
+
+    def evaluate(self, population):
+        """
+        Fitness of every row, evaluated in parallel. Genomes seen
+        before are looked up instead of re-evaluated.
+        """
+        self.evaluations += len(population)
+        keys = [row.tobytes() for row in population]
+        todo = [i for i, key in enumerate(keys) if key not in self._cache]
+        unique = dict((keys[i], i) for i in todo)
+        rows = [population[i] for i in unique.values()]
+        self.cache_hits += len(population) - len(rows)
+        scores = self._pool.map(self.fitness, rows, self.threads)
+        if len(self._cache) + len(scores) > CACHE_SIZE:
+            self._cache = {}
+        self._cache.update(zip(unique.keys(), scores))
+        return np.array([self._cache[key] for key in keys])
+
+    def initial_population(self):
+        shape = (self.config.popSize, self.num_features)
+        if self.config.opMode == OPMODE_SELECTION:
+            return (self.rng.uniform(size=shape) < 0.5).astype(np.float64)
+        return self.rng.uniform(size=shape)
+
+    def _repair(self, population):
+        # A selection must keep at least one feature.
+        if self.config.opMode == OPMODE_SELECTION:
+            empty = np.flatnonzero(~population.any(axis=1))
+            population[empty, self.rng.randint(
+                0, self.num_features, len(empty)
+            )] = 1.0
+        return population
+
+    def breed(self, n):
+        """
+        Select parents and produce n offspring by
+        crossover and mutation.
+        """
+        pairs = (n + 1) // 2
+        parents = select(
+            self.rng, self.config.selection, self.scores, 2 * pairs
+        )
+        a = self.population[parents[0::2]]
+        b = self.population[parents[1::2]]
+        c1, c2 = a.copy(), b.copy()
+
+        # Each crossing pair uses one of the configured operators.
+        crossing = self.rng.uniform(size=pairs) < self.config.crossRate
+        ops = self.rng.randint(0, len(self.config.crossover), pairs)
+        for o, op in enumerate(self.config.crossover):
+            rows = np.flatnonzero(crossing & (ops == o))
+            if len(rows):
+                c1[rows], c2[rows] = self._crossover(op, a[rows], b[rows])
+        children = np.vstack([c1, c2])[:n]
+
+        mutating = self.rng.uniform(size=n) < self.mutation_rate
+        ops = self.rng.randint(0, len(self.config.mutation), n)
+        for o, op in enumerate(self.config.mutation):
+            rows = np.flatnonzero(mutating & (ops == o))
+            if len(rows):
+                children[rows] = self._mutate(
+                    self._boosted(op), children[rows]
+                )
+        return self._repair(children)
+
+    def _boosted(self, op):
+        """
+        The mutation operator with its rate and sigma raised by
+        the restarts' boost.
+        """
+        if self.mutation_boost == 1.0:
+            return op
+        p = dict(op["parameters"])
+        if op["method"] == "binary":
+            # A normalized rate is the bits flipped per genome;
+            # flipping half of them is as random as it gets.
+            p["rate"] = min(
+                p.get("rate", 0.05) * self.mutation_boost,
+                self.num_features / 2.0 if p.get("normalize", True) else 0.5
+            )
+        elif op["method"] == "gauss":
+            p["rate"] = min(p["rate"] * self.mutation_boost, 1.0)
+            p["sigma"] = p["sigma"] * self.mutation_boost
+        return dict(op, parameters=p)
+
+    def _crossover(self, op, a, b):
+        return crossover(self.rng, op, a, b)
+
+    def _mutate(self, op, x):
+        return mutate(self.rng, op, x)
+
+    def replace(self, children, scores):
+        m = self.config.replacement["method"]
+        p = self.config.replacement["parameters"]
+        if m == "SSGAworse":
+            # Offspring take the places of the worst individuals.
+            worst = np.argsort(self.scores, kind="mergesort")[:len(children)]
+            self.population[worst] = children
+            self.scores[worst] = scores
+        elif m == "SSGAdetTournament":
+            # Each offspring replaces the loser of a tournament.
+            for child, score in zip(children, scores):
+                entrants = self.rng.randint(
+                    0, len(self.scores), p.get("tSize", 3)
+                )
+                loser = entrants[self.scores[entrants].argmin()]
+                self.population[loser] = child
+                self.scores[loser] = score
+        else:
+            self.population, self.scores = children, scores
+
+    def offspring_count(self):
+        if self.config.replacement["method"] in (
+            "SSGAworse", "SSGAdetTournament"
+        ):
+            return max(2, int(round(
+                SSGA_OFFSPRING_RATE * self.config.popSize
+            )))
+        return self.config.popSize
+
+    def _record_best(self):
+        i = int(self.scores.argmax())
+        if self.best is None or self.scores[i] > self.bestFitness:
+            self.bestFitness = float(self.scores[i])
+            self.best = self.population[i].copy()
+            self.last_improvement = self.generation
+
+    def diversity(self):
+        """
+        Mean distance between pairs of individuals: the Hamming
+        distance in selection mode, L1 in weighting mode.
+        """
+        return mean_pairwise_distance(self.population)
+
+    def relative_diversity(self):
+        """
+        Diversity per gene, from 0 (all clones) to at most 1.
+        """
+        return self.diversity() / max(self.num_features, 1)
+
+    def restart(self, diversity):
+        """
+        Restore diversity with the configured strategy and record
+        the event.
+        """
+        strategy = self.config.restart["strategy"]
+        if strategy == RESTART_MUTATION:
+            self.mutation_rate = min(1.0, self.mutation_rate * MUTATION_BOOST)
+            self.mutation_boost *= MUTATION_BOOST
+        else:
+            n = int(round(RESEED_FRACTION * len(self.population)))
+            worst = np.argsort(self.scores, kind="mergesort")[:n]
+            self.population[worst] = self._repair(
+                self.initial_population()[:n]
+            )
+            self.scores[worst] = self.evaluate(self.population[worst])
+            self._record_best()
+        # Only an actual improvement resets the steady state count,
+        # so a population that keeps collapsing still stops.
+        self.restarts.append({
+            "generation": self.generation,
+            "diversity": diversity,
+            "strategy": strategy,
+            "mutationRate": self.mutation_rate,
+            "mutationBoost": self.mutation_boost,
+            "bestFitness": self.bestFitness
+        })
+
+    def monitor_diversity(self):
+        """
+        Record the population's diversity, restarting if it fell
+        below the threshold (and the last restart had time to take
+        effect). Raised mutation rates are restored once it did.
+        """
+        diversity = self.relative_diversity()
+        self.diversities.append(diversity)
+        threshold = self.config.restart["threshold"]
+        if threshold <= 0 or (
+            self.restarts and self.generation -
+            self.restarts[-1]["generation"] < RESTART_COOLDOWN
+        ):
+            return
+        if diversity < threshold:
+            self.restart(diversity)
+        else:
+            self.mutation_rate = self.config.mutRate
+            self.mutation_boost = 1.0
+
+    def stop_criteria_met(self):
+        for criterion in self.config.stop_criteria:
+            m = criterion["method"]
+            p = criterion["parameters"]
+            if m == "bestFitness" and \
+                    self.bestFitness >= p.get("optimum", 1.0):
+                return True
+            elif m == "maxFitnessEvals" and \
+                    self.evaluations >= p.get("n", 5000):
+                return True
+            elif m == "maxGenerations" and \
+                    self.generation >= p.get("n", 100):
+                return True
+            elif m == "steadyState" and \
+                    self.generation >= p.get("minGens", 40) and \
+                    self.generation - self.last_improvement >= \
+                    p.get("noChangeGens", 10):
+                return True
+        return False
+
+    def warm_start(self, genome, score=None):
+        """
+        Start from a known genome (such as a previous optimization's
+        best) instead of a random population: it is kept, half of
+        the others are mutated copies of it and the rest are random.
+        Its score, if known, is not evaluated again.
+        """
+        self._warm_start = (np.asarray(genome, dtype=np.float64), score)
+
+    def _encode(self, genomes):
+        """
+        Genomes in the population's representation.
+        """
+        return genomes
+
+    def initialize(self):
+        population = self.initial_population()
+        if self._warm_start is not None:
+            genome, score = self._warm_start
+            seeded = self._encode(genome[np.newaxis, :])
+            copies = np.repeat(seeded, len(population) // 2, axis=0)
+            ops = self.rng.randint(0, len(self.config.mutation), len(copies))
+            for o, op in enumerate(self.config.mutation):
+                rows = np.flatnonzero(ops == o)
+                if len(rows):
+                    copies[rows] = self._mutate(op, copies[rows])
+            population[:len(copies)] = copies
+            population[0] = seeded[0]
+            if score is not None:
+                self._cache[seeded[0].tobytes()] = score
+        self.population = self._repair(population)
+        self.scores = self.evaluate(self.population)
+        self._record_best()
+        self.monitor_diversity()
+
+    def step(self):
+        """
+        Run one generation.
+        """
+        children = self.breed(self.offspring_count())
+        self.replace(children, self.evaluate(children))
+        self.generation += 1
+        self._record_best()
+        self.monitor_diversity()
+
+    def evolve(self):
+        if self.population is None:
+            self.initialize()
+        while not self._stop and not self.stop_criteria_met():
+            self.step()
+
+    def run(self):
+        """
+        Optimize until a stop criterion is met or the run is stopped,
+        returning the best genome found.
+        """
+        self.status = True
+        try:
+            self.evolve()
+        finally:
+            self.close()
+            self.status = False
+        return self.best
+
+    def close(self):
+        """
+        End the threads evaluating genomes (and the fitness's own).
+        They are started again if the run continues.
+        """
+        self._pool.close()
+        close_fitness(self.fitness)
+
+    def startCalculation(self):
+        self._stop = False
+        self.status = True
+
+        def target():
+            # Profiled in this thread, where the GA runs; genomes
+            # evaluated on the pool's threads count under its map.
+            with profiling.capture(self.profile) as capture:
+                try:
+                    self.run()
+                except Exception as e:
+                    self.error = e
+                    self.status = False
+            self.profile_stats = capture.get("stats")
+
+        self._thread = threading.Thread(target=target)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stopCalculation(self):
+        self._stop = True
+        if self._thread is not None:
+            self._thread.join()
+
+    def join(self, timeout=None):
+        """
+        Wait for a run started with startCalculation.
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+class FeatureGroups(object):
+    """
+    Map a genome with one gene per feature family (e.g. all of
+    volume64regions) onto the per-dimension genome of a layout
+    given as (name, length) pairs. extra trailing genes (such as
+    parameter genes) are passed through unchanged.
+    """
+
+    def __init__(self, layout, extra=0):
+        self.layout = layout
+        self.index = np.concatenate([
+            np.repeat(np.arange(len(layout)),
+                      [length for name, length in layout]),
+            len(layout) + np.arange(extra)
+        ]).astype(np.int64)
+        self.extra = extra
+
+    def __len__(self):
+        return len(self.layout) + self.extra
+
+    @property
+    def num_features(self):
+        return len(self.index)
+
+    def expand(self, genome):
+        """
+        Per-dimension genome(s) of one or more grouped genomes.
+        """
+        return genome[..., self.index]
+
+    def collapse(self, genome):
+        """
+        The grouped genome closest to a per-dimension one: the mean
+        gene of each family.
+        """
+        return np.bincount(self.index, genome) / np.bincount(self.index)
+
+
+class GroupedFitness(object):
+    """
+    Score grouped genomes with a per-dimension fitness function.
+    """
+
+    def __init__(self, fitness, groups):
+        self.fitness = fitness
+        self.groups = groups
+
+    def __call__(self, genome):
+        return self.fitness(self.groups.expand(genome))
+
+    def close(self):
+        close_fitness(self.fitness)
+
+
+class GroupedGAOptimization(NumpyGAOptimization):
+    """
+    Optimize one gene per feature family, so selection keeps or
+    drops whole families and weighting shares one weight per family.
+    In weighting mode, the final population can then be refined
+    per dimension for a number of generations. best is always a
+    per-dimension genome once the run has finished.
+    """
+
+    def __init__(self, fitness, groups, config, threads=1, rng=None,
+                 refine_generations=0):
+        super(GroupedGAOptimization, self).__init__(
+            GroupedFitness(fitness, groups), len(groups), config,
+            threads, rng
+        )
+        self.groups = groups
+        self.refine_generations = refine_generations
+        self.refining = False
+        self._refine_start = None
+
+    def stop_criteria_met(self):
+        if self.refining:
+            return self.generation - self._refine_start >= \
+                self.refine_generations
+        return super(GroupedGAOptimization, self).stop_criteria_met()
+
+    def refine(self):
+        """
+        Continue from the expanded population with one gene
+        per dimension.
+        """
+        self.fitness = self.fitness.fitness
+        self.num_features = self.groups.num_features
+        self.population = self.groups.expand(self.population)
+        self.best = self.groups.expand(self.best)
+        self._cache = {}
+        self.refining = True
+        self._refine_start = self.generation
+
+    def evolve(self):
+        super(GroupedGAOptimization, self).evolve()
+        if self.refining:
+            return
+        if not self._stop and self.refine_generations > 0 and \
+                self.config.opMode == OPMODE_WEIGHTING:
+            self.refine()
+            super(GroupedGAOptimization, self).evolve()
+        else:
+            self.best = self.groups.expand(self.best)
+
+
+# Bit-packed genomes: bit i of a genome is bit i % 64 of its
+# word i // 64, and the bits past the genome's end are zero.
+
+WORD = np.dtype("<u8")
+WORD_BITS = 64
+# Above this flip probability, binary mutation draws a dense mask.
+SPARSE_FLIP_RATE = 0.05
+POPCOUNT_8 = np.array([bin(i).count("1") for i in range(256)],
+                      dtype=np.uint8)
+
+
+def num_words(length):
+    return (length + WORD_BITS - 1) // WORD_BITS
+
+
+def pack(genomes):
+    """
+    Pack (m, L) genomes of zeros and ones into (m, W) words.
+    """
+    m, length = genomes.shape
+    bits = np.zeros((m, num_words(length) * WORD_BITS), dtype=np.uint8)
+    bits[:, :length] = np.asarray(genomes) > 0.5
+    # packbits puts the first bit of each byte in its highest bit;
+    # reversing each group of 8 makes it the lowest (NumPy 1.16 has
+    # no bitorder argument).
+    bits = bits.reshape(m, -1, 8)[:, :, ::-1]
+    return np.packbits(bits, axis=-1).reshape(m, -1).view(WORD)
+
+
+def unpack(words, length):
+    """
+    Unpack (m, W) words into (m, L) genomes of zeros and ones.
+    """
+    words = np.ascontiguousarray(words, dtype=WORD)
+    bits = np.unpackbits(words.view(np.uint8), axis=-1)
+    shape = bits.shape[:-1] + (-1, 8)
+    bits = bits.reshape(shape)[..., ::-1].reshape(bits.shape)
+    return bits[..., :length].astype(np.float64)
+
+
+def popcount(words):
+    """
+    Number of set bits of each row of words.
+    """
+    words = np.ascontiguousarray(words, dtype=WORD)
+    return POPCOUNT_8[words.view(np.uint8)].sum(axis=-1, dtype=np.int64)
+
+
+def bit_counts(words):
+    """
+    Number of rows of words with each bit set, bit i of the genome
+    at index i (padding bits included).
+    """
+    octets = np.ascontiguousarray(words, dtype=WORD).view(np.uint8)
+    counts = np.empty((octets.shape[1], 8), dtype=np.int64)
+    for bit in range(8):
+        counts[:, bit] = np.count_nonzero(octets & (1 << bit), axis=0)
+    return counts.ravel()
+
+
+def hamming(a, b):
+    """
+    Hamming distances between packed genomes.
+    """
+    return popcount(np.bitwise_xor(a, b))
+
+
+def tail_mask(length):
+    """
+    The valid bits of each word of a packed genome of this length.
+    """
+    mask = np.full(num_words(length), np.iinfo(WORD).max, dtype=WORD)
+    if length % WORD_BITS:
+        mask[-1] = (1 << (length % WORD_BITS)) - 1
+    return mask
+
+
+def _bit_masks(length, points):
+    """
+    Words whose bits at and after each point are set, for an
+    array of bit positions.
+    """
+    points = np.asarray(points, dtype=np.int64)[..., np.newaxis]
+    word = np.arange(num_words(length))
+    ones = np.iinfo(WORD).max
+    shifted = np.left_shift(
+        np.full(points.shape, ones, dtype=WORD),
+        (points % WORD_BITS).astype(WORD)
+    )
+    return np.where(
+        word < points // WORD_BITS, WORD.type(0),
+        np.where(word == points // WORD_BITS, shifted, WORD.type(ones))
+    ).astype(WORD)
+
+
+def packed_n_point(rng, a, b, length, n):
+    m = a.shape[0]
+    n = max(1, min(n, length - 1))
+    points = rng.randint(1, length, (m, n)) if length > 1 \
+        else np.zeros((m, n), dtype=np.int64)
+    # Bits past an odd number of cuts come from the other parent.
+    mask = np.bitwise_xor.reduce(_bit_masks(length, points), axis=1)
+    mask &= tail_mask(length)
+    return (a & ~mask) | (b & mask), (b & ~mask) | (a & mask)
+
+
+def packed_uniform(rng, a, b, length, preference):
+    if preference == 0.5:
+        mask = rng.randint(0, 2 ** 64, a.shape, dtype=np.uint64).astype(WORD)
+    else:
+        mask = pack(rng.uniform(size=(a.shape[0], length)) >= preference)
+    mask &= tail_mask(length)
+    return (a & ~mask) | (b & mask), (b & ~mask) | (a & mask)
+
+
+def packed_binary(rng, x, length, rate, normalize):
+    p = rate / length if normalize else rate
+    if p > SPARSE_FLIP_RATE:
+        return x ^ pack(rng.uniform(size=(x.shape[0], length)) < p)
+    # Draw how many bits flip in each genome, then which ones.
+    counts = rng.binomial(length, p, x.shape[0])
+    flips = np.zeros(0, dtype=np.int64)
+    missing = counts
+    while missing.any():
+        rows = np.repeat(np.arange(len(counts)), missing)
+        flips = np.union1d(
+            flips, rows * length + rng.randint(0, length, len(rows))
+        )
+        missing = counts - np.bincount(flips // length,
+                                       minlength=len(counts))
+    rows, bits = flips // length, flips % length
+    x = x.copy()
+    np.bitwise_xor.at(
+        x, (rows, bits // WORD_BITS),
+        np.left_shift(WORD.type(1), (bits % WORD_BITS).astype(WORD))
+    )
+    return x
+
+
+class PackedFitness(object):
+    """
+    Score packed genomes with a fitness function of unpacked ones.
+    """
+
+    def __init__(self, fitness, length):
+        self.fitness = fitness
+        self.length = length
+
+    def __call__(self, words):
+        return self.fitness(unpack(words, self.length))
+
+    def close(self):
+        close_fitness(self.fitness)
+
+
+class PackedGAOptimization(NumpyGAOptimization):
+    """
+    A selection mode GA storing each genome as 64-bit words.
+    n-point and uniform crossover and binary mutation are bitwise
+    operations on the words, which are also the fitness cache keys;
+    other operators work on temporarily unpacked genomes. best is
+    an unpacked genome.
+    """
+
+    def __init__(self, fitness, num_features, config, threads=1, rng=None):
+        super(PackedGAOptimization, self).__init__(
+            PackedFitness(fitness, num_features), num_features, config,
+            threads, rng
+        )
+        self.mask = tail_mask(num_features)
+
+    def initial_population(self):
+        return self.rng.randint(
+            0, 2 ** 64, (self.config.popSize, len(self.mask)),
+            dtype=np.uint64
+        ).astype(WORD) & self.mask
+
+    def _repair(self, population):
+        empty = np.flatnonzero(~population.any(axis=1))
+        bits = self.rng.randint(0, self.num_features, len(empty))
+        population[empty, bits // WORD_BITS] = np.left_shift(
+            WORD.type(1), (bits % WORD_BITS).astype(WORD)
+        )
+        return population
+
+    def _crossover(self, op, a, b):
+        p = op["parameters"]
+        if op["method"] == "nPoint":
+            return packed_n_point(self.rng, a, b, self.num_features, p["n"])
+        elif op["method"] == "uniform":
+            return packed_uniform(self.rng, a, b, self.num_features,
+                                  p.get("preference", 0.5))
+        c1, c2 = crossover(
+            self.rng, op, unpack(a, self.num_features),
+            unpack(b, self.num_features)
+        )
+        return pack(c1), pack(c2)
+
+    def _mutate(self, op, x):
+        p = op["parameters"]
+        if op["method"] == "binary":
+            return packed_binary(self.rng, x, self.num_features,
+                                 p.get("rate", 0.05), p.get("normalize", True))
+        return pack(mutate(self.rng, op, unpack(x, self.num_features)))
+
+    def _encode(self, genomes):
+        return pack(genomes)
+
+    def _record_best(self):
+        i = int(self.scores.argmax())
+        if self.best is None or self.scores[i] > self.bestFitness:
+            self.bestFitness = float(self.scores[i])
+            self.best = unpack(self.population[i], self.num_features)
+            self.last_improvement = self.generation
+
+    def diversity(self):
+        """
+        Mean Hamming distance between pairs of individuals. A bit
+        set in c of m genomes differs in c (m - c) pairs.
+        """
+        m = len(self.population)
+        if m < 2:
+            return 0.0
+        c = bit_counts(self.population)
+        return float((c * (m - c)).sum() / (m * (m - 1) / 2))
@@ -0,0 +1,229 @@
+# Copyright (C) 2020 Juliette Regimbal
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import division, unicode_literals
+
+from collections import defaultdict
+from tempfile import gettempdir, mkstemp
+
+import errno
+import feature_matrix
+import hashlib
+import knn_fitness
+import numpy as np
+import os
+import time
+
+
+# Neighbor lists of optimized classifiers, one per training resource.
+DEFAULT_DIRECTORY = os.path.join(gettempdir(), "biollante-neighbors")
+# Saving evicts lists older than this many seconds, then the least
+# recently used until the directory holds at most this many bytes.
+MAX_CACHE_AGE = 7 * 24 * 3600
+MAX_CACHE_BYTES = 2 ** 30
+# Cached lists are reused while the normalization of the active
+# features moves by less than this (relative to the new deviation).
+STATS_TOLERANCE = 0.01
+
+
+def glyph_keys(path, layout):
+    """
+    A digest of each glyph of a gamera XML file, or list of files
+    (its class name and features in layout order), in file order.
+    """
+    names = [name for name, length in layout]
+    keys = []
+    glyphs = feature_matrix._iter_files(feature_matrix._paths(path))
+    for class_name, glyph_features in glyphs:
+        values = dict(glyph_features)
+        h = hashlib.sha1((class_name or "").encode("utf-8"))
+        for name in names:
+            h.update(np.asarray(values.get(name, []), dtype="<f8").tobytes())
+        keys.append(h.digest())
+    return np.array(keys, dtype="S20")
+
+
+def diff(old_keys, new_keys):
+    """
+    Match glyphs of two versions of a training set by key. Returns
+    the index in the old set of every new glyph (-1 if it was
+    added) and the old indices of removed glyphs.
+    """
+    unmatched = defaultdict(list)
+    for i, key in enumerate(old_keys):
+        unmatched[key].append(i)
+    for rows in unmatched.values():
+        rows.reverse()
+    old_index = np.full(len(new_keys), -1, dtype=np.int64)
+    for i, key in enumerate(new_keys):
+        rows = unmatched.get(key)
+        if rows:
+            old_index[i] = rows.pop()
+    removed = np.setdiff1d(np.arange(len(old_keys)), old_index)
+    return old_index, removed
+
+
+def neighbor_lists(features, weights, k, distance_type, rows=None,
+                   max_bytes=knn_fitness.DEFAULT_MAX_BYTES):
+    """
+    Sorted leave-one-out neighbors of the given rows (all by
+    default) and their distances.
+    """
+    rows = np.arange(len(features)) if rows is None else rows
+    return knn_fitness.k_nearest(
+        features[rows], features, weights, min(k, len(features) - 1),
+        distance_type, rows, max_bytes
+    )
+
+
+def stats_drift(cache, mean, std, weights):
+    """
+    Largest change of the normalization of an active feature.
+    """
+    active = np.flatnonzero(weights)
+    if len(active) == 0:
+        return 0.0
+    return float(max(
+        np.max(np.abs(cache["mean"][active] - mean[active]) / std[active]),
+        np.max(np.abs(cache["std"][active] / std[active] - 1.0))
+    ))
+
+
+class NeighborCache(object):
+    """
+    The leave-one-out neighbor lists of a training resource under
+    the weights of the classifier optimized on it, with the glyph
+    keys and normalization they were computed with. An incremental
+    run updates the lists of the previous resource for the glyphs
+    that were added or removed, instead of recomputing them all.
+    """
+
+    def __init__(self, directory=DEFAULT_DIRECTORY,
+                 max_bytes=MAX_CACHE_BYTES, max_age=MAX_CACHE_AGE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def load(self, key):
+        if not os.path.exists(self.path(key)):
+            return None
+        with np.load(self.path(key)) as f:
+            cache = dict((name, f[name]) for name in f.files)
+        try:
+            # Marks the lists as recently used for evict.
+            os.utime(self.path(key), None)
+        except OSError:
+            pass
+        return cache
+
+    def save(self, key, keys, nearest, dist, weights, distance_type,
+             mean, std):
+        try:
+            os.makedirs(self.directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        # Not named .npz, so evict leaves it alone until renamed.
+        fd, temp = mkstemp(suffix=".tmp", dir=self.directory)
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, keys=keys, nearest=nearest, dist=dist,
+                     weights=weights, distance_type=distance_type,
+                     mean=mean, std=std)
+        os.rename(temp, self.path(key))
+        self.evict()
+
+    def evict(self, now=None):
+        """
+        Remove lists older than max_age, then the least recently
+        used ones while the directory holds more than max_bytes.
+        """
+        now = time.time() if now is None else now
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".npz"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in entries:
+            if now - mtime <= self.max_age and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    @staticmethod
+    def usable(cache, weights, distance_type, k, mean, std):
+        """
+        Whether the cached lists can be updated for these weights,
+        distance, k and (new) normalization.
+        """
+        return cache is not None and \
+            int(cache["distance_type"]) == distance_type and \
+            cache["nearest"].shape[1] >= k and \
+            cache["weights"].shape == weights.shape and \
+            np.allclose(cache["weights"], weights, rtol=1e-5, atol=1e-8) and \
+            stats_drift(cache, mean, std, weights) <= STATS_TOLERANCE
+
+    @staticmethod
+    def update(cache, keys, features, weights, k, distance_type,
+               max_bytes=knn_fitness.DEFAULT_MAX_BYTES):
+        """
+        Neighbor lists of the new training set (features, with
+        glyph keys) from the cached ones. Only the rows of added
+        glyphs, and of glyphs that lost a neighbor, are recomputed;
+        the others are merged with their distances to the added
+        glyphs. Returns (nearest, dist, summary).
+        """
+        old_index, removed = diff(cache["keys"], keys)
+        added = np.flatnonzero(old_index < 0)
+        kept = np.flatnonzero(old_index >= 0)
+        k = min(k, len(features) - 1)
+
+        # Old row -> new row, -1 for removed glyphs.
+        new_index = np.full(len(cache["keys"]), -1, dtype=np.int64)
+        new_index[old_index[kept]] = kept
+        nearest = np.empty((len(features), k), dtype=np.int64)
+        dist = np.empty((len(features), k))
+        old_nearest = new_index[cache["nearest"][old_index[kept], :k]]
+        old_dist = cache["dist"][old_index[kept], :k]
+
+        lost = (old_nearest < 0).any(axis=1)
+        merge = kept[~lost]
+        if len(merge):
+            candidates = old_nearest[~lost]
+            candidate_dist = old_dist[~lost]
+            if len(added):
+                # Only the k nearest added glyphs can enter a list.
+                added_nearest, added_dist = knn_fitness.k_nearest(
+                    features[merge], features[added], weights, k,
+                    distance_type, max_bytes=max_bytes
+                )
+                candidates = np.hstack([candidates, added[added_nearest]])
+                candidate_dist = np.hstack([candidate_dist, added_dist])
+            r = np.arange(len(merge))[:, np.newaxis]
+            order = np.argsort(candidate_dist, axis=1, kind="mergesort")
+            nearest[merge] = candidates[r, order[:, :k]]
+            dist[merge] = candidate_dist[r, order[:, :k]]
+
+        recompute = np.concatenate([added, kept[lost]])
+        if len(recompute):
+            nearest[recompute], dist[recompute] = neighbor_lists(
+                features, weights, k, distance_type, recompute, max_bytes
+            )
+        return nearest, dist, {
+            "glyphs": len(features),
+            "added": len(added),
+            "removed": len(removed),
+            "recomputedRows": len(recompute),
+        }
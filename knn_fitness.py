@@ -0,0 +1,269 @@
+# Copyright (C) 2020 Juliette Regimbal
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import division, unicode_literals
+
+import knn_jit
+import numpy as np
+
+
+# Distance types, numbered as in gamera.knncore.
+DISTANCE_CITY_BLOCK = 0
+DISTANCE_EUCLIDEAN = 1
+DISTANCE_FAST_EUCLIDEAN = 2
+
+# Memory the neighbor search may use for distances at once.
+DEFAULT_MAX_BYTES = 256 * 2 ** 20
+# Reference rows compared with each block of queries.
+REFERENCE_BLOCK = 4096
+# Search neighbors with knn_jit's compiled kernels when numba is
+# installed, for the distances where they beat NumPy: euclidean
+# distances expanded into a matrix product are faster through BLAS.
+USE_JIT = knn_jit.AVAILABLE
+JIT_DISTANCES = (DISTANCE_CITY_BLOCK,)
+
+
+def normalization(features):
+    """
+    Return the per-feature mean and standard deviation
+    gamera's kNN uses to normalize its training data.
+    """
+    mean = features.mean(axis=0)
+    std = features.std(axis=0)
+    std[std == 0] = 1.0
+    return mean, std
+
+
+def normalize(features, mean=None, std=None):
+    """
+    Scale features to zero mean and unit variance. If no
+    statistics are given, they are computed from features.
+    """
+    if mean is None or std is None:
+        mean, std = normalization(features)
+    return (features - mean) / std
+
+
+def distances(queries, reference, weights, distance_type=DISTANCE_CITY_BLOCK):
+    """
+    Weighted distances between every query row and every reference
+    row. Features with a weight of zero are not considered.
+    """
+    # Work in the features' precision (at least float32) so a
+    # float32 training matrix is never widened to float64.
+    dtype = np.promote_types(queries.dtype, np.float32)
+    active = np.flatnonzero(weights)
+    if len(active) < len(weights):
+        queries = queries[:, active]
+        reference = reference[:, active]
+    q = queries.astype(dtype, copy=False)
+    r = reference.astype(dtype, copy=False)
+    w = weights[active].astype(dtype)
+
+    if distance_type == DISTANCE_CITY_BLOCK:
+        # Accumulate one feature at a time to avoid a
+        # (queries x reference x features) temporary.
+        d = np.zeros((q.shape[0], r.shape[0]), dtype=dtype)
+        for j in range(len(active)):
+            d += w[j] * np.abs(q[:, j, np.newaxis] - r[np.newaxis, :, j])
+        return d
+
+    d = (q * q).dot(w)[:, np.newaxis] - 2.0 * (q * w).dot(r.T) \
+        + (r * r).dot(w)[np.newaxis, :]
+    np.maximum(d, 0.0, out=d)
+    if distance_type == DISTANCE_EUCLIDEAN:
+        np.sqrt(d, out=d)
+    return d
+
+
+def block_rows(num_queries, k, reference_rows, itemsize,
+               max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Query rows to process at once so that their distances to a
+    block of reference rows, the distance kernel's temporaries and
+    the running top k candidates stay within max_bytes.
+    """
+    per_row = 3 * reference_rows * itemsize \
+        + (reference_rows + k) * (itemsize + 16)
+    return int(max(1, min(num_queries, max_bytes // per_row)))
+
+
+def k_nearest(queries, reference, weights, k,
+              distance_type=DISTANCE_CITY_BLOCK, exclude=None,
+              max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Indices and distances of the k nearest reference rows of each
+    query, nearest first. The distance matrix is never built in
+    full: blocks of queries are compared with blocks of reference
+    rows, keeping a running top k per query. exclude optionally
+    gives, per query, a reference index that must not be returned
+    (used for leave-one-out).
+    """
+    if USE_JIT and distance_type in JIT_DISTANCES \
+            and knn_jit.supports(queries, reference, weights):
+        nearest, dist = knn_jit.k_nearest(
+            queries, reference, weights, k,
+            distance_type == DISTANCE_CITY_BLOCK, exclude, max_bytes
+        )
+        if distance_type == DISTANCE_EUCLIDEAN:
+            np.sqrt(dist, out=dist)
+        return nearest, dist
+
+    num_queries, num_reference = len(queries), len(reference)
+    k = min(k, num_reference)
+    dtype = np.promote_types(queries.dtype, np.float32)
+    nearest = np.empty((num_queries, k), dtype=np.int64)
+    dist = np.empty((num_queries, k), dtype=dtype)
+    reference_rows = max(min(num_reference, REFERENCE_BLOCK), 1)
+    query_rows = block_rows(
+        num_queries, k, reference_rows, dtype.itemsize, max_bytes
+    )
+
+    for q0 in range(0, num_queries, query_rows):
+        q = queries[q0:q0 + query_rows]
+        rows = np.arange(len(q))[:, np.newaxis]
+        best_d = np.empty((len(q), 0), dtype=dtype)
+        best_i = np.empty((len(q), 0), dtype=np.int64)
+        for r0 in range(0, num_reference, reference_rows):
+            r1 = min(r0 + reference_rows, num_reference)
+            d = distances(q, reference[r0:r1], weights, distance_type)
+            if exclude is not None:
+                e = exclude[q0:q0 + len(q)]
+                inside = np.flatnonzero((e >= r0) & (e < r1))
+                d[inside, e[inside] - r0] = np.inf
+            best_d = np.hstack([best_d, d])
+            best_i = np.hstack([
+                best_i, np.broadcast_to(np.arange(r0, r1), d.shape)
+            ])
+            if best_d.shape[1] > k:
+                keep = np.argpartition(best_d, k - 1, axis=1)[:, :k]
+                best_d = best_d[rows, keep]
+                best_i = best_i[rows, keep]
+        order = np.argsort(best_d, axis=1, kind="mergesort")
+        nearest[q0:q0 + len(q)] = best_i[rows, order]
+        dist[q0:q0 + len(q)] = best_d[rows, order]
+    return nearest, dist
+
+
+def nearest_neighbors(queries, reference, weights, k,
+                      distance_type=DISTANCE_CITY_BLOCK, exclude=None,
+                      max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Return the indices of the k nearest reference rows of each query,
+    nearest first. exclude optionally gives, per query, a reference
+    index that must not be returned (used for leave-one-out).
+    """
+    return k_nearest(
+        queries, reference, weights, k, distance_type, exclude, max_bytes
+    )[0]
+
+
+def vote(neighbor_labels, num_classes):
+    """
+    Majority vote over each row of neighbor labels (nearest first).
+    Ties go to the class whose members rank closest overall.
+    """
+    n, k = neighbor_labels.shape
+    # The rank bonus of a class never adds up to a full vote.
+    bonus = (k - np.arange(k)) / (k * k + 1.0)
+    votes = np.zeros((n, num_classes))
+    rows = np.repeat(np.arange(n), k)
+    np.add.at(
+        votes,
+        (rows, neighbor_labels.ravel()),
+        np.tile(1.0 + bonus, n)
+    )
+    return votes.argmax(axis=1)
+
+
+def weighted_vote(neighbor_labels, multiplicity, num_classes, k):
+    """
+    vote over the first k glyphs of neighbor lists whose entries
+    each stand for multiplicity glyphs (such as the rows of a
+    deduplicated training set): the same vote as over the lists
+    with every entry repeated.
+    """
+    n, columns = neighbor_labels.shape
+    # Glyphs ahead of each entry, and how many of its own count.
+    start = np.cumsum(multiplicity, axis=1) - multiplicity
+    taken = np.clip(k - start, 0, multiplicity).astype(np.float64)
+    # Rank bonus of the glyphs taken, as vote gives each glyph.
+    bonus = (taken * (k - start) - taken * (taken - 1) / 2.0) \
+        / (k * k + 1.0)
+    votes = np.zeros((n, num_classes))
+    rows = np.repeat(np.arange(n), columns)
+    np.add.at(
+        votes, (rows, neighbor_labels.ravel()), (taken + bonus).ravel()
+    )
+    return votes.argmax(axis=1)
+
+
+def leave_one_out_predictions(labels, nearest, k, counts=None):
+    """
+    Leave-one-out k nearest neighbor vote of each training row,
+    over a prefix of its sorted neighbor lists. The rows of a
+    deduplicated training set count as many glyphs as they stand
+    for: a row of count c also has its c - 1 other copies as
+    nearest neighbors.
+    """
+    num_classes = int(labels.max()) + 1
+    if counts is None:
+        return vote(labels[nearest[:, :k]], num_classes)
+    return weighted_vote(
+        np.hstack([labels[:, np.newaxis], labels[nearest[:, :k]]]),
+        np.hstack([counts[:, np.newaxis] - 1, counts[nearest[:, :k]]]),
+        num_classes, k
+    )
+
+
+def classify(queries, reference, labels, weights, k,
+             distance_type=DISTANCE_CITY_BLOCK, exclude=None,
+             max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Label each query by a k nearest neighbor vote over reference.
+    """
+    nearest = nearest_neighbors(
+        queries, reference, weights, k, distance_type, exclude, max_bytes
+    )
+    return vote(labels[nearest], int(labels.max()) + 1)
+
+
+def leave_one_out_neighbors(features, weights, k,
+                            distance_type=DISTANCE_CITY_BLOCK,
+                            max_bytes=DEFAULT_MAX_BYTES):
+    """
+    The k nearest other training samples of every training sample,
+    nearest first. Any smaller k uses a prefix of these lists.
+    """
+    return nearest_neighbors(
+        features, features, weights, k, distance_type,
+        np.arange(len(features)), max_bytes
+    )
+
+
+def leave_one_out_accuracies(labels, nearest, ks, counts=None):
+    """
+    Leave-one-out accuracy for each k in ks, voting over
+    prefixes of the sorted neighbor lists. counts weights the
+    glyphs of a deduplicated training set.
+    """
+    return [
+        float(np.average(
+            leave_one_out_predictions(labels, nearest, k, counts) == labels,
+            weights=counts
+        ))
+        for k in ks
+    ]
+
+
+def leave_one_out_accuracy(features, labels, weights, k,
+                           distance_type=DISTANCE_CITY_BLOCK,
+                           max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Fraction of training samples correctly classified by the
+    remaining samples. This is the fitness gamera's GA optimizes.
+    """
+    nearest = leave_one_out_neighbors(
+        features, weights, k, distance_type, max_bytes
+    )
+    return leave_one_out_accuracies(labels, nearest, [k])[0]
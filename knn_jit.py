@@ -0,0 +1,162 @@
+# Copyright (C) 2020 Juliette Regimbal
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Compiled neighbor search for knn_fitness. Each query's weighted
+distances are accumulated and merged into its top k as they are
+computed, so no distance matrix is built, and queries run in
+parallel. numba is optional: without it AVAILABLE is False and
+knn_fitness keeps its NumPy kernels (the functions below still
+run, slowly, as plain Python).
+"""
+
+from __future__ import division, unicode_literals
+
+import numpy as np
+import os
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+AVAILABLE = numba is not None
+# Feature dtypes the compiled kernels are built for.
+DTYPES = (np.dtype(np.float32), np.dtype(np.float64))
+# Features summed between checks against the current k-th distance.
+PRUNE_FEATURES = 16
+
+if AVAILABLE and "NUMBA_THREADING_LAYER" not in os.environ:
+    # The GA evaluates genomes on several threads at once, which
+    # numba's default workqueue layer does not support.
+    numba.config.THREADING_LAYER = "threadsafe"
+
+
+def _jit(**options):
+    if numba is None:
+        return lambda f: f
+    return numba.njit(nogil=True, cache=True, fastmath=True, **options)
+
+
+prange = range if numba is None else numba.prange
+
+
+@_jit()
+def _merge_row(queries, reference, offset, city_block, zero,
+               exclude, nearest, dist, i):
+    k = nearest.shape[1]
+    m = queries.shape[1]
+    worst = dist[i, k - 1]
+    for r in range(reference.shape[0]):
+        if r + offset == exclude[i]:
+            continue
+        d = 0.0
+        for a0 in range(0, m, PRUNE_FEATURES):
+            # Summed in the features' precision, which vectorizes.
+            s = zero
+            if city_block:
+                for a in range(a0, min(a0 + PRUNE_FEATURES, m)):
+                    s += abs(queries[i, a] - reference[r, a])
+            else:
+                for a in range(a0, min(a0 + PRUNE_FEATURES, m)):
+                    x = queries[i, a] - reference[r, a]
+                    s += x * x
+            d += s
+            # Weights are non-negative: the partial sum only grows.
+            if d >= worst:
+                break
+        if d < worst:
+            # Insert after any equal distance: ties keep the lower index.
+            p = k - 1
+            while p > 0 and dist[i, p - 1] > d:
+                dist[i, p] = dist[i, p - 1]
+                nearest[i, p] = nearest[i, p - 1]
+                p -= 1
+            dist[i, p] = d
+            nearest[i, p] = r + offset
+            worst = dist[i, k - 1]
+
+
+@_jit(parallel=True)
+def _merge_parallel(queries, reference, offset, city_block, zero,
+                    exclude, nearest, dist):
+    for i in prange(queries.shape[0]):
+        _merge_row(queries, reference, offset, city_block, zero,
+                   exclude, nearest, dist, i)
+
+
+@_jit()
+def _merge_serial(queries, reference, offset, city_block, zero,
+                  exclude, nearest, dist):
+    for i in range(queries.shape[0]):
+        _merge_row(queries, reference, offset, city_block, zero,
+                   exclude, nearest, dist, i)
+
+
+_parallel = {"usable": AVAILABLE}
+
+
+def _merge(*args):
+    if _parallel["usable"]:
+        try:
+            return _merge_parallel(*args)
+        except ValueError:
+            # No thread-safe threading layer (TBB or OpenMP).
+            _parallel["usable"] = False
+    return _merge_serial(*args)
+
+
+def supports(queries, reference, weights):
+    """
+    Whether the compiled kernels handle these features and weights.
+    """
+    return queries.dtype in DTYPES and reference.dtype == queries.dtype \
+        and bool(np.all(np.asarray(weights) >= 0))
+
+
+def _scaled(features, active, scale):
+    return np.ascontiguousarray(features[:, active] * scale)
+
+
+def k_nearest(queries, reference, weights, k, city_block, exclude=None,
+              max_bytes=None):
+    """
+    Indices and weighted distances (squared for euclidean) of the k
+    nearest reference rows of each query, nearest first, as
+    knn_fitness.k_nearest returns them. The active features of
+    blocks of queries and reference rows are gathered and scaled
+    by their weights (square roots for euclidean), holding at most
+    max_bytes at once. Weights must be non-negative.
+    """
+    num_queries, num_reference = len(queries), len(reference)
+    k = min(k, num_reference)
+    dtype = queries.dtype
+    active = np.flatnonzero(weights)
+    weights = np.asarray(weights, dtype=np.float64)[active]
+    scale = (weights if city_block else np.sqrt(weights)).astype(dtype)
+    exclude = np.full(num_queries, -1, dtype=np.int64) if exclude is None \
+        else np.asarray(exclude, dtype=np.int64)
+    nearest = np.full((num_queries, k), -1, dtype=np.int64)
+    dist = np.full((num_queries, k), np.inf)
+    if k == 0 or num_queries == 0:
+        return nearest, dist.astype(dtype)
+
+    rows = num_queries + num_reference if max_bytes is None else max(
+        max_bytes // max(2 * dtype.itemsize * len(active), 1), 1
+    )
+    zero = dtype.type(0)
+    for q0 in range(0, num_queries, rows):
+        q = _scaled(queries[q0:q0 + rows], active, scale)
+        for r0 in range(0, num_reference, rows):
+            _merge(
+                q, _scaled(reference[r0:r0 + rows], active, scale), r0,
+                city_block, zero, exclude[q0:q0 + rows],
+                nearest[q0:q0 + rows], dist[q0:q0 + rows]
+            )
+    # As in the NumPy kernel, an excluded row fills a list
+    # longer than the other rows.
+    unfilled = nearest < 0
+    nearest[unfilled] = np.broadcast_to(exclude[:, np.newaxis],
+                                        nearest.shape)[unfilled]
+    return nearest, dist.astype(dtype)
@@ -21,6 +21,9 @@ DEFAULT_EVAL_N = 5000
 DEFAULT_GEN_N = 100
 DEFAULT_MIN_GEN = 40
 DEFAULT_NO_CHANGE_GEN = 10
+DEFAULT_WALL_CLOCK = 3600           # seconds
+DEFAULT_IMPROVEMENT_RATE = 0.001    # fitness per CPU minute
+DEFAULT_RATE_WINDOW = 10            # CPU minutes
 
 
 class SerializableSelection():
@@ -562,6 +565,53 @@ class SerializableStopCriteria:
         self.methods.sort()
         self.sc.setSteadyStateStop(minGens, noChangeGens)
 
+    # The following criteria are not part of gamera's GAStopCriteria.
+    # They are checked by the job while polling the optimizer.
+
+    def setMaxWallClock(self, seconds=DEFAULT_WALL_CLOCK):
+        self.methods = [x for x in self.methods
+                        if x["method"] != "maxWallClock"]
+        self.methods.append(
+            {
+                "method": "maxWallClock",
+                "parameters": {"seconds": seconds}
+            }
+        )
+        self.methods.sort()
+
+    def setDeadline(self, timestamp):
+        self.methods = [x for x in self.methods
+                        if x["method"] != "deadline"]
+        self.methods.append(
+            {
+                "method": "deadline",
+                "parameters": {"timestamp": timestamp}
+            }
+        )
+        self.methods.sort()
+
+    def setImprovementRateStop(
+        self,
+        rate=DEFAULT_IMPROVEMENT_RATE,
+        window=DEFAULT_RATE_WINDOW
+    ):
+        if rate <= 0:
+            raise ValueError("Improvement rate must be positive: %r" % rate)
+        if window <= 0:
+            raise ValueError("Rate window must be positive: %r" % window)
+        self.methods = [x for x in self.methods
+                        if x["method"] != "improvementRate"]
+        self.methods.append(
+            {
+                "method": "improvementRate",
+                "parameters": {
+                    "rate": rate,
+                    "window": window
+                }
+            }
+        )
+        self.methods.sort()
+
     def toJSON(self):
         return json.dumps(self.methods)
 
@@ -601,6 +651,22 @@ class SerializableStopCriteria:
                     e.setSteadyStateStop(noChangeGens=p["noChangeGens"])
                 else:
                     e.setSteadyStateStop()
+            elif m == "maxWallClock":
+                if "seconds" in p:
+                    e.setMaxWallClock(p["seconds"])
+                else:
+                    e.setMaxWallClock()
+            elif m == "deadline":
+                e.setDeadline(p["timestamp"])
+            elif m == "improvementRate":
+                if "rate" in p and "window" in p:
+                    e.setImprovementRateStop(p["rate"], p["window"])
+                elif "rate" in p:
+                    e.setImprovementRateStop(p["rate"])
+                elif "window" in p:
+                    e.setImprovementRateStop(window=p["window"])
+                else:
+                    e.setImprovementRateStop()
         return e
 
 
@@ -0,0 +1,115 @@
+# Copyright (C) 2020 Juliette Regimbal
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import division, unicode_literals
+
+import classifier_bundle
+import knn_fitness
+import numpy as np
+import time
+
+
+# Glyphs classified to measure throughput, and timed repetitions.
+THROUGHPUT_GLYPHS = 1000
+THROUGHPUT_REPEATS = 3
+
+
+def confusion(labels, predicted, num_classes, counts=None):
+    """
+    Glyphs of each class (rows) by the class they were assigned
+    (columns). counts weights the rows of a deduplicated matrix.
+    """
+    matrix = np.zeros((num_classes, num_classes), dtype=np.int64)
+    np.add.at(
+        matrix, (labels.astype(np.int64), predicted.astype(np.int64)),
+        1 if counts is None else counts
+    )
+    return matrix
+
+
+def throughput(bundle, queries, repeats=THROUGHPUT_REPEATS):
+    """
+    Glyphs per second the bundle classifies in one batch (the
+    best of repeats, after a warm-up on a few glyphs).
+    """
+    bundle.predict(queries[:1])
+    best = None
+    for _ in range(repeats):
+        start = time.time()
+        bundle.predict(queries)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(queries) / max(best, 1e-9)
+
+
+def evaluate(matrix, weights, k, distance_type, queries,
+             max_bytes=knn_fitness.DEFAULT_MAX_BYTES):
+    """
+    Leave-one-out accuracy, per-class confusion, active features
+    and batch classification throughput of a classifier on a
+    normalized training matrix. queries are raw feature vectors
+    to time classification on.
+    """
+    nearest = knn_fitness.leave_one_out_neighbors(
+        matrix.features, weights, k, distance_type, max_bytes
+    )
+    num_classes = len(matrix.class_names)
+    predicted = knn_fitness.leave_one_out_predictions(
+        matrix.labels, nearest, k, matrix.counts
+    )
+    table = confusion(matrix.labels, predicted, num_classes, matrix.counts)
+    glyphs = table.sum(axis=1)
+    bundle = classifier_bundle.ClassifierBundle.from_matrix(
+        matrix, weights, k, distance_type
+    )
+    return {
+        "k": int(k),
+        "distanceType": int(distance_type),
+        "accuracy": knn_fitness.leave_one_out_accuracies(
+            matrix.labels, nearest, [k], matrix.counts
+        )[0],
+        "activeFeatures": int(np.count_nonzero(weights)),
+        "confusion": table.tolist(),
+        "perClass": dict(
+            (name, {
+                "glyphs": int(glyphs[c]),
+                "accuracy": None if glyphs[c] == 0
+                else float(table[c, c] / glyphs[c])
+            })
+            for c, name in enumerate(matrix.class_names)
+        ),
+        "glyphsPerSecond": throughput(bundle, queries)
+    }
+
+
+def sample_queries(matrix, num_glyphs=THROUGHPUT_GLYPHS, seed=0):
+    """
+    Raw feature vectors of up to num_glyphs training glyphs.
+    """
+    rng = np.random.RandomState(seed)
+    rows = np.sort(rng.permutation(len(matrix))[:num_glyphs])
+    return matrix.features[rows].astype(np.float64) * matrix.std \
+        + matrix.mean
+
+
+def compare(matrix, before, after, max_bytes=knn_fitness.DEFAULT_MAX_BYTES):
+    """
+    Report on the classifier before and after optimization, each
+    given as (weights, k, distance type), on the same matrix.
+    """
+    queries = sample_queries(matrix)
+    report = {
+        "glyphs": matrix.num_glyphs,
+        "classes": matrix.class_names,
+        "features": matrix.num_features,
+        "throughputGlyphs": len(queries),
+        "before": evaluate(matrix, *before, queries=queries,
+                           max_bytes=max_bytes),
+        "after": evaluate(matrix, *after, queries=queries,
+                          max_bytes=max_bytes)
+    }
+    report["accuracyChange"] = \
+        report["after"]["accuracy"] - report["before"]["accuracy"]
+    report["speedup"] = report["after"]["glyphsPerSecond"] \
+        / report["before"]["glyphsPerSecond"]
+    return report
@@ -0,0 +1,105 @@
+# Copyright (C) 2020 Juliette Regimbal
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import division, unicode_literals
+
+from contextlib import contextmanager
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import resource
+import time
+
+
+# Number of functions kept from a cProfile capture.
+DEFAULT_PROFILE_LINES = 30
+
+
+def rss_bytes():
+    """
+    Current resident set size of this process, or None
+    where /proc is not available.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (IOError, OSError):
+        return None
+    return pages * os.sysconf(str("SC_PAGE_SIZE"))
+
+
+def peak_rss_bytes():
+    """
+    Peak resident set size of this process (ru_maxrss is in KiB
+    on Linux and in bytes on macOS; Rodan workers run Linux).
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+class PhaseProfiler(object):
+    """
+    Record wall time, CPU time and memory use of named phases
+    of a job and log each one as a JSON line.
+    """
+
+    def __init__(self, logger=None, context=None):
+        self.logger = logger
+        self.context = context or {}
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        rss = rss_bytes()
+        wall = time.time()
+        cpu = cpu_seconds()
+        try:
+            yield
+        finally:
+            record = {
+                "phase": name,
+                "wall": time.time() - wall,
+                "cpu": cpu_seconds() - cpu,
+                "rss": rss_bytes(),
+                "rssDelta": None if rss is None else rss_bytes() - rss,
+                "peakRss": peak_rss_bytes(),
+            }
+            self.phases.append(record)
+            if self.logger is not None:
+                entry = dict(self.context)
+                entry.update(record)
+                self.logger.info(json.dumps(entry, sort_keys=True))
+
+    def summary(self):
+        return list(self.phases)
+
+
+@contextmanager
+def capture(enabled=True, lines=DEFAULT_PROFILE_LINES):
+    """
+    Run the enclosed block under cProfile (if enabled). The yielded
+    dictionary receives the top functions by cumulative time under
+    "stats" once the block exits.
+    """
+    result = {}
+    if not enabled:
+        yield result
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield result
+    finally:
+        profiler.disable()
+        stream = io.BytesIO() if str is bytes else io.StringIO()
+        stats = pstats.Stats(profiler, stream=stream)
+        stats.sort_stats(str("cumulative")).print_stats(lines)
+        result["stats"] = stream.getvalue()
@@ -0,0 +1,138 @@
+# Copyright (C) 2020 Juliette Regimbal
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import division, unicode_literals
+
+from tempfile import gettempdir, mkstemp
+
+import json
+import os
+import time
+
+
+# Progress files of running jobs are written here so
+# operators (and the interface) can poll them.
+DEFAULT_DIRECTORY = os.path.join(gettempdir(), "biollante-progress")
+
+
+def create_progress_file(directory=DEFAULT_DIRECTORY):
+    """
+    Create an empty JSON lines progress file and return its path.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd, path = mkstemp(prefix="biollante-", suffix=".jsonl", dir=directory)
+    os.close(fd)
+    return path
+
+
+def read_latest(path):
+    """
+    Return the last record of a progress file, or None.
+    """
+    if path is None or not os.path.exists(path):
+        return None
+    latest = None
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                latest = line
+    return None if latest is None else json.loads(latest)
+
+
+class ProgressTracker(object):
+    """
+    Turn periodic (generation, best fitness) samples into
+    throughput and time-to-completion estimates for each active
+    stop criterion, appending each sample to a JSON lines file.
+    """
+
+    def __init__(self, stop_criteria, population_size, path=None,
+                 start=None):
+        self.stop_criteria = stop_criteria
+        self.population_size = population_size
+        self.path = path
+        self.start = time.time() if start is None else start
+        self.best_fitness = None
+        self.last_improvement = 0
+        self.latest = None
+
+    def estimates(self, generation, evaluations, elapsed, now):
+        """
+        Seconds until each stop criterion would trigger at the
+        current rate (None if it cannot be predicted).
+        """
+        generation_rate = generation / elapsed if elapsed > 0 else 0.0
+        evaluation_rate = evaluations / elapsed if elapsed > 0 else 0.0
+
+        def remaining(todo, rate):
+            if rate <= 0:
+                return None
+            return max(todo, 0) / rate
+
+        eta = {}
+        for criterion in self.stop_criteria:
+            m = criterion["method"]
+            p = criterion["parameters"]
+            if m == "maxGenerations":
+                eta[m] = remaining(p["n"] - generation, generation_rate)
+            elif m == "maxFitnessEvals":
+                eta[m] = remaining(p["n"] - evaluations, evaluation_rate)
+            elif m == "steadyState":
+                # Earliest stop, assuming fitness no longer improves.
+                stop = max(
+                    p["minGens"],
+                    self.last_improvement + p["noChangeGens"]
+                )
+                eta[m] = remaining(stop - generation, generation_rate)
+            elif m == "maxWallClock":
+                eta[m] = max(p["seconds"] - elapsed, 0.0)
+            elif m == "deadline":
+                eta[m] = max(p["timestamp"] - now, 0.0)
+            else:
+                eta[m] = None
+        return eta
+
+    def update(self, generation, best_fitness, evaluations=None, now=None,
+               finished=False, scheduling=None, diversity=None):
+        """
+        Record a sample and return the resulting progress record.
+        Evaluations default to one per individual per generation.
+        scheduling optionally describes the job's core allocation,
+        and diversity the population's relative diversity.
+        """
+        now = time.time() if now is None else now
+        elapsed = now - self.start
+        estimated = evaluations is None
+        if estimated:
+            evaluations = generation * self.population_size
+
+        if self.best_fitness is None or best_fitness > self.best_fitness:
+            self.best_fitness = best_fitness
+            self.last_improvement = generation
+
+        eta = self.estimates(generation, evaluations, elapsed, now)
+        known = [v for v in eta.values() if v is not None]
+        record = {
+            "time": now,
+            "elapsed": elapsed,
+            "generation": generation,
+            "evaluations": evaluations,
+            "evaluationsEstimated": estimated,
+            "evaluationsPerSecond": evaluations / elapsed
+            if elapsed > 0 else None,
+            "bestFitness": best_fitness,
+            "lastImprovement": self.last_improvement,
+            # The GA stops as soon as any one criterion is met.
+            "eta": 0.0 if finished else (min(known) if known else None),
+            "etaByCriterion": eta,
+            "finished": finished,
+            "scheduling": scheduling,
+            "diversity": diversity,
+        }
+        self.latest = record
+
+        if self.path is not None:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record, sort_keys=True) + "\n")
+        return record
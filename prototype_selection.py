@@ -0,0 +1,245 @@
+# Copyright (C) 2020 Juliette Regimbal
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import division, unicode_literals
+
+import json
+import knn_fitness
+import numpy as np
+
+
+DEFAULT_TOLERANCE = 0.01
+DEFAULT_EDIT_K = 3
+
+
+class SerializableCondensation:
+    """
+    Settings for reducing a training set to a subset of
+    prototype glyphs instead of optimizing its features.
+    """
+
+    def __init__(self):
+        self.method = None
+        self.parameters = {}
+
+    def __eq__(self, other):
+        if isinstance(other, self.__class__):
+            return self.__dict__ == other.__dict__
+        else:
+            return False
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def setCondensedNearestNeighbor(self, tolerance=DEFAULT_TOLERANCE):
+        self.method = "cnn"
+        self.parameters = {"tolerance": tolerance}
+
+    def setEditedNearestNeighbor(
+        self,
+        k=DEFAULT_EDIT_K,
+        tolerance=DEFAULT_TOLERANCE
+    ):
+        self.method = "enn"
+        self.parameters = {"k": k, "tolerance": tolerance}
+
+    def setEditedCondensedNearestNeighbor(
+        self,
+        k=DEFAULT_EDIT_K,
+        tolerance=DEFAULT_TOLERANCE
+    ):
+        self.method = "enn_cnn"
+        self.parameters = {"k": k, "tolerance": tolerance}
+
+    def toJSON(self):
+        return json.dumps(self.__dict__)
+
+    @staticmethod
+    def fromJSON(jsonString):
+        d = json.loads(jsonString)
+        return SerializableCondensation.from_dict(d)
+
+    @staticmethod
+    def from_dict(d):
+        p = d["parameters"]
+        e = SerializableCondensation()
+        tolerance = p.get("tolerance", DEFAULT_TOLERANCE)
+
+        if d["method"] == "cnn":
+            e.setCondensedNearestNeighbor(tolerance)
+        elif d["method"] == "enn":
+            e.setEditedNearestNeighbor(
+                p.get("k", DEFAULT_EDIT_K), tolerance
+            )
+        elif d["method"] == "enn_cnn":
+            e.setEditedCondensedNearestNeighbor(
+                p.get("k", DEFAULT_EDIT_K), tolerance
+            )
+        return e
+
+
+def edited_nearest_neighbor(features, labels, weights, k,
+                            distance_type=knn_fitness.DISTANCE_CITY_BLOCK,
+                            candidates=None,
+                            max_bytes=knn_fitness.DEFAULT_MAX_BYTES):
+    """
+    Wilson editing: drop every candidate that is misclassified
+    by its k nearest neighbors among the other candidates.
+    Returns the indices that are kept.
+    """
+    if candidates is None:
+        candidates = np.arange(len(labels))
+    x = features[candidates]
+    y = labels[candidates]
+    predicted = knn_fitness.classify(
+        x, x, y, weights, k, distance_type,
+        exclude=np.arange(len(candidates)), max_bytes=max_bytes
+    )
+    return candidates[predicted == y]
+
+
+def condensed_nearest_neighbor(features, labels, weights,
+                               distance_type=knn_fitness.DISTANCE_CITY_BLOCK,
+                               candidates=None):
+    """
+    Hart's condensed nearest neighbor rule: grow a prototype set
+    until every candidate is classified correctly by its nearest
+    prototype. Returns the sorted prototype indices.
+    """
+    if candidates is None:
+        candidates = np.arange(len(labels))
+    x = features[candidates]
+    y = labels[candidates]
+    n = len(candidates)
+
+    # Nearest prototype found so far for each candidate.
+    nearest_distance = np.full(n, np.inf)
+    nearest_label = np.full(n, -1, dtype=np.int64)
+    is_prototype = np.zeros(n, dtype=bool)
+
+    def add(i):
+        is_prototype[i] = True
+        d = knn_fitness.distances(x, x[i:i + 1], weights, distance_type)
+        d = d[:, 0]
+        closer = d < nearest_distance
+        nearest_distance[closer] = d[closer]
+        nearest_label[closer] = y[i]
+
+    # Seed with the first sample of every class.
+    for label in np.unique(y):
+        add(np.flatnonzero(y == label)[0])
+
+    changed = True
+    while changed:
+        changed = False
+        for i in range(n):
+            if not is_prototype[i] and nearest_label[i] != y[i]:
+                add(i)
+                changed = True
+
+    return np.sort(candidates[is_prototype])
+
+
+def reduced_predictions(features, labels, weights, k, keep,
+                        distance_type=knn_fitness.DISTANCE_CITY_BLOCK,
+                        max_bytes=knn_fitness.DEFAULT_MAX_BYTES):
+    """
+    Classify every training sample against only the kept
+    prototypes. Prototypes are classified leave-one-out.
+    """
+    # Non-prototypes exclude nothing.
+    exclude = np.full(len(labels), -1, dtype=np.int64)
+    exclude[keep] = np.arange(len(keep))
+    k = min(k, len(keep) - 1) if len(keep) > 1 else 1
+    nearest = knn_fitness.nearest_neighbors(
+        features, features[keep], weights, k, distance_type, exclude,
+        max_bytes
+    )
+    return knn_fitness.vote(labels[keep][nearest], int(labels.max()) + 1)
+
+
+def supporting_samples(features, labels, weights, keep, prototypes,
+                       distance_type=knn_fitness.DISTANCE_CITY_BLOCK,
+                       max_bytes=knn_fitness.DEFAULT_MAX_BYTES):
+    """
+    For each given prototype, the index of the nearest sample of
+    the same class that is not kept, if there is one.
+    """
+    missing = np.setdiff1d(np.arange(len(labels)), keep)
+    found = [np.array([], dtype=int)]
+    for label in np.unique(labels[prototypes]):
+        candidates = missing[labels[missing] == label]
+        if len(candidates):
+            nearest = knn_fitness.nearest_neighbors(
+                features[prototypes[labels[prototypes] == label]],
+                features[candidates], weights, 1, distance_type,
+                max_bytes=max_bytes
+            )
+            found.append(candidates[nearest[:, 0]])
+    return np.unique(np.concatenate(found))
+
+
+def condense(features, labels, weights, k, condensation,
+             distance_type=knn_fitness.DISTANCE_CITY_BLOCK,
+             max_bytes=knn_fitness.DEFAULT_MAX_BYTES):
+    """
+    Select prototypes as configured by a SerializableCondensation.
+    Misclassified samples are added back (in order) until the
+    accuracy is within the tolerance of the full training set.
+
+    Features are expected to be normalized already; max_bytes
+    bounds the memory of each neighbor search. Returns the kept
+    indices and a summary of the reduction.
+    """
+    method = condensation.method
+    p = condensation.parameters
+    tolerance = p.get("tolerance", DEFAULT_TOLERANCE)
+
+    baseline = knn_fitness.leave_one_out_accuracy(
+        features, labels, weights, k, distance_type, max_bytes
+    )
+
+    keep = np.arange(len(labels))
+    if method in ("enn", "enn_cnn"):
+        keep = edited_nearest_neighbor(
+            features, labels, weights, p.get("k", DEFAULT_EDIT_K),
+            distance_type, max_bytes=max_bytes
+        )
+    if method in ("cnn", "enn_cnn"):
+        keep = condensed_nearest_neighbor(
+            features, labels, weights, distance_type, keep
+        )
+
+    predicted = reduced_predictions(
+        features, labels, weights, k, keep, distance_type, max_bytes
+    )
+    accuracy = float(np.mean(predicted == labels))
+    while baseline - accuracy > tolerance:
+        wrong = np.setdiff1d(np.flatnonzero(predicted != labels), keep)
+        if len(wrong) == 0:
+            # Only prototypes are misclassified; support them
+            # with their nearest removed sample of the same class.
+            wrong = supporting_samples(
+                features, labels, weights, keep,
+                np.intersect1d(np.flatnonzero(predicted != labels), keep),
+                distance_type, max_bytes
+            )
+            if len(wrong) == 0:
+                break
+        # Add back a batch proportional to the accuracy gap.
+        batch = max(1, int(np.ceil(
+            (baseline - accuracy - tolerance) * len(labels)
+        )))
+        keep = np.union1d(keep, wrong[:batch])
+        predicted = reduced_predictions(
+            features, labels, weights, k, keep, distance_type, max_bytes
+        )
+        accuracy = float(np.mean(predicted == labels))
+
+    return keep, {
+        "method": method,
+        "glyphs": int(len(labels)),
+        "prototypes": int(len(keep)),
+        "accuracyBefore": baseline,
+        "accuracyAfter": accuracy,
+    }
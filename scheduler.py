@@ -0,0 +1,200 @@
+# Copyright (C) 2020 Juliette Regimbal
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import division, unicode_literals
+
+from multiprocessing import cpu_count
+from tempfile import gettempdir
+from time import sleep
+
+import errno
+import fcntl
+import json
+import os
+import time
+import uuid
+
+
+# Leases of every Biollante job on the host are kept here.
+DEFAULT_DIRECTORY = os.path.join(gettempdir(), "biollante-leases")
+# Leases not renewed for this many seconds are considered abandoned.
+LEASE_TIMEOUT = 300
+# Seconds between checks while waiting for a core.
+WAIT_INTERVAL = 5
+
+
+def fair_shares(requests, total):
+    """
+    Split total cores between leases, given as (id, requested)
+    pairs in arrival order. Cores are spread evenly, no lease gets
+    more than it asked for, and leases beyond the number of cores
+    get none (they are queued) instead of oversubscribing the host.
+    """
+    shares = dict((lease, 0) for lease, requested in requests)
+    running = [(lease, max(requested, 1))
+               for lease, requested in requests][:total]
+    remaining = total
+    while remaining > 0:
+        wanting = [(lease, requested) for lease, requested in running
+                   if shares[lease] < requested]
+        if not wanting:
+            break
+        each = remaining // len(wanting)
+        if each == 0:
+            # Hand out what is left in arrival order.
+            for lease, requested in wanting[:remaining]:
+                shares[lease] += 1
+            break
+        for lease, requested in wanting:
+            extra = min(each, requested - shares[lease])
+            shares[lease] += extra
+            remaining -= extra
+    return shares
+
+
+def split_cores(num_tasks, cores):
+    """
+    Threads of each worker running num_tasks independent tasks on
+    cores: one worker per task up to the number of cores, with the
+    cores spread evenly between them.
+    """
+    workers = max(min(num_tasks, cores), 1)
+    return [cores // workers + (1 if i < cores % workers else 0)
+            for i in range(workers)]
+
+
+def process_alive(pid):
+    """
+    Whether a process with this id exists on the host.
+    """
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+class CoreLease(object):
+    """
+    A job's claim on a share of the host's CPU cores. Leases are
+    JSON files in a shared directory, updated under a file lock, so
+    concurrent jobs on the same host see each other.
+    """
+
+    def __init__(self, requested=None, directory=DEFAULT_DIRECTORY,
+                 total=None):
+        self.total = cpu_count() if total is None else total
+        self.requested = self.total if requested is None else requested
+        self.directory = directory
+        self.id = "%d-%s" % (os.getpid(), uuid.uuid4().hex)
+        self.path = os.path.join(directory, self.id + ".json")
+        self.started = None
+        self.cores = 0
+        self._status = {}
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+    def _lock(self):
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        lock = open(os.path.join(self.directory, ".lock"), "a")
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    def _write(self):
+        with open(self.path, "w") as f:
+            json.dump({
+                "pid": os.getpid(),
+                "requested": self.requested,
+                "started": self.started,
+                "heartbeat": time.time(),
+            }, f)
+
+    def _leases(self):
+        """
+        Live leases as (id, lease) in arrival order; abandoned
+        leases are removed. Must be called with the lock held.
+        """
+        leases = []
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path) as f:
+                    lease = json.load(f)
+            except (IOError, OSError, ValueError):
+                continue
+            if now - lease["heartbeat"] > LEASE_TIMEOUT or \
+                    not process_alive(lease["pid"]):
+                os.remove(path)
+                continue
+            leases.append((name[:-len(".json")], lease))
+        leases.sort(key=lambda x: (x[1]["started"], x[0]))
+        return leases
+
+    def _update(self):
+        lock = self._lock()
+        try:
+            self._write()
+            leases = self._leases()
+        finally:
+            lock.close()
+        shares = fair_shares(
+            [(i, lease["requested"]) for i, lease in leases],
+            self.total
+        )
+        self.cores = shares.get(self.id, 0)
+        self._status = {
+            "cores": self.cores,
+            "requested": self.requested,
+            "hostCores": self.total,
+            "jobs": len(leases),
+            "queueDepth": len([s for s in shares.values() if s == 0]),
+            "allocations": shares,
+        }
+        return self.cores
+
+    def acquire(self, wait=True):
+        """
+        Register the lease and return the number of cores granted.
+        If wait is set, block until at least one core is granted.
+        """
+        self.started = time.time()
+        cores = self._update()
+        while wait and cores == 0:
+            sleep(WAIT_INTERVAL)
+            cores = self._update()
+        return cores
+
+    def renew(self):
+        """
+        Refresh the lease and return the (possibly changed) share.
+        """
+        return self._update()
+
+    def status(self):
+        """
+        The latest allocation, the number of jobs on the host, and
+        how many of them are queued waiting for a core.
+        """
+        return dict(self._status)
+
+    def release(self):
+        lock = self._lock()
+        try:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        finally:
+            lock.close()
+        self.cores = 0
@@ -0,0 +1,169 @@
+# Copyright (C) 2020 Juliette Regimbal
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import division, unicode_literals
+
+from tempfile import gettempdir
+
+import errno
+import fcntl
+import feature_matrix
+import hashlib
+import json
+import numpy as np
+import os
+import scheduler
+import uuid
+
+
+# /dev/shm is RAM-backed, so matrices stored there are shared
+# between processes without touching the disk.
+SHM_DIRECTORY = os.path.join("/dev/shm", "biollante") \
+    if os.path.isdir("/dev/shm") \
+    else os.path.join(gettempdir(), "biollante-shm")
+DISK_DIRECTORY = os.path.join(gettempdir(), "biollante-store")
+
+HASH_CHUNK = 1024 * 1024
+
+
+def content_key(path, layout, precision, options=None):
+    """
+    Key a training matrix by the contents of its resource (or list
+    of resources, in order) and the feature layout, precision and
+    any other options (e.g. deduplication) it is built with.
+    """
+    h = hashlib.sha1()
+    for p in path if isinstance(path, (list, tuple)) else [path]:
+        with open(p, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+                h.update(chunk)
+    key = [layout, precision]
+    if options is not None:
+        key.append(options)
+    h.update(json.dumps(key, sort_keys=True).encode("utf-8"))
+    return h.hexdigest()
+
+
+class SharedMatrixStore(object):
+    """
+    One read-only, normalized copy of each training matrix on the
+    host, memory-mapped by every job that attaches to it. Each
+    attached job holds a reference file; the matrix is deleted
+    when the last reference is released.
+    """
+
+    def __init__(self, directory=SHM_DIRECTORY):
+        self.directory = directory
+
+    def _path(self, key, suffix):
+        return os.path.join(self.directory, key + suffix)
+
+    def _lock(self, key):
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        path = self._path(key, ".lock")
+        while True:
+            lock = open(path, "a")
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # The last release removes the lock file; if it did while
+            # we waited, lock the new file instead.
+            try:
+                if os.stat(path).st_ino == os.fstat(lock.fileno()).st_ino:
+                    return lock
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    lock.close()
+                    raise
+            lock.close()
+
+    def _references(self, key):
+        """
+        Live references to key; those of dead processes are removed.
+        Must be called with the key's lock held.
+        """
+        references = []
+        for name in os.listdir(self.directory):
+            if not (name.startswith(key + ".") and name.endswith(".ref")):
+                continue
+            pid = int(name[len(key) + 1:].split("-")[0])
+            if scheduler.process_alive(pid):
+                references.append(name)
+            else:
+                os.remove(os.path.join(self.directory, name))
+        return references
+
+    def _save(self, key, matrix):
+        np.save(self._path(key, ".labels.npy"), matrix.labels)
+        if matrix.counts is not None:
+            np.save(self._path(key, ".counts.npy"), matrix.counts)
+            np.save(self._path(key, ".rows.npy"), matrix.rows)
+        with open(self._path(key, ".json"), "w") as f:
+            json.dump({
+                "class_names": matrix.class_names,
+                "layout": matrix.layout,
+                "mean": matrix.mean.tolist(),
+                "std": matrix.std.tolist(),
+                "deduplicated": matrix.counts is not None,
+            }, f)
+        # Written last: its presence marks a complete entry.
+        os.rename(matrix.path, self._path(key, ".features.npy"))
+
+    def attach(self, key, build):
+        """
+        Return the shared matrix for key, calling build() to create a
+        memory-mapped FeatureMatrix in this store's directory if no
+        job has stored it yet. Close the result to release it.
+        """
+        lock = self._lock(key)
+        try:
+            if not os.path.exists(self._path(key, ".features.npy")):
+                matrix = build()
+                matrix.normalize()
+                matrix.features.flush()
+                self._save(key, matrix)
+                del matrix
+            reference = "%s.%d-%s.ref" % (key, os.getpid(), uuid.uuid4().hex)
+            open(os.path.join(self.directory, reference), "w").close()
+        finally:
+            lock.close()
+
+        with open(self._path(key, ".json")) as f:
+            meta = json.load(f)
+        matrix = feature_matrix.FeatureMatrix(
+            np.load(self._path(key, ".features.npy"), mmap_mode="r"),
+            np.load(self._path(key, ".labels.npy")),
+            meta["class_names"],
+            [tuple(x) for x in meta["layout"]],
+            mode=feature_matrix.MODE_SHARED,
+            release=lambda: self.release(key, reference)
+        )
+        if meta.get("deduplicated"):
+            matrix.counts = np.load(self._path(key, ".counts.npy"))
+            matrix.rows = np.load(self._path(key, ".rows.npy"))
+        matrix.mean = np.asarray(meta["mean"])
+        matrix.std = np.asarray(meta["std"])
+        return matrix
+
+    def release(self, key, reference):
+        """
+        Drop a reference, deleting the matrix and its lock file if it
+        was the last.
+        """
+        lock = self._lock(key)
+        try:
+            path = os.path.join(self.directory, reference)
+            if os.path.exists(path):
+                os.remove(path)
+            if not self._references(key):
+                for suffix in (".features.npy", ".labels.npy", ".json",
+                               ".counts.npy", ".rows.npy"):
+                    if os.path.exists(self._path(key, suffix)):
+                        os.remove(self._path(key, suffix))
+                # Removed while held, so no one else can hold it.
+                os.remove(self._path(key, ".lock"))
+        finally:
+            lock.close()
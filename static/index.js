@@ -26,6 +26,12 @@ function handleTab (evt) {
         case "tab-stop-criteria":
             document.getElementById("stop-criteria-contents").classList.remove("is-sr-only");
             break;
+        case "tab-fitness":
+            document.getElementById("fitness-contents").classList.remove("is-sr-only");
+            break;
+        case "tab-condensation":
+            document.getElementById("condensation-contents").classList.remove("is-sr-only");
+            break;
     }
 }
 
@@ -57,6 +63,14 @@ document.querySelectorAll("#replacement-contents input[type='radio']").forEach(i
     });
 });
 
+document.querySelectorAll("#fitness-contents input[type='radio']").forEach(input => {
+    input.addEventListener("input", () => {
+        document.querySelectorAll("#fitness-contents input[type='radio']").forEach(input => {
+            updateHelperDisabled(input);
+        });
+    });
+});
+
 document.querySelectorAll("#crossover-contents input[type='checkbox']").forEach(input => {
     input.addEventListener("input", () => {
         document.querySelectorAll("#crossover-contents input[type='checkbox']").forEach(input => {
@@ -85,7 +99,10 @@ document.querySelectorAll("#stop-criteria-contents input[type='checkbox']").forE
 function generateBase () {
     let base = {};
     $('#base-settings input').serializeArray().map(entry => {
-        if (Number.isNaN(Number(entry.value))) {
+        if (entry.value === "") {
+            // Left empty, as the seed is for a random one.
+            return;
+        } else if (Number.isNaN(Number(entry.value))) {
             base[entry.name] = entry.value;
         } else {
             base[entry.name] = Number(entry.value);
@@ -178,7 +195,10 @@ function generateStopCriteria () {
         let vals = {};
         if (level) {
             $(level).find(".level-right input").serializeArray().map(entry => {
-                if (!Number.isNaN(Number(entry.value))) {
+                if (entry.name === "timestamp") {
+                    // Deadlines are stored as Unix timestamps
+                    vals[entry.name] = Date.parse(entry.value) / 1000;
+                } else if (!Number.isNaN(Number(entry.value))) {
                     vals[entry.name] = Number(entry.value);
                 } else {
                     vals[entry.name] = entry.value;
@@ -191,6 +211,40 @@ function generateStopCriteria () {
     return stopCriteria;
 }
 
+function generateFitness () {
+    let vals = {};
+    $("#fitness-contents input").serializeArray().map(entry => {
+        if (!Number.isNaN(Number(entry.value))) {
+            vals[entry.name] = Number(entry.value);
+        } else {
+            vals[entry.name] = entry.value;
+        }
+    });
+    let fitness = {
+        "method": vals["method"],
+    };
+    delete vals.method;
+    fitness.parameters = vals;
+    return fitness;
+}
+
+function generateCondensation () {
+    let vals = {};
+    $("#condensation-contents input").serializeArray().map(entry => {
+        if (!Number.isNaN(Number(entry.value))) {
+            vals[entry.name] = Number(entry.value);
+        } else {
+            vals[entry.name] = entry.value;
+        }
+    });
+    let condensation = {
+        "method": vals["method"],
+    };
+    delete vals.method;
+    condensation.parameters = vals;
+    return condensation;
+}
+
 function generateFullParams () {
     return {
         "base": generateBase(),
@@ -198,7 +252,8 @@ function generateFullParams () {
         "replacement": generateReplacement(),
         "mutation": generateMutation(),
         "crossover": generateCrossover(),
-        "stop_criteria": generateStopCriteria()
+        "stop_criteria": generateStopCriteria(),
+        "fitness": generateFitness()
     };
 }
 
@@ -221,6 +276,45 @@ $("#start-button").on("click", () => {
     });
 });
 
+$("#estimate-button").on("click", () => {
+    let obj = generateFullParams();
+    obj.method = "estimate";
+    $.ajax({
+        contentType: "application/json",
+        data: JSON.stringify(obj),
+        error: (jqXHR, textStatus, error) => {
+            console.debug(textStatus);
+            console.debug(error);
+        },
+        method: "POST",
+        success: (data, textStatus, jqXHR) => {
+            console.debug("success");
+            console.debug(textStatus);
+            window.close();
+        }
+    });
+});
+
+$("#condense-button").on("click", () => {
+    let obj = generateFullParams();
+    obj.condensation = generateCondensation();
+    obj.method = "condense";
+    $.ajax({
+        contentType: "application/json",
+        data: JSON.stringify(obj),
+        error: (jqXHR, textStatus, error) => {
+            console.debug(textStatus);
+            console.debug(error);
+        },
+        method: "POST",
+        success: (data, textStatus, jqXHR) => {
+            console.debug("success");
+            console.debug(textStatus);
+            window.close();
+        }
+    });
+});
+
 $("#finish-button").on("click", () => {
     let obj = generateFullParams();
     obj.method = "finish";
@@ -0,0 +1,79 @@
+# Copyright (C) 2020 Juliette Regimbal
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import division, unicode_literals
+
+import bench_state_machine
+import unittest
+
+
+class ScriptedJob(bench_state_machine.RodanTask):
+    """
+    Follows the job's states without gamera.
+    """
+
+    def run_my_task(self, inputs, settings, outputs):
+        if "@state" not in settings:
+            return self.WAITING_FOR_INPUT({"@state": 1, "@settings": "x"})
+        if settings["@state"] == 2:
+            return self.WAITING_FOR_INPUT({"@state": 1, "@results": [1] * 50})
+        return True
+
+    def get_my_interface(self, inputs, settings):
+        return "index.html", {"optimizer": settings.get("@results")}
+
+    def validate_my_user_input(self, inputs, settings, user_input):
+        return {"@state": 2 if user_input["method"] == "start" else 3}
+
+
+class TestDrive(unittest.TestCase):
+    def test_transitions(self):
+        settings = {"Max. Threads": 2}
+        transitions = bench_state_machine.drive(
+            ScriptedJob, {}, settings, {}, {"method": "start"}
+        )
+        self.assertEqual(
+            [(t["name"], t["from"], t["to"]) for t in transitions], [
+                ("init", "NEW", "NOT_OPTIMIZING"),
+                ("interface", "NOT_OPTIMIZING", "NOT_OPTIMIZING"),
+                ("start", "NOT_OPTIMIZING", "OPTIMIZING"),
+                ("optimize", "OPTIMIZING", "NOT_OPTIMIZING"),
+                ("results", "NOT_OPTIMIZING", "NOT_OPTIMIZING"),
+                ("finish", "NOT_OPTIMIZING", "FINISHING"),
+                ("write", "FINISHING", "FINISHING"),
+            ]
+        )
+        self.assertEqual(settings["Max. Threads"], 2)
+        self.assertGreater(transitions[3]["settingsBytes"],
+                           transitions[2]["settingsBytes"])
+        self.assertGreater(transitions[4]["contextBytes"],
+                           transitions[1]["contextBytes"])
+        self.assertIsNone(transitions[0]["contextBytes"])
+
+
+class TestRegressions(unittest.TestCase):
+    def report(self, seconds, settings_bytes):
+        return {"transitions": [{
+            "name": "optimize", "seconds": seconds,
+            "settingsBytes": settings_bytes, "contextBytes": None,
+            "readBytes": None, "writtenBytes": 0
+        }]}
+
+    def test_regressions(self):
+        baseline = self.report(1.0, 1000)
+        self.assertEqual(bench_state_machine.regressions(
+            self.report(1.2, 1200), baseline
+        ), [])
+        found = bench_state_machine.regressions(
+            self.report(2.0, 1300), baseline
+        )
+        self.assertEqual(len(found), 2)
+        self.assertTrue(found[0].startswith("optimize: seconds"))
+        # Short timings get an absolute slack.
+        self.assertEqual(bench_state_machine.regressions(
+            self.report(0.04, 1000), self.report(0.01, 1000)
+        ), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+# Copyright (C) 2020 Juliette Regimbal
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import unicode_literals
+
+import budget
+import unittest
+
+
+class TestBudgetMonitor(unittest.TestCase):
+    def test_no_budget(self):
+        monitor = budget.BudgetMonitor(
+            [{"method": "maxGenerations", "parameters": {"n": 100}}]
+        )
+        self.assertFalse(monitor)
+        self.assertIsNone(monitor.update(0.5, 100.0))
+        self.assertIsNone(monitor.remaining())
+
+    def test_wall_clock(self):
+        monitor = budget.BudgetMonitor(
+            [{"method": "maxWallClock", "parameters": {"seconds": 60}}],
+            start=1000.0
+        )
+        self.assertTrue(monitor)
+        self.assertIsNone(monitor.update(0.5, 0.0, now=1030.0))
+        self.assertEqual(monitor.remaining(now=1030.0), 30.0)
+        self.assertEqual(
+            monitor.update(0.5, 0.0, now=1060.0), "maxWallClock"
+        )
+
+    def test_deadline(self):
+        monitor = budget.BudgetMonitor(
+            [{"method": "deadline", "parameters": {"timestamp": 500.0}},
+             {"method": "maxWallClock", "parameters": {"seconds": 60}}],
+            start=480.0
+        )
+        self.assertEqual(monitor.remaining(now=490.0), 10.0)
+        self.assertEqual(monitor.update(0.5, 0.0, now=500.0), "deadline")
+
+    def test_improvement_rate(self):
+        monitor = budget.BudgetMonitor(
+            [{"method": "improvementRate",
+              "parameters": {"rate": 0.01, "window": 2}}],
+            start=0.0
+        )
+        # 0.05 per CPU minute over the first window
+        self.assertIsNone(monitor.update(0.50, 0.0, now=0.0))
+        self.assertIsNone(monitor.update(0.55, 60.0, now=1.0))
+        self.assertIsNone(monitor.update(0.60, 120.0, now=2.0))
+        # Then 0.0025 per CPU minute
+        self.assertIsNone(monitor.update(0.60, 180.0, now=3.0))
+        self.assertEqual(
+            monitor.update(0.605, 240.0, now=4.0), "improvementRate"
+        )
+
+    def test_invalid_improvement_rate(self):
+        for p in ({"rate": 0.01, "window": 0},
+                  {"rate": 0.01, "window": -1},
+                  {"rate": 0, "window": 2}):
+            with self.assertRaises(ValueError):
+                budget.BudgetMonitor(
+                    [{"method": "improvementRate", "parameters": p}]
+                )
@@ -0,0 +1,106 @@
+# Copyright (C) 2020 Juliette Regimbal
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import division, unicode_literals
+
+from tempfile import NamedTemporaryFile as NTF
+
+import classifier_bundle
+import feature_matrix
+import knn_fitness
+import numpy as np
+import unittest
+
+from test_knn_fitness import make_blobs
+
+
+class TestClassifierBundle(unittest.TestCase):
+    def setUp(self):
+        features, labels = make_blobs(n_per_class=30)
+        self.matrix = feature_matrix.FeatureMatrix(
+            features.astype(np.float32), labels.astype(np.uint8),
+            ["a", "b", "c"], [("f", 4), ("g", 2)]
+        ).normalize()
+        self.queries = make_blobs(n_per_class=10, seed=0)[0] \
+            + np.random.RandomState(1).normal(0, 1.0, (30, 6))
+        self.weights = np.array([1.0, 0.0, 0.5, 2.0, 0.0, 1.0])
+
+    def test_matches_classify(self):
+        normalized = ((self.queries - self.matrix.mean) / self.matrix.std) \
+            .astype(np.float32)
+        for distance_type in (knn_fitness.DISTANCE_CITY_BLOCK,
+                              knn_fitness.DISTANCE_EUCLIDEAN,
+                              knn_fitness.DISTANCE_FAST_EUCLIDEAN):
+            bundle = classifier_bundle.ClassifierBundle.from_matrix(
+                self.matrix, self.weights, 3, distance_type
+            )
+            self.assertEqual(bundle.features.shape, (90, 4))
+            self.assertEqual(bundle.features.dtype, np.float32)
+            expected = knn_fitness.classify(
+                normalized, self.matrix.features, self.matrix.labels,
+                self.weights, 3, distance_type
+            )
+            np.testing.assert_array_equal(
+                bundle.predict(self.queries), expected
+            )
+
+    def test_save_load(self):
+        bundle = classifier_bundle.ClassifierBundle.from_matrix(
+            self.matrix, self.weights, 3, knn_fitness.DISTANCE_CITY_BLOCK,
+            rows=np.arange(0, 90, 2)
+        )
+        with NTF() as f:
+            bundle.save(f.name)
+            loaded = classifier_bundle.ClassifierBundle.load(f.name)
+        self.assertEqual(len(loaded), 45)
+        self.assertEqual(loaded.layout, [("f", 4), ("g", 2)])
+        self.assertEqual(loaded.k, 3)
+        self.assertEqual(
+            loaded.classify(self.queries), bundle.classify(self.queries)
+        )
+        self.assertEqual(set(loaded.classify(self.queries)), {"a", "b", "c"})
+
+    def test_deduplicated_matches_full(self):
+        # Some glyphs three times over, in classes that overlap.
+        features, labels = make_blobs(n_per_class=30, seed=3)
+        features += np.random.RandomState(4).normal(0, 2.0, features.shape)
+        repeats = np.where(np.arange(90) % 4 == 0, 3, 1)
+        full = feature_matrix.FeatureMatrix(
+            np.repeat(features, repeats, axis=0).astype(np.float32),
+            np.repeat(labels, repeats).astype(np.uint8),
+            ["a", "b", "c"], [("f", 4), ("g", 2)]
+        )
+        deduplicated = feature_matrix.deduplicate(full, 0).normalize()
+        full.normalize()
+        self.assertEqual(len(deduplicated), 90)
+        bundles = [
+            classifier_bundle.ClassifierBundle.from_matrix(
+                matrix, self.weights, 7, knn_fitness.DISTANCE_CITY_BLOCK
+            ) for matrix in (full, deduplicated)
+        ]
+        np.testing.assert_array_equal(
+            bundles[1].predict(self.queries), bundles[0].predict(self.queries)
+        )
+        with NTF() as f:
+            bundles[1].save(f.name)
+            loaded = classifier_bundle.ClassifierBundle.load(f.name)
+        np.testing.assert_array_equal(loaded.counts, deduplicated.counts)
+        np.testing.assert_array_equal(
+            loaded.predict(self.queries), bundles[0].predict(self.queries)
+        )
+        # Without the counts the vote is a different one.
+        bundles[1].counts = None
+        self.assertFalse(np.array_equal(
+            bundles[1].predict(self.queries), bundles[0].predict(self.queries)
+        ))
+
+    def test_wrong_layout(self):
+        bundle = classifier_bundle.ClassifierBundle.from_matrix(
+            self.matrix, self.weights, 3, knn_fitness.DISTANCE_CITY_BLOCK
+        )
+        with self.assertRaises(AssertionError):
+            bundle.predict(self.queries[:, :5])
+
+
+if __name__ == '__main__':
+    unittest.main()
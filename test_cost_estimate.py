@@ -0,0 +1,180 @@
+# Copyright (C) 2020 Juliette Regimbal
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import division, unicode_literals
+
+import cost_estimate
+import cross_validation
+import feature_matrix
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+
+CALIBRATION = {"time": 0.0, "pairFeature": 1e-9, "pair": 1e-8}
+BASE = {"opMode": 1, "popSize": 100, "crossRate": 0.95, "mutRate": 0.05}
+
+
+def criterion(method, **parameters):
+    return {"method": method, "parameters": parameters}
+
+
+class TestBounds(unittest.TestCase):
+    def test_evaluation_bound(self):
+        self.assertEqual(
+            cost_estimate.evaluation_bound(BASE, [
+                criterion("maxGenerations", n=50),
+                criterion("maxFitnessEvals", n=10000),
+            ]),
+            (5100, True)
+        )
+        self.assertEqual(
+            cost_estimate.evaluation_bound(BASE, [
+                criterion("steadyState", minGens=40, noChangeGens=10),
+                criterion("bestFitness", optimum=1.0),
+            ]),
+            (5100, False)
+        )
+        self.assertEqual(
+            cost_estimate.evaluation_bound(
+                BASE, [criterion("bestFitness", optimum=1.0)]
+            ),
+            (None, False)
+        )
+
+    def test_time_bound(self):
+        self.assertEqual(
+            cost_estimate.time_bound([
+                criterion("maxWallClock", seconds=600),
+                criterion("deadline", timestamp=1300.0),
+            ], now=1000.0),
+            300.0
+        )
+        self.assertIsNone(
+            cost_estimate.time_bound([criterion("maxGenerations", n=5)])
+        )
+
+
+class TestEstimate(unittest.TestCase):
+    def test_runtime(self):
+        cost = cost_estimate.estimate(
+            1000, 100, BASE, [criterion("maxFitnessEvals", n=1000)], 4,
+            CALIBRATION
+        )
+        # 10^6 pairs * (100 * 1e-9 + 1e-8) = 0.11 s per evaluation.
+        self.assertAlmostEqual(cost["secondsPerEvaluation"], 0.11)
+        self.assertAlmostEqual(cost["seconds"], 1000 * 0.11 / 4)
+        self.assertTrue(cost["bounded"])
+
+    def test_selection_costs_half_the_features(self):
+        base = dict(BASE, opMode=0)
+        cost = cost_estimate.estimate(
+            1000, 100, base, [criterion("maxFitnessEvals", n=1)], 1,
+            CALIBRATION
+        )
+        self.assertAlmostEqual(cost["secondsPerEvaluation"], 0.06)
+
+    def test_wall_clock_caps_runtime(self):
+        cost = cost_estimate.estimate(
+            1000, 100, BASE, [criterion("bestFitness", optimum=1.0),
+                              criterion("maxWallClock", seconds=60)],
+            1, CALIBRATION
+        )
+        self.assertEqual(cost["seconds"], 60)
+        self.assertTrue(cost["certain"])
+
+    def test_memory(self):
+        numpy_cost = cost_estimate.estimate(
+            1000, 100, BASE, [criterion("maxFitnessEvals", n=1)], 2,
+            CALIBRATION, "numpy", "float32"
+        )
+        self.assertEqual(
+            numpy_cost["peakBytes"],
+            feature_matrix.estimate_bytes(1000, 100, "float32") +
+            2 * 1000 * 1000 * 16 + 100 * 100 * 8
+        )
+        gamera_cost = cost_estimate.estimate(
+            1000, 100, BASE, [criterion("maxFitnessEvals", n=1)], 2,
+            CALIBRATION
+        )
+        self.assertLess(gamera_cost["peakBytes"], numpy_cost["peakBytes"])
+
+    def test_fitness(self):
+        holdout = cross_validation.SerializableFitness()
+        holdout.setHoldout(0.2, 2)
+        args = (1000, 100, BASE, [criterion("maxFitnessEvals", n=1000)], 4,
+                CALIBRATION, "numpy", "float32")
+        loo = cost_estimate.estimate(*args)
+        cost = cost_estimate.estimate(*args, fitness=holdout)
+        self.assertAlmostEqual(cost["seconds"], loo["seconds"] * 0.32)
+        self.assertEqual(
+            cost["peakBytes"] - loo["peakBytes"],
+            2 * feature_matrix.estimate_bytes(1000, 100, "float32")
+        )
+        # gamera always scores leave-one-out.
+        self.assertEqual(
+            cost_estimate.estimate(*args[:6], fitness=holdout)["seconds"],
+            cost_estimate.estimate(*args[:6])["seconds"]
+        )
+
+
+class TestSuggest(unittest.TestCase):
+    def cost(self, evaluations=10 ** 6, threads=4):
+        return cost_estimate.estimate(
+            1000, 100, BASE,
+            [criterion("maxFitnessEvals", n=evaluations)], threads,
+            CALIBRATION, "numpy", "float32"
+        )
+
+    def test_within_budget(self):
+        self.assertIsNone(cost_estimate.suggest(self.cost(1000), BASE,
+                                                3600, 2 ** 30))
+
+    def test_runtime(self):
+        suggestion = cost_estimate.suggest(self.cost(), BASE, 3600)
+        self.assertEqual(suggestion["maxWallClock"], 3600)
+        cheaper = self.cost(suggestion["maxFitnessEvals"])
+        self.assertLessEqual(cheaper["seconds"], 3600)
+        self.assertLessEqual(suggestion["popSize"], BASE["popSize"])
+
+    def test_memory(self):
+        cost = self.cost(threads=8)
+        suggestion = cost_estimate.suggest(cost, BASE, None, 60 * 2 ** 20)
+        cheaper = self.cost(threads=suggestion["threads"])
+        self.assertLess(suggestion["threads"], 8)
+        self.assertLessEqual(cheaper["peakBytes"], 60 * 2 ** 20)
+        self.assertTrue(cost_estimate.suggest(cost, BASE, None, 2 ** 20)
+                        ["condense"])
+
+
+class TestCalibration(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "calibration.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_calibrate(self):
+        calibration = cost_estimate.calibrate(100, 8, 1)
+        self.assertGreaterEqual(calibration["pairFeature"], 0.0)
+        self.assertGreaterEqual(calibration["pair"], 0.0)
+
+    def test_cached(self):
+        with open(self.path, "w") as f:
+            json.dump(dict(CALIBRATION, time=1000.0), f)
+        self.assertEqual(
+            cost_estimate.load_calibration(self.path, now=2000.0)["pair"],
+            CALIBRATION["pair"]
+        )
+        # Stale calibrations are measured again.
+        calibration = cost_estimate.load_calibration(
+            self.path, now=1000.0 + cost_estimate.CALIBRATION_TTL
+        )
+        self.assertGreater(calibration["time"], 1000.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
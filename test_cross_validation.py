@@ -0,0 +1,101 @@
+# Copyright (C) 2020 Juliette Regimbal
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import division, unicode_literals
+
+import cross_validation
+import numpy as np
+import unittest
+
+
+class TestSerializableFitness(unittest.TestCase):
+    def test_round_trip(self):
+        for d in [
+            {"method": "leaveOneOut", "parameters": {}},
+            {"method": "kFold", "parameters": {"folds": 10, "seed": 3}},
+            {"method": "holdout",
+             "parameters": {"fraction": 0.3, "rotations": 4, "seed": 1}},
+        ]:
+            fitness = cross_validation.SerializableFitness.from_dict(d)
+            self.assertEqual(fitness.method, d["method"])
+            self.assertEqual(fitness.parameters, d["parameters"])
+            self.assertEqual(
+                cross_validation.SerializableFitness.fromJSON(
+                    fitness.toJSON()
+                ),
+                fitness
+            )
+
+    def test_defaults(self):
+        fitness = cross_validation.SerializableFitness.from_dict(
+            {"method": "kFold", "parameters": {}}
+        )
+        self.assertEqual(fitness.parameters, {
+            "folds": cross_validation.DEFAULT_FOLDS,
+            "seed": cross_validation.DEFAULT_SEED
+        })
+
+    def test_invalid(self):
+        from_dict = cross_validation.SerializableFitness.from_dict
+        with self.assertRaises(AssertionError):
+            from_dict({"method": "kFold", "parameters": {"folds": 1}})
+        with self.assertRaises(AssertionError):
+            from_dict({"method": "holdout", "parameters": {"fraction": 1.0}})
+        with self.assertRaises(ValueError):
+            from_dict({"method": "bootstrap", "parameters": {}})
+
+
+class TestSplits(unittest.TestCase):
+    def setUp(self):
+        self.labels = np.repeat(np.arange(3), [20, 11, 4])
+
+    def test_stratified_folds(self):
+        folds = cross_validation.stratified_folds(self.labels, 5, seed=2)
+        sizes = np.bincount(folds, minlength=5)
+        self.assertLessEqual(sizes.max() - sizes.min(), 1)
+        for c in range(3):
+            counts = np.bincount(folds[self.labels == c], minlength=5)
+            self.assertLessEqual(counts.max() - counts.min(), 1)
+        np.testing.assert_array_equal(
+            folds, cross_validation.stratified_folds(self.labels, 5, seed=2)
+        )
+
+    def test_holdout(self):
+        mask = cross_validation.holdout(self.labels, 0.25)
+        self.assertEqual(
+            np.bincount(self.labels[mask]).tolist(), [5, 3, 1]
+        )
+        # Every class keeps a reference glyph.
+        mask = cross_validation.holdout(self.labels, 0.99)
+        self.assertEqual(np.bincount(self.labels[~mask]).tolist(), [1, 1, 1])
+
+    def test_splits(self):
+        fitness = cross_validation.SerializableFitness()
+        self.assertIsNone(cross_validation.splits(fitness, self.labels))
+
+        fitness.setKFold(4)
+        splits = cross_validation.splits(fitness, self.labels)
+        self.assertEqual(len(splits), 4)
+        tests = np.concatenate([test for test, reference in splits])
+        np.testing.assert_array_equal(np.sort(tests),
+                                      np.arange(len(self.labels)))
+        for test, reference in splits:
+            self.assertEqual(len(np.intersect1d(test, reference)), 0)
+            self.assertEqual(len(test) + len(reference), len(self.labels))
+
+        fitness.setHoldout(0.2, 3, seed=7)
+        splits = cross_validation.splits(fitness, self.labels)
+        self.assertEqual(len(splits), 3)
+        self.assertFalse(np.array_equal(splits[0][0], splits[1][0]))
+
+    def test_pair_fraction(self):
+        fitness = cross_validation.SerializableFitness()
+        self.assertEqual(cross_validation.pair_fraction(fitness), 1.0)
+        fitness.setKFold(5)
+        self.assertAlmostEqual(cross_validation.pair_fraction(fitness), 0.8)
+        fitness.setHoldout(0.2, 2)
+        self.assertAlmostEqual(cross_validation.pair_fraction(fitness), 0.32)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+# Copyright (C) 2020 Juliette Regimbal
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import division, unicode_literals
+
+from tempfile import NamedTemporaryFile as NTF
+
+import feature_matrix
+import numpy as np
+import os
+import unittest
+
+
+GLYPH = """
+    <glyph uly="0" ulx="0" nrows="2" ncols="2">
+      <ids state="MANUAL">
+        <id name="%s" confidence="1.000000"/>
+      </ids>
+      <data>
+        1 2 1
+      </data>
+      <features scaling="1.0">
+        <feature name="area">
+          %s
+        </feature>
+        <feature name="moments">
+          %s
+        </feature>
+      </features>
+    </glyph>"""
+
+
+def write_training_xml(f, glyphs):
+    f.write(b'<?xml version="1.0" encoding="utf-8"?>\n')
+    f.write(b'<gamera-database version="2.0">\n<glyphs>')
+    for name, area, moments in glyphs:
+        f.write((GLYPH % (
+            name, area, " ".join(str(m) for m in moments)
+        )).encode("utf-8"))
+    f.write(b"\n</glyphs>\n</gamera-database>\n")
+    f.flush()
+
+
+class TestFeatureMatrix(unittest.TestCase):
+    def setUp(self):
+        self.temp = NTF(suffix=".xml")
+        write_training_xml(self.temp, [
+            ("neume.punctum", 4.0, [0.1, 0.2]),
+            ("clef.c", 6.0, [0.3, 0.4]),
+            ("neume.punctum", 5.0, [0.5, 0.6]),
+        ])
+
+    def tearDown(self):
+        self.temp.close()
+
+    def test_scan(self):
+        count, layout = feature_matrix.scan_xml(self.temp.name)
+        self.assertEqual(count, 3)
+        self.assertEqual(layout, [("area", 1), ("moments", 2)])
+
+    def test_from_xml(self):
+        m = feature_matrix.FeatureMatrix.from_xml(
+            self.temp.name, [("moments", 2), ("area", 1)]
+        )
+        self.assertEqual(m.features.dtype, np.float32)
+        self.assertEqual(m.labels.dtype, np.uint8)
+        self.assertEqual(m.class_names, ["clef.c", "neume.punctum"])
+        self.assertEqual(m.labels.tolist(), [1, 0, 1])
+        np.testing.assert_allclose(m.features[1], [0.3, 0.4, 6.0])
+
+    def test_mmap(self):
+        m = feature_matrix.FeatureMatrix.from_xml(
+            self.temp.name,
+            precision="float16",
+            mode=feature_matrix.MODE_MMAP
+        )
+        path = m.path
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(m.mode, feature_matrix.MODE_MMAP)
+        self.assertEqual(m.features.dtype, np.float16)
+        m.normalize()
+        np.testing.assert_allclose(
+            m.features.astype(np.float64).mean(axis=0), 0.0, atol=1e-3
+        )
+        m.close()
+        self.assertFalse(os.path.exists(path))
+
+    def test_several_files(self):
+        with NTF(suffix=".xml") as other:
+            write_training_xml(other, [("clef.f", 7.0, [0.7, 0.8])])
+            count, layout = feature_matrix.scan_xml(
+                [self.temp.name, other.name]
+            )
+            m = feature_matrix.FeatureMatrix.from_xml(
+                [self.temp.name, other.name]
+            )
+        self.assertEqual(count, 4)
+        self.assertEqual(m.class_names, ["clef.c", "clef.f", "neume.punctum"])
+        self.assertEqual(m.labels.tolist(), [2, 0, 2, 1])
+        np.testing.assert_allclose(m.features[3], [7.0, 0.7, 0.8])
+
+    def test_choose_mode(self):
+        self.assertEqual(
+            feature_matrix.choose_mode(1000, 100, budget=10 ** 6),
+            feature_matrix.MODE_RAM
+        )
+        self.assertEqual(
+            feature_matrix.choose_mode(10000, 100, budget=10 ** 6),
+            feature_matrix.MODE_MMAP
+        )
+
+
+class TestDeduplicate(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        features = rng.normal(size=(200, 4)).astype(np.float32)
+        labels = np.repeat(np.arange(2), 100).astype(np.uint8)
+        # Rows 200-249 copy rows 0-49 exactly; rows 250-299 copy
+        # rows 100-149 but are labelled as the other class.
+        self.features = np.vstack([
+            features, features[:50], features[100:150]
+        ])
+        self.labels = np.concatenate([
+            labels, labels[:50], 1 - labels[100:150]
+        ])
+        self.matrix = feature_matrix.FeatureMatrix(
+            self.features.copy(), self.labels, ["a", "b"], [("f", 4)]
+        )
+
+    def test_identical(self):
+        d = feature_matrix.deduplicate(self.matrix, 0)
+        self.assertEqual(len(d), 250)
+        self.assertEqual(d.num_glyphs, 300)
+        rows = list(range(200)) + list(range(250, 300))
+        self.assertEqual(d.rows.tolist(), rows)
+        self.assertEqual(d.counts.tolist(), [2] * 50 + [1] * 200)
+        np.testing.assert_array_equal(d.features, self.features[rows])
+        np.testing.assert_array_equal(d.labels, self.labels[rows])
+
+    def test_near_identical(self):
+        self.matrix.features[200:250] += 1e-6
+        self.assertEqual(len(feature_matrix.deduplicate(self.matrix, 0)), 300)
+        d = feature_matrix.deduplicate(self.matrix, 0.01)
+        self.assertLessEqual(len(d), 255)
+        self.assertEqual(d.num_glyphs, 300)
+
+    def test_weighted_statistics(self):
+        d = feature_matrix.deduplicate(self.matrix, 0)
+        mean, std = d.statistics()
+        full = self.features.astype(np.float64)
+        np.testing.assert_allclose(mean, full.mean(axis=0), atol=1e-6)
+        np.testing.assert_allclose(std, full.std(axis=0), rtol=1e-5)
@@ -0,0 +1,690 @@
+# Copyright (C) 2020 Juliette Regimbal
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import division, unicode_literals
+
+from test_knn_fitness import make_blobs
+
+import cross_validation
+import ga_engine
+import json
+import knn_fitness
+import numpy as np
+import threading
+import unittest
+
+
+def make_config(op_mode=ga_engine.OPMODE_SELECTION, pop_size=20,
+                replacement="generational", generations=10):
+    if op_mode == ga_engine.OPMODE_SELECTION:
+        crossover = [{"method": "uniform", "parameters": {"preference": 0.5}}]
+        mutation = [{"method": "binary",
+                     "parameters": {"rate": 0.05, "normalize": True}}]
+    else:
+        crossover = [{"method": "hypercube",
+                      "parameters": {"min": 0.0, "max": 1.0, "alpha": 0.0}}]
+        mutation = [{"method": "gauss", "parameters": {
+            "min": 0.0, "max": 1.0, "sigma": 0.1, "rate": 0.5
+        }}]
+    return ga_engine.GAConfig(
+        {"opMode": op_mode, "popSize": pop_size,
+         "crossRate": 0.95, "mutRate": 0.05},
+        {"method": "tournament", "parameters": {"tSize": 3}},
+        {"method": replacement, "parameters": {}},
+        mutation,
+        crossover,
+        [{"method": "maxGenerations", "parameters": {"n": generations}}]
+    )
+
+
+class TestOperators(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.RandomState(0)
+        self.a = self.rng.uniform(size=(8, 12))
+        self.b = self.rng.uniform(size=(8, 12))
+
+    def test_selection_indices(self):
+        fitness = self.rng.uniform(size=10)
+        for selection in (
+            {"method": "random", "parameters": {}},
+            {"method": "rank",
+             "parameters": {"pressure": 2.0, "exponent": 1.0}},
+            {"method": "roulette", "parameters": {}},
+            {"method": "roulette_scaled", "parameters": {"pressure": 2.0}},
+            {"method": "stochiastic", "parameters": {}},
+            {"method": "tournament", "parameters": {"tSize": 3}},
+        ):
+            indices = ga_engine.select(self.rng, selection, fitness, 30)
+            self.assertEqual(len(indices), 30)
+            self.assertTrue(np.all((indices >= 0) & (indices < 10)))
+
+    def test_tournament_of_all_picks_best(self):
+        fitness = np.array([0.1, 0.9, 0.5])
+        indices = ga_engine.select_tournament(self.rng, fitness, 5, 50)
+        self.assertTrue(np.all(indices == 1))
+
+    def test_discrete_crossover_keeps_genes(self):
+        for op in (
+            {"method": "nPoint", "parameters": {"n": 2}},
+            {"method": "uniform", "parameters": {"preference": 0.5}},
+        ):
+            c1, c2 = ga_engine.crossover(self.rng, op, self.a, self.b)
+            self.assertEqual(c1.shape, self.a.shape)
+            # Every gene comes from one parent, the other goes to the
+            # other child.
+            from_a = c1 == self.a
+            self.assertTrue(np.all(from_a | (c1 == self.b)))
+            np.testing.assert_array_equal(
+                c2, np.where(from_a, self.b, self.a)
+            )
+
+    def test_real_crossover_bounds(self):
+        for method in ("sbx", "segment", "hypercube"):
+            op = {"method": method, "parameters": {
+                "min": 0.2, "max": 0.8, "alpha": 0.5, "eta": 1.0
+            }}
+            c1, c2 = ga_engine.crossover(self.rng, op, self.a, self.b)
+            for c in (c1, c2):
+                self.assertEqual(c.shape, self.a.shape)
+                self.assertTrue(np.all((c >= 0.2) & (c <= 0.8)))
+
+    def test_permutation_mutations(self):
+        for method in ("swap", "shift", "inversion"):
+            mutated = ga_engine.mutate(
+                self.rng, {"method": method, "parameters": {}}, self.a
+            )
+            np.testing.assert_array_equal(
+                np.sort(mutated, axis=1), np.sort(self.a, axis=1)
+            )
+
+    def test_shift(self):
+        x = np.arange(6, dtype=np.float64)[np.newaxis, :]
+
+        class Fixed(object):
+            values = [[1], [4]]
+
+            def randint(self, low, high, size):
+                return np.array(self.values.pop(0))
+
+        np.testing.assert_array_equal(
+            ga_engine.mutate_shift(Fixed(), x),
+            [[0, 2, 3, 4, 1, 5]]
+        )
+
+    def test_binary_mutation(self):
+        x = np.zeros((4, 100))
+        mutated = ga_engine.mutate_binary(self.rng, x, 1.0, False)
+        np.testing.assert_array_equal(mutated, np.ones((4, 100)))
+        self.assertTrue(np.all(np.isin(
+            ga_engine.mutate_binary(self.rng, x, 0.5, False), (0.0, 1.0)
+        )))
+
+    def test_gauss_bounds(self):
+        mutated = ga_engine.mutate_gauss(self.rng, self.a, 0.0, 1.0, 5.0, 1.0)
+        self.assertTrue(np.all((mutated >= 0.0) & (mutated <= 1.0)))
+
+
+class TestConfig(unittest.TestCase):
+    def test_from_settings(self):
+        config = make_config()
+        settings = {
+            "@base": json.dumps({"opMode": 1, "popSize": 30,
+                                 "crossRate": 0.9, "mutRate": 0.1}),
+            "@selection": json.dumps(config.selection),
+            "@replacement": json.dumps(config.replacement),
+            "@mutation": json.dumps(config.mutation),
+            "@crossover": json.dumps(config.crossover),
+            "@stop_criteria": json.dumps(config.stop_criteria),
+        }
+        parsed = ga_engine.GAConfig.from_settings(settings)
+        self.assertEqual(parsed.opMode, 1)
+        self.assertEqual(parsed.popSize, 30)
+        self.assertEqual(parsed.mutRate, 0.1)
+        self.assertEqual(parsed.crossover, config.crossover)
+        self.assertEqual(parsed.stop_criteria, config.stop_criteria)
+        self.assertEqual(parsed.restart["threshold"], 0.0)
+        self.assertIsNone(parsed.seed)
+        settings["@seed"] = 7
+        self.assertEqual(ga_engine.GAConfig.from_settings(settings).seed, 7)
+        settings["Restart Diversity"] = 0.1
+        settings["Restart Strategy"] = ga_engine.RESTART_MUTATION
+        self.assertEqual(ga_engine.GAConfig.from_settings(settings).restart,
+                         {"threshold": 0.1,
+                          "strategy": ga_engine.RESTART_MUTATION})
+
+
+class TestNumpyGAOptimization(unittest.TestCase):
+    def setUp(self):
+        features, self.labels = make_blobs(n_per_class=15, num_features=4)
+        # Noise features the optimization should learn to drop.
+        rng = np.random.RandomState(3)
+        features = np.hstack([features, rng.normal(0, 8.0, (45, 8))])
+        self.features = knn_fitness.normalize(features)
+
+    def optimizer(self, config, threads=1):
+        fitness = ga_engine.LeaveOneOutFitness(
+            self.features, self.labels, 1, knn_fitness.DISTANCE_EUCLIDEAN,
+            config.opMode
+        )
+        return ga_engine.NumpyGAOptimization(
+            fitness, self.features.shape[1], config, threads,
+            np.random.RandomState(0)
+        )
+
+    def test_selection_improves(self):
+        optimizer = self.optimizer(make_config(generations=15))
+        optimizer.initialize()
+        initial = optimizer.bestFitness
+        best = optimizer.run()
+        self.assertEqual(optimizer.generation, 15)
+        self.assertGreaterEqual(optimizer.bestFitness, initial)
+        self.assertGreater(optimizer.bestFitness, 0.9)
+        self.assertEqual(best.shape, (12,))
+        self.assertTrue(np.all(np.isin(best, (0.0, 1.0))))
+
+    def test_weighting(self):
+        config = make_config(ga_engine.OPMODE_WEIGHTING, generations=5)
+        optimizer = self.optimizer(config, threads=2)
+        best = optimizer.run()
+        self.assertTrue(np.all((best >= 0.0) & (best <= 1.0)))
+        self.assertAlmostEqual(
+            optimizer.bestFitness, optimizer.fitness(best)
+        )
+
+    def test_steady_state_replacement(self):
+        config = make_config(replacement="SSGAworse", generations=5)
+        optimizer = self.optimizer(config)
+        optimizer.run()
+        self.assertEqual(optimizer.offspring_count(), 2)
+        self.assertEqual(optimizer.population.shape, (20, 12))
+        self.assertEqual(optimizer.evaluations, 20 + 5 * 2)
+
+    def test_selection_never_empty(self):
+        optimizer = self.optimizer(make_config())
+        repaired = optimizer._repair(np.zeros((5, 12)))
+        self.assertTrue(np.all(repaired.sum(axis=1) == 1))
+
+    def test_stop_criteria(self):
+        config = make_config()
+        config.stop_criteria = [{"method": "steadyState",
+                                 "parameters": {"minGens": 3,
+                                                "noChangeGens": 2}}]
+        optimizer = self.optimizer(config)
+        optimizer.generation = 3
+        optimizer.last_improvement = 2
+        self.assertFalse(optimizer.stop_criteria_met())
+        optimizer.generation = 4
+        self.assertTrue(optimizer.stop_criteria_met())
+
+    def test_warm_start(self):
+        config = make_config(generations=2)
+        optimizer = self.optimizer(config)
+        genome = np.zeros(12)
+        genome[:4] = 1.0
+        optimizer.warm_start(genome, 0.75)
+        optimizer.initialize()
+        np.testing.assert_array_equal(optimizer.population[0], genome)
+        # The known score is not evaluated again.
+        self.assertEqual(optimizer.scores[0], 0.75)
+        close = np.abs(optimizer.population - genome).sum(axis=1) <= 2
+        self.assertGreaterEqual(close.sum(), 10)
+
+    def test_start_stop(self):
+        config = make_config(generations=10 ** 6)
+        optimizer = self.optimizer(config)
+        optimizer.startCalculation()
+        optimizer.stopCalculation()
+        self.assertFalse(optimizer.status)
+        self.assertIsNone(optimizer.error)
+        self.assertLess(optimizer.generation, 10 ** 6)
+
+    def test_profile_engine_thread(self):
+        optimizer = self.optimizer(make_config(generations=3))
+        optimizer.profile = True
+        optimizer.startCalculation()
+        optimizer.join()
+        # The GA's own calls, not the waiting caller's.
+        self.assertIn("evolve", optimizer.profile_stats)
+        self.assertIn("step", optimizer.profile_stats)
+
+    def test_cache_hits_counted(self):
+        optimizer = self.optimizer(make_config())
+        population = optimizer.initial_population()
+        optimizer.evaluate(population)
+        unique = len(set(row.tobytes() for row in population))
+        self.assertEqual(optimizer.cache_hits, len(population) - unique)
+        optimizer.evaluate(population)
+        self.assertEqual(optimizer.evaluations, 2 * len(population))
+        self.assertEqual(optimizer.cache_hits, 2 * len(population) - unique)
+
+    def test_no_threads_left_behind(self):
+        before = threading.active_count()
+        config = make_config(ga_engine.OPMODE_WEIGHTING, generations=4)
+        fitness = ga_engine.CrossValidationFitness(
+            self.features, self.labels, 1, knn_fitness.DISTANCE_EUCLIDEAN,
+            config.opMode, cross_validation.splits(
+                cross_validation.SerializableFitness.from_dict({
+                    "method": cross_validation.FITNESS_K_FOLD
+                }), self.labels
+            ), threads=2
+        )
+        optimizer = ga_engine.NumpyGAOptimization(
+            fitness, self.features.shape[1], config, 2
+        )
+        pools = []
+        step = optimizer.step
+
+        def record_step():
+            step()
+            pools.append((optimizer._pool._pool, fitness._pool._pool))
+
+        optimizer.step = record_step
+        optimizer.run()
+        # One pool of each kind for the whole run...
+        self.assertEqual(len(set(pools)), 1)
+        self.assertIsNotNone(pools[0][0])
+        self.assertIsNotNone(pools[0][1])
+        # ...whose threads are gone once it ends.
+        self.assertEqual(threading.active_count(), before)
+
+    def test_seeded_runs_identical(self):
+        def run(threads, stream=0):
+            config = make_config(ga_engine.OPMODE_WEIGHTING, generations=6)
+            config.seed, config.stream = 11, stream
+            fitness = ga_engine.CrossValidationFitness(
+                self.features, self.labels, 1,
+                knn_fitness.DISTANCE_EUCLIDEAN, config.opMode,
+                cross_validation.splits(
+                    cross_validation.SerializableFitness.from_dict({
+                        "method": cross_validation.FITNESS_K_FOLD
+                    }), self.labels
+                ), threads=threads
+            )
+            optimizer = ga_engine.NumpyGAOptimization(
+                fitness, self.features.shape[1], config, threads
+            )
+            optimizer.run()
+            return optimizer
+
+        single, many = run(1), run(4)
+        self.assertEqual(single.seed, 11)
+        self.assertEqual(single.bestFitness, many.bestFitness)
+        np.testing.assert_array_equal(single.best, many.best)
+        np.testing.assert_array_equal(single.population, many.population)
+        other = run(1, stream=1)
+        self.assertFalse(np.array_equal(single.population, other.population))
+
+    def test_unseeded_run_records_seed(self):
+        optimizer = ga_engine.NumpyGAOptimization(
+            None, 12, make_config()
+        )
+        self.assertIsInstance(optimizer.seed, int)
+        again = ga_engine.make_rng(optimizer.seed)
+        self.assertEqual(optimizer.rng.uniform(), again.uniform())
+
+    def test_mean_pairwise_distance(self):
+        population = np.random.RandomState(1).uniform(size=(7, 5))
+        self.assertAlmostEqual(
+            ga_engine.mean_pairwise_distance(population), np.mean([
+                np.abs(x - y).sum() for i, x in enumerate(population)
+                for y in population[i + 1:]
+            ])
+        )
+        self.assertEqual(ga_engine.mean_pairwise_distance(population[:1]), 0)
+
+    def test_diversity_recorded(self):
+        optimizer = self.optimizer(make_config(generations=5))
+        optimizer.run()
+        self.assertEqual(len(optimizer.diversities), 6)
+        self.assertTrue(all(0 <= d <= 1 for d in optimizer.diversities))
+        self.assertEqual(optimizer.restarts, [])
+
+    def test_restart_reseeds(self):
+        config = make_config(replacement="SSGAworse", generations=12)
+        # Always below the threshold: restart whenever allowed.
+        config.restart = {"threshold": 1.0,
+                          "strategy": ga_engine.RESTART_RESEED}
+        optimizer = self.optimizer(config)
+        optimizer.initialize()
+        initial = optimizer.bestFitness
+        optimizer.run()
+        self.assertEqual([r["generation"] for r in optimizer.restarts],
+                         [0, 5, 10])
+        self.assertEqual(optimizer.evaluations, 20 + 12 * 2 + 3 * 10)
+        self.assertGreaterEqual(optimizer.bestFitness, initial)
+
+    def test_restarts_reach_steady_state(self):
+        config = make_config(replacement="SSGAworse", generations=2000)
+        config.stop_criteria.append({"method": "steadyState", "parameters": {
+            "minGens": 10, "noChangeGens": 10
+        }})
+        config.restart = {"threshold": 1.0,
+                          "strategy": ga_engine.RESTART_MUTATION}
+        optimizer = self.optimizer(config)
+        optimizer.run()
+        # Restarts do not count as improvements.
+        self.assertLess(optimizer.generation, 2000)
+        self.assertGreaterEqual(
+            optimizer.generation - optimizer.last_improvement, 10
+        )
+
+    def test_restart_raises_mutation(self):
+        config = make_config(ga_engine.OPMODE_WEIGHTING, generations=6)
+        config.restart = {"threshold": 1.0,
+                          "strategy": ga_engine.RESTART_MUTATION}
+        optimizer = self.optimizer(config)
+        optimizer.run()
+        self.assertEqual(optimizer.mutation_rate, 0.2)
+        self.assertEqual(
+            [r["mutationRate"] for r in optimizer.restarts], [0.1, 0.2]
+        )
+        # The operators' own rates are raised too.
+        self.assertEqual(optimizer.mutation_boost, 4.0)
+        op = optimizer._boosted(config.mutation[0])
+        self.assertEqual(op["parameters"]["rate"], 1.0)
+        self.assertAlmostEqual(op["parameters"]["sigma"], 0.4)
+        self.assertEqual(config.mutation[0]["parameters"]["sigma"], 0.1)
+        # Restored once diversity is above the threshold.
+        config.restart["threshold"] = 1e-9
+        optimizer.generation += ga_engine.RESTART_COOLDOWN
+        optimizer.monitor_diversity()
+        self.assertEqual(optimizer.mutation_rate, 0.05)
+        self.assertIs(optimizer._boosted(config.mutation[0]),
+                      config.mutation[0])
+
+
+class TestParameterGenes(unittest.TestCase):
+    def setUp(self):
+        self.features, self.labels = make_blobs(num_features=3, seed=2)
+
+    def test_binary_encoding(self):
+        parameters = ga_engine.ParameterGenes(
+            ga_engine.OPMODE_SELECTION, 5, True
+        )
+        # Three bits for k, one for the distance.
+        self.assertEqual(len(parameters), 4)
+        self.assertEqual(parameters.max_k, 5)
+        self.assertEqual(
+            parameters.decode(np.array([1.0, 1.0, 0.0, 1.0])),
+            {"k": 4, "distance": knn_fitness.DISTANCE_EUCLIDEAN}
+        )
+        # Codes beyond the last choice wrap around.
+        self.assertEqual(
+            parameters.decode(np.array([1.0, 1.0, 1.0, 0.0]))["k"], 3
+        )
+        codes = [
+            parameters.decode(np.append((c >> np.arange(3)) & 1, 0.0))["k"]
+            for c in range(8)
+        ]
+        self.assertEqual(sorted(codes), [1, 1, 2, 2, 3, 3, 4, 5])
+
+    def test_real_encoding(self):
+        parameters = ga_engine.ParameterGenes(
+            ga_engine.OPMODE_WEIGHTING, 4
+        )
+        self.assertEqual(len(parameters), 1)
+        self.assertEqual(parameters.decode(np.array([0.0])), {"k": 1})
+        self.assertEqual(parameters.decode(np.array([0.6])), {"k": 3})
+        self.assertEqual(parameters.decode(np.array([1.0])), {"k": 4})
+
+    def test_encode(self):
+        for op_mode in (ga_engine.OPMODE_SELECTION,
+                        ga_engine.OPMODE_WEIGHTING):
+            parameters = ga_engine.ParameterGenes(op_mode, 7, True)
+            for chosen in ({"k": 1, "distance": 0}, {"k": 6, "distance": 1}):
+                self.assertEqual(
+                    parameters.decode(parameters.encode(chosen)), chosen
+                )
+
+    def test_none(self):
+        parameters = ga_engine.ParameterGenes(ga_engine.OPMODE_SELECTION)
+        self.assertEqual(len(parameters), 0)
+        self.assertEqual(parameters.decode(np.array([])), {})
+
+    def test_fitness_uses_parameters(self):
+        parameters = ga_engine.ParameterGenes(
+            ga_engine.OPMODE_WEIGHTING, 8, True
+        )
+        fitness = ga_engine.LeaveOneOutFitness(
+            self.features, self.labels, 1, knn_fitness.DISTANCE_EUCLIDEAN,
+            ga_engine.OPMODE_WEIGHTING, parameters=parameters
+        )
+        w = np.array([1.0, 0.5, 0.0])
+        for k, distance, genes in (
+            (1, knn_fitness.DISTANCE_CITY_BLOCK, [0.0, 0.0]),
+            (5, knn_fitness.DISTANCE_EUCLIDEAN, [0.6, 0.9]),
+            (8, knn_fitness.DISTANCE_CITY_BLOCK, [1.0, 0.2]),
+        ):
+            genome = np.concatenate([w, genes])
+            self.assertEqual(fitness.decode(genome), (k, distance))
+            self.assertEqual(
+                fitness(genome),
+                knn_fitness.leave_one_out_accuracy(
+                    self.features, self.labels, w, k, distance
+                )
+            )
+        # One neighbor list per weighting and distance.
+        self.assertEqual(len(fitness._neighbors), 2)
+
+
+class TestCrossValidationFitness(unittest.TestCase):
+    def setUp(self):
+        features, self.labels = make_blobs(n_per_class=12, num_features=4)
+        self.features = knn_fitness.normalize(features)
+        self.splits = cross_validation.splits(
+            cross_validation.SerializableFitness.from_dict(
+                {"method": "kFold", "parameters": {"folds": 4}}
+            ),
+            self.labels
+        )
+
+    def fitness(self, threads=1):
+        return ga_engine.CrossValidationFitness(
+            self.features, self.labels, 3, knn_fitness.DISTANCE_EUCLIDEAN,
+            ga_engine.OPMODE_WEIGHTING, self.splits, threads=threads
+        )
+
+    def test_matches_classify(self):
+        w = np.array([1.0, 0.0, 0.5, 0.2])
+        correct = 0
+        for test, reference in self.splits:
+            predicted = knn_fitness.classify(
+                self.features[test], self.features[reference],
+                self.labels[reference], w, 3, knn_fitness.DISTANCE_EUCLIDEAN
+            )
+            correct += np.sum(predicted == self.labels[test])
+        self.assertAlmostEqual(self.fitness()(w), correct / len(self.labels))
+        self.assertEqual(self.fitness()(np.zeros(4)), 0.0)
+
+    def test_parallel_folds(self):
+        rng = np.random.RandomState(1)
+        serial, parallel = self.fitness(), self.fitness(threads=4)
+        for w in rng.uniform(size=(5, 4)):
+            self.assertEqual(serial(w), parallel(w))
+
+
+class TestGroupedGenome(unittest.TestCase):
+    def setUp(self):
+        features, self.labels = make_blobs(n_per_class=15, num_features=4)
+        rng = np.random.RandomState(3)
+        # One informative family of four dimensions, two noise families.
+        self.features = knn_fitness.normalize(
+            np.hstack([features, rng.normal(0, 8.0, (45, 8))])
+        )
+        self.groups = ga_engine.FeatureGroups(
+            [("moments", 4), ("zernike", 5), ("nrows", 3)]
+        )
+
+    def optimizer(self, config, refine_generations=0):
+        fitness = ga_engine.LeaveOneOutFitness(
+            self.features, self.labels, 1, knn_fitness.DISTANCE_EUCLIDEAN,
+            config.opMode
+        )
+        return ga_engine.GroupedGAOptimization(
+            fitness, self.groups, config, rng=np.random.RandomState(0),
+            refine_generations=refine_generations
+        )
+
+    def test_expand(self):
+        self.assertEqual(len(self.groups), 3)
+        self.assertEqual(self.groups.num_features, 12)
+        np.testing.assert_array_equal(
+            self.groups.expand(np.array([1.0, 0.0, 0.5])),
+            [1, 1, 1, 1, 0, 0, 0, 0, 0, 0.5, 0.5, 0.5]
+        )
+        self.assertEqual(self.groups.expand(np.zeros((7, 3))).shape, (7, 12))
+
+    def test_collapse(self):
+        np.testing.assert_allclose(
+            self.groups.collapse(np.arange(12.0)), [1.5, 6.0, 10.0]
+        )
+
+    def test_expand_extra(self):
+        groups = ga_engine.FeatureGroups([("moments", 2), ("nrows", 1)], 2)
+        self.assertEqual(len(groups), 4)
+        self.assertEqual(groups.num_features, 5)
+        np.testing.assert_array_equal(
+            groups.expand(np.array([1.0, 0.0, 0.3, 0.7])),
+            [1, 1, 0, 0.3, 0.7]
+        )
+
+    def test_selection_of_families(self):
+        optimizer = self.optimizer(make_config(pop_size=8, generations=5))
+        best = optimizer.run()
+        self.assertEqual(optimizer.population.shape, (8, 3))
+        self.assertEqual(best.shape, (12,))
+        np.testing.assert_array_equal(best[:4], [1, 1, 1, 1])
+        self.assertAlmostEqual(
+            optimizer.bestFitness, optimizer.fitness.fitness(best)
+        )
+
+    def test_refinement(self):
+        config = make_config(ga_engine.OPMODE_WEIGHTING, pop_size=8,
+                             generations=3)
+        optimizer = self.optimizer(config, refine_generations=2)
+        best = optimizer.run()
+        self.assertTrue(optimizer.refining)
+        self.assertEqual(optimizer.generation, 5)
+        self.assertEqual(optimizer.population.shape, (8, 12))
+        self.assertEqual(best.shape, (12,))
+        self.assertAlmostEqual(
+            optimizer.bestFitness, optimizer.fitness(best)
+        )
+
+
+class TestPackedPopulation(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.RandomState(5)
+        self.length = 150
+        self.a = (self.rng.uniform(size=(6, self.length)) < 0.5) * 1.0
+        self.b = (self.rng.uniform(size=(6, self.length)) < 0.5) * 1.0
+
+    def test_pack_round_trip(self):
+        words = ga_engine.pack(self.a)
+        self.assertEqual(words.shape, (6, 3))
+        self.assertEqual(words.dtype, ga_engine.WORD)
+        np.testing.assert_array_equal(
+            ga_engine.unpack(words, self.length), self.a
+        )
+        self.assertFalse(np.any(words & ~ga_engine.tail_mask(self.length)))
+        np.testing.assert_array_equal(
+            ga_engine.unpack(words[2], self.length), self.a[2]
+        )
+
+    def test_bit_order(self):
+        genome = np.zeros((1, 70))
+        genome[0, [0, 65]] = 1.0
+        np.testing.assert_array_equal(ga_engine.pack(genome), [[1, 2]])
+
+    def test_hamming(self):
+        np.testing.assert_array_equal(
+            ga_engine.hamming(ga_engine.pack(self.a), ga_engine.pack(self.b)),
+            (self.a != self.b).sum(axis=1)
+        )
+
+    def test_bit_counts(self):
+        counts = ga_engine.bit_counts(ga_engine.pack(self.a))
+        self.assertEqual(len(counts), 64 * ga_engine.num_words(self.length))
+        np.testing.assert_array_equal(
+            counts[:self.length], self.a.sum(axis=0)
+        )
+        self.assertFalse(counts[self.length:].any())
+
+    def check_crossover(self, c1, c2):
+        c1 = ga_engine.unpack(c1, self.length)
+        c2 = ga_engine.unpack(c2, self.length)
+        from_a = c1 == self.a
+        self.assertTrue(np.all(from_a | (c1 == self.b)))
+        np.testing.assert_array_equal(c2, np.where(from_a, self.b, self.a))
+        self.assertGreater(np.sum(c1 != self.a), 0)
+
+    def test_n_point(self):
+        a, b = ga_engine.pack(self.a), ga_engine.pack(self.b)
+        c1, c2 = ga_engine.packed_n_point(self.rng, a, b, self.length, 2)
+        self.check_crossover(c1, c2)
+        # Crossing zeros with ones shows the cuts: two cuts leave
+        # at most three runs of each parent's genes.
+        zeros = np.zeros((6, 3), dtype=ga_engine.WORD)
+        c1, c2 = ga_engine.packed_n_point(
+            self.rng, zeros, ~zeros & ga_engine.tail_mask(self.length),
+            self.length, 2
+        )
+        runs = np.abs(np.diff(ga_engine.unpack(c1, self.length), axis=1))
+        self.assertTrue(np.all(runs.sum(axis=1) <= 2))
+        self.assertEqual(ga_engine.unpack(c1, self.length)[0, 0], 0.0)
+
+    def test_uniform(self):
+        for preference in (0.5, 0.8):
+            c1, c2 = ga_engine.packed_uniform(
+                self.rng, ga_engine.pack(self.a), ga_engine.pack(self.b),
+                self.length, preference
+            )
+            self.check_crossover(c1, c2)
+            self.assertFalse(np.any(c1 & ~ga_engine.tail_mask(self.length)))
+
+    def test_binary_mutation(self):
+        words = ga_engine.pack(self.a)
+        flipped = ga_engine.packed_binary(
+            self.rng, words, self.length, 1.0, False
+        )
+        np.testing.assert_array_equal(
+            ga_engine.unpack(flipped, self.length), 1.0 - self.a
+        )
+        mutated = ga_engine.packed_binary(
+            self.rng, words, self.length, 0.05, False
+        )
+        changed = ga_engine.hamming(words, mutated)
+        self.assertTrue(np.all(changed < self.length // 2))
+        self.assertFalse(np.any(mutated & ~ga_engine.tail_mask(self.length)))
+
+    def test_optimization(self):
+        features, labels = make_blobs(n_per_class=15, num_features=4)
+        rng = np.random.RandomState(3)
+        features = knn_fitness.normalize(
+            np.hstack([features, rng.normal(0, 8.0, (45, 8))])
+        )
+        fitness = ga_engine.LeaveOneOutFitness(
+            features, labels, 1, knn_fitness.DISTANCE_EUCLIDEAN,
+            ga_engine.OPMODE_SELECTION
+        )
+        config = make_config(generations=15)
+        config.crossover = [{"method": "nPoint", "parameters": {"n": 1}}]
+        config.mutation.append({"method": "swap", "parameters": {}})
+        optimizer = ga_engine.PackedGAOptimization(
+            fitness, 12, config, rng=np.random.RandomState(0)
+        )
+        best = optimizer.run()
+        self.assertEqual(optimizer.population.shape, (20, 1))
+        self.assertEqual(best.shape, (12,))
+        self.assertGreater(optimizer.bestFitness, 0.9)
+        self.assertEqual(optimizer.bestFitness, fitness(best))
+        population = ga_engine.unpack(optimizer.population, 12)
+        self.assertAlmostEqual(optimizer.diversity(), np.mean([
+            np.sum(x != y) for i, x in enumerate(population)
+            for y in population[i + 1:]
+        ]))
+        self.assertTrue(np.all(optimizer.population.any(axis=1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
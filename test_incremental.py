@@ -0,0 +1,142 @@
+# Copyright (C) 2020 Juliette Regimbal
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import division, unicode_literals
+
+from tempfile import NamedTemporaryFile as NTF
+from test_feature_matrix import write_training_xml
+
+import incremental
+import knn_fitness
+import numpy as np
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestDiff(unittest.TestCase):
+    def test_glyph_keys(self):
+        with NTF(suffix=".xml") as temp:
+            write_training_xml(temp, [
+                ("neume.punctum", 4.0, [0.1, 0.2]),
+                ("clef.c", 4.0, [0.1, 0.2]),
+                ("neume.punctum", 4.0, [0.1, 0.2]),
+            ])
+            keys = incremental.glyph_keys(
+                temp.name, [("area", 1), ("moments", 2)]
+            )
+        self.assertEqual(len(keys), 3)
+        self.assertNotEqual(keys[0], keys[1])
+        self.assertEqual(keys[0], keys[2])
+
+    def test_diff(self):
+        old = np.array([b"a", b"b", b"a", b"c"], dtype="S20")
+        new = np.array([b"c", b"a", b"d", b"b"], dtype="S20")
+        old_index, removed = incremental.diff(old, new)
+        self.assertEqual(old_index.tolist(), [3, 0, -1, 1])
+        self.assertEqual(removed.tolist(), [2])
+
+
+class TestNeighborCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = incremental.NeighborCache(self.directory)
+        rng = np.random.RandomState(0)
+        self.features = rng.normal(size=(60, 4))
+        self.keys = np.array(
+            [("glyph%d" % i).encode("ascii") for i in range(60)],
+            dtype="S20"
+        )
+        self.weights = np.array([1.0, 0.5, 0.0, 2.0])
+        self.mean, self.std = np.zeros(4), np.ones(4)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def cached(self, rows, distance_type=knn_fitness.DISTANCE_EUCLIDEAN):
+        nearest, dist = incremental.neighbor_lists(
+            self.features[rows], self.weights, 5, distance_type
+        )
+        self.cache.save("old", self.keys[rows], nearest, dist, self.weights,
+                        distance_type, self.mean, self.std)
+        return self.cache.load("old")
+
+    def test_neighbor_lists(self):
+        nearest, dist = incremental.neighbor_lists(
+            self.features, self.weights, 3, knn_fitness.DISTANCE_CITY_BLOCK
+        )
+        np.testing.assert_array_equal(
+            nearest, knn_fitness.leave_one_out_neighbors(
+                self.features, self.weights, 3,
+                knn_fitness.DISTANCE_CITY_BLOCK
+            )
+        )
+        self.assertTrue(np.all(np.diff(dist, axis=1) >= 0))
+
+    def test_update_matches_full(self):
+        # Glyphs 50-59 are new; glyphs 0-4 were removed.
+        old_rows = np.arange(50)
+        cache = self.cached(old_rows)
+        new_rows = np.arange(5, 60)
+        nearest, dist, summary = incremental.NeighborCache.update(
+            cache, self.keys[new_rows], self.features[new_rows],
+            self.weights, 5, knn_fitness.DISTANCE_EUCLIDEAN
+        )
+        full, full_dist = incremental.neighbor_lists(
+            self.features[new_rows], self.weights, 5,
+            knn_fitness.DISTANCE_EUCLIDEAN
+        )
+        np.testing.assert_array_equal(nearest, full)
+        np.testing.assert_allclose(dist, full_dist)
+        self.assertEqual(summary["added"], 10)
+        self.assertEqual(summary["removed"], 5)
+        self.assertLess(summary["recomputedRows"], len(new_rows))
+        self.assertGreaterEqual(summary["recomputedRows"], 10)
+
+    def test_evict(self):
+        self.cached(np.arange(50))
+        self.cache.save("new", *[self.cache.load("old")[name] for name in (
+            "keys", "nearest", "dist", "weights", "distance_type", "mean",
+            "std"
+        )])
+        old, new = self.cache.path("old"), self.cache.path("new")
+        now = os.path.getmtime(new)
+        os.utime(old, (now - 100, now - 100))
+        # Within both limits: nothing goes.
+        self.cache.evict(now)
+        self.assertTrue(os.path.exists(old))
+        # Over the size limit: the least recently used goes first.
+        self.cache.max_bytes = os.path.getsize(new)
+        self.cache.evict(now)
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+        # Too old.
+        self.cache.max_age = 10
+        self.cache.evict(now + 11)
+        self.assertFalse(os.path.exists(new))
+
+    def test_usable(self):
+        cache = self.cached(np.arange(50))
+        usable = incremental.NeighborCache.usable
+        euclidean = knn_fitness.DISTANCE_EUCLIDEAN
+        self.assertTrue(usable(cache, self.weights, euclidean, 5,
+                               self.mean, self.std))
+        self.assertFalse(usable(None, self.weights, euclidean, 5,
+                                self.mean, self.std))
+        self.assertFalse(usable(cache, self.weights, euclidean, 6,
+                                self.mean, self.std))
+        self.assertFalse(usable(cache, self.weights * 2, euclidean, 5,
+                                self.mean, self.std))
+        self.assertFalse(usable(cache, self.weights,
+                                knn_fitness.DISTANCE_CITY_BLOCK, 5,
+                                self.mean, self.std))
+        # Only the normalization of active features matters.
+        self.assertTrue(usable(cache, self.weights, euclidean, 5,
+                               self.mean + [0, 0, 1, 0], self.std))
+        self.assertFalse(usable(cache, self.weights, euclidean, 5,
+                                self.mean, self.std * 1.1))
+
+
+if __name__ == '__main__':
+    unittest.main()
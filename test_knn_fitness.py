@@ -0,0 +1,150 @@
+# Copyright (C) 2020 Juliette Regimbal
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import division, unicode_literals
+
+import knn_fitness
+import numpy as np
+import unittest
+
+
+def make_blobs(n_per_class=20, num_classes=3, num_features=6, seed=0):
+    rng = np.random.RandomState(seed)
+    centers = rng.uniform(-5.0, 5.0, (num_classes, num_features))
+    features = np.vstack([
+        rng.normal(c, 1.0, (n_per_class, num_features)) for c in centers
+    ])
+    labels = np.repeat(np.arange(num_classes), n_per_class)
+    return features, labels
+
+
+class TestDistances(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(1)
+        self.a = rng.normal(size=(5, 4))
+        self.b = rng.normal(size=(7, 4))
+        self.w = np.array([1.0, 0.0, 0.5, 2.0])
+
+    def brute_force(self, p):
+        diff = np.abs(self.a[:, np.newaxis, :] - self.b[np.newaxis, :, :])
+        return (self.w * diff ** p).sum(axis=2)
+
+    def test_city_block(self):
+        np.testing.assert_allclose(
+            knn_fitness.distances(self.a, self.b, self.w,
+                                  knn_fitness.DISTANCE_CITY_BLOCK),
+            self.brute_force(1)
+        )
+
+    def test_euclidean(self):
+        np.testing.assert_allclose(
+            knn_fitness.distances(self.a, self.b, self.w,
+                                  knn_fitness.DISTANCE_EUCLIDEAN),
+            np.sqrt(self.brute_force(2))
+        )
+        np.testing.assert_allclose(
+            knn_fitness.distances(self.a, self.b, self.w,
+                                  knn_fitness.DISTANCE_FAST_EUCLIDEAN),
+            self.brute_force(2),
+            atol=1e-10
+        )
+
+
+class TestLeaveOneOut(unittest.TestCase):
+    def test_nearest_excludes_self(self):
+        features, labels = make_blobs()
+        w = np.ones(features.shape[1])
+        n = len(labels)
+        nearest = knn_fitness.nearest_neighbors(
+            features, features, w, 3, exclude=np.arange(n)
+        )
+        self.assertEqual(nearest.shape, (n, 3))
+        self.assertFalse(np.any(nearest == np.arange(n)[:, np.newaxis]))
+
+    def test_vote_tie_goes_to_nearest(self):
+        self.assertEqual(
+            knn_fitness.vote(np.array([[2, 1, 1, 2]]), 3).tolist(), [1]
+        )
+        self.assertEqual(
+            knn_fitness.vote(np.array([[2, 1, 2, 1]]), 3).tolist(), [2]
+        )
+
+    def test_separable_accuracy(self):
+        features, labels = make_blobs()
+        w = np.ones(features.shape[1])
+        self.assertEqual(
+            knn_fitness.leave_one_out_accuracy(features, labels, w, 1),
+            1.0
+        )
+
+    def test_blocked_matches_full(self):
+        rng = np.random.RandomState(6)
+        features = rng.normal(size=(70, 5))
+        w = np.array([1.0, 0.0, 0.5, 2.0, 1.0])
+        n = len(features)
+        for distance_type in (knn_fitness.DISTANCE_CITY_BLOCK,
+                              knn_fitness.DISTANCE_EUCLIDEAN):
+            full = knn_fitness.distances(features, features, w, distance_type)
+            full[np.arange(n), np.arange(n)] = np.inf
+            expected = np.argsort(full, axis=1, kind="mergesort")[:, :4]
+            block = knn_fitness.REFERENCE_BLOCK
+            knn_fitness.REFERENCE_BLOCK = 16
+            try:
+                # Room for only a few query rows at a time.
+                nearest, dist = knn_fitness.k_nearest(
+                    features, features, w, 4, distance_type,
+                    np.arange(n), max_bytes=2000
+                )
+            finally:
+                knn_fitness.REFERENCE_BLOCK = block
+            np.testing.assert_array_equal(nearest, expected)
+            np.testing.assert_allclose(
+                dist, np.sort(full, axis=1)[:, :4], rtol=1e-5
+            )
+
+    def test_block_rows(self):
+        self.assertEqual(knn_fitness.block_rows(10, 3, 100, 4, 1), 1)
+        self.assertEqual(knn_fitness.block_rows(10, 3, 100, 4, 2 ** 30), 10)
+        rows = knn_fitness.block_rows(10 ** 6, 3, 4096, 4, 2 ** 20)
+        self.assertLess(rows * 4096 * 4, 2 ** 20)
+
+    def test_accuracies_share_neighbors(self):
+        features, labels = make_blobs(num_features=2, seed=4)
+        w = np.ones(features.shape[1])
+        nearest = knn_fitness.leave_one_out_neighbors(features, w, 7)
+        self.assertEqual(
+            knn_fitness.leave_one_out_accuracies(labels, nearest, [1, 3, 7]),
+            [knn_fitness.leave_one_out_accuracy(features, labels, w, k)
+             for k in (1, 3, 7)]
+        )
+
+    def test_accuracy_weighted_by_counts(self):
+        features, labels = make_blobs(num_features=2, seed=4)
+        counts = np.arange(len(labels)) % 4 + 1
+        # The glyphs the deduplicated rows stand for.
+        glyphs = np.repeat(np.arange(len(labels)), counts)
+        nearest = knn_fitness.leave_one_out_neighbors(
+            features, np.ones(2), 7
+        )
+        for k in (1, 3, 7):
+            self.assertAlmostEqual(
+                knn_fitness.leave_one_out_accuracies(
+                    labels, nearest, [k], counts
+                )[0],
+                knn_fitness.leave_one_out_accuracy(
+                    features[glyphs], labels[glyphs], np.ones(2), k
+                )
+            )
+
+    def test_weighted_vote(self):
+        neighbor_labels = np.random.RandomState(4).randint(0, 3, (50, 6))
+        np.testing.assert_array_equal(
+            knn_fitness.weighted_vote(
+                neighbor_labels, np.ones(neighbor_labels.shape), 3, 5
+            ),
+            knn_fitness.vote(neighbor_labels[:, :5], 3)
+        )
+        # Two votes for 1 outweigh the nearer one for 0.
+        self.assertEqual(knn_fitness.weighted_vote(
+            np.array([[0, 1, 2]]), np.array([[1, 2, 4]]), 3, 3
+        ).tolist(), [1])
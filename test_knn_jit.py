@@ -0,0 +1,97 @@
+# Copyright (C) 2020 Juliette Regimbal
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import division, unicode_literals
+
+from test_knn_fitness import make_blobs
+
+import ga_engine
+import knn_fitness
+import knn_jit
+import numpy as np
+import unittest
+
+
+class TestKernels(unittest.TestCase):
+    """
+    Without numba these run knn_jit's kernels as plain Python.
+    """
+
+    def setUp(self):
+        features, self.labels = make_blobs(n_per_class=20, num_features=6)
+        self.features = knn_fitness.normalize(features)
+        self.use_jit = knn_fitness.USE_JIT, knn_fitness.JIT_DISTANCES
+        knn_fitness.JIT_DISTANCES = (knn_fitness.DISTANCE_CITY_BLOCK,
+                                     knn_fitness.DISTANCE_EUCLIDEAN,
+                                     knn_fitness.DISTANCE_FAST_EUCLIDEAN)
+
+    def tearDown(self):
+        knn_fitness.USE_JIT, knn_fitness.JIT_DISTANCES = self.use_jit
+
+    def both(self, f, *args):
+        knn_fitness.USE_JIT = False
+        numpy_result = f(*args)
+        knn_fitness.USE_JIT = True
+        return numpy_result, f(*args)
+
+    def test_k_nearest(self):
+        w = np.array([1.0, 0.0, 0.5, 2.0, 0.0, 1.0])
+        for distance_type in (knn_fitness.DISTANCE_CITY_BLOCK,
+                              knn_fitness.DISTANCE_EUCLIDEAN,
+                              knn_fitness.DISTANCE_FAST_EUCLIDEAN):
+            for features in (self.features, self.features.astype("f4")):
+                (a, a_dist), (b, b_dist) = self.both(
+                    knn_fitness.k_nearest, features[:15], features, w, 5,
+                    distance_type, np.arange(15)
+                )
+                np.testing.assert_array_equal(a, b)
+                self.assertEqual(a_dist.dtype, b_dist.dtype)
+                np.testing.assert_allclose(a_dist, b_dist, rtol=1e-5)
+
+    def test_blocks(self):
+        w = np.array([1.0, 0.0, 0.5, 2.0, 0.0, 1.0])
+        whole = knn_jit.k_nearest(self.features, self.features, w, 4, True,
+                                  np.arange(60))
+        # Blocks of 7 rows.
+        blocks = knn_jit.k_nearest(self.features, self.features, w, 4, True,
+                                   np.arange(60), max_bytes=7 * 2 * 8 * 4)
+        np.testing.assert_array_equal(whole[0], blocks[0])
+        np.testing.assert_array_equal(whole[1], blocks[1])
+
+    def test_excluded_row_fills_list(self):
+        nearest, dist = knn_jit.k_nearest(
+            self.features[:3], self.features[:3], np.ones(6), 3, True,
+            np.arange(3)
+        )
+        self.assertEqual(nearest[:, 2].tolist(), [0, 1, 2])
+        self.assertTrue(np.all(np.isinf(dist[:, 2])))
+
+    def test_identical_fitness(self):
+        rng = np.random.RandomState(2)
+        parameters = ga_engine.ParameterGenes(
+            ga_engine.OPMODE_WEIGHTING, 5, True
+        )
+        for genome in rng.uniform(size=(5, 6 + len(parameters))):
+            numpy_fitness, jit_fitness = self.both(
+                lambda g: ga_engine.LeaveOneOutFitness(
+                    self.features, self.labels, 1,
+                    knn_fitness.DISTANCE_CITY_BLOCK,
+                    ga_engine.OPMODE_WEIGHTING, parameters=parameters
+                )(g),
+                genome
+            )
+            self.assertEqual(numpy_fitness, jit_fitness)
+
+    def test_supports(self):
+        w = np.ones(6)
+        self.assertTrue(knn_jit.supports(self.features, self.features, w))
+        half = self.features.astype(np.float16)
+        self.assertFalse(knn_jit.supports(half, half, w))
+        self.assertFalse(knn_jit.supports(
+            self.features, self.features.astype(np.float32), w
+        ))
+        self.assertFalse(knn_jit.supports(self.features, self.features, -w))
+
+
+if __name__ == '__main__':
+    unittest.main()
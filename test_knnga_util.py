@@ -252,6 +252,27 @@ class TestStopCriteria(unittest.TestCase):
         self.sc.setMaxFitnessEvals(6000)
         self.sc.setMaxGenerations(102)
         self.sc.setSteadyStateStop(40, 15)
+        self.sc.setMaxWallClock(600)
+        self.sc.setDeadline(1600000000)
+        self.sc.setImprovementRateStop(0.01, 5)
+
+    def test_budget_from_json(self):
+        self.sc.setMaxGenerations(100)
+        self.sc.setMaxWallClock(600)
+        self.sc.setDeadline(1600000000)
+        self.sc.setImprovementRateStop()
+        testJSON = self.sc.toJSON()
+        test = knnga_util.SerializableStopCriteria.fromJSON(testJSON)
+        self.assertEqual(self.sc, test)
+
+    def test_invalid_improvement_rate(self):
+        with self.assertRaises(ValueError):
+            self.sc.setImprovementRateStop(window=0)
+        with self.assertRaises(ValueError):
+            knnga_util.SerializableStopCriteria.from_dict([{
+                "method": "improvementRate",
+                "parameters": {"rate": -0.01, "window": 5}
+            }])
 
 
 class TestBaseSetting(unittest.TestCase):
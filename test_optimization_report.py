@@ -0,0 +1,71 @@
+# Copyright (C) 2020 Juliette Regimbal
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import division, unicode_literals
+
+import feature_matrix
+import json
+import knn_fitness
+import numpy as np
+import optimization_report
+import unittest
+
+from test_knn_fitness import make_blobs
+
+
+class TestReport(unittest.TestCase):
+    def setUp(self):
+        features, labels = make_blobs(n_per_class=20, seed=5)
+        # Two informative features and four of noise.
+        features[:, 2:] = np.random.RandomState(6).normal(
+            0, 10.0, (60, 4)
+        )
+        self.matrix = feature_matrix.FeatureMatrix(
+            features.astype(np.float32), labels.astype(np.uint8),
+            ["a", "b", "c"], [("f", 6)]
+        ).normalize()
+
+    def test_confusion(self):
+        table = optimization_report.confusion(
+            np.array([0, 0, 1, 2]), np.array([0, 1, 1, 2]), 3,
+            np.array([2, 1, 1, 4])
+        )
+        self.assertEqual(table.tolist(), [[2, 1, 0], [0, 1, 0], [0, 0, 4]])
+
+    def test_compare(self):
+        before = (np.ones(6), 1, knn_fitness.DISTANCE_CITY_BLOCK)
+        after = (np.array([1.0, 1.0, 0, 0, 0, 0]), 3,
+                 knn_fitness.DISTANCE_EUCLIDEAN)
+        report = optimization_report.compare(self.matrix, before, after)
+        self.assertEqual(report["glyphs"], 60)
+        self.assertEqual(report["throughputGlyphs"], 60)
+        self.assertEqual(report["before"]["activeFeatures"], 6)
+        self.assertEqual(report["after"]["activeFeatures"], 2)
+        self.assertEqual(report["after"]["k"], 3)
+        for side in ("before", "after"):
+            table = np.array(report[side]["confusion"])
+            self.assertEqual(table.sum(), 60)
+            self.assertAlmostEqual(
+                np.trace(table) / 60.0, report[side]["accuracy"]
+            )
+            self.assertEqual(report[side]["perClass"]["a"]["glyphs"], 20)
+            self.assertGreater(report[side]["glyphsPerSecond"], 0)
+        self.assertGreater(report["accuracyChange"], 0)
+        self.assertAlmostEqual(
+            report["accuracyChange"],
+            report["after"]["accuracy"] - report["before"]["accuracy"]
+        )
+        json.dumps(report)
+
+    def test_sample_queries(self):
+        queries = optimization_report.sample_queries(self.matrix, 10)
+        self.assertEqual(queries.shape, (10, 6))
+        # Raw vectors are normalized back to training rows.
+        normalized = (queries - self.matrix.mean) / self.matrix.std
+        self.assertTrue(np.any(np.all(
+            np.abs(self.matrix.features - normalized[0]) < 1e-5, axis=1
+        )))
+
+
+if __name__ == '__main__':
+    unittest.main()
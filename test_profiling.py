@@ -0,0 +1,48 @@
+# Copyright (C) 2020 Juliette Regimbal
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import unicode_literals
+
+import json
+import profiling
+import unittest
+
+
+class ListLogger(object):
+    def __init__(self):
+        self.lines = []
+
+    def info(self, line):
+        self.lines.append(line)
+
+
+class TestPhaseProfiler(unittest.TestCase):
+    def test_phases_are_recorded_and_logged(self):
+        logger = ListLogger()
+        profiler = profiling.PhaseProfiler(logger, {"state": 2})
+        with profiler.phase("copy"):
+            pass
+        with profiler.phase("parse"):
+            sum(range(1000))
+        self.assertEqual(
+            [p["phase"] for p in profiler.summary()], ["copy", "parse"]
+        )
+        entry = json.loads(logger.lines[-1])
+        self.assertEqual(entry["state"], 2)
+        self.assertEqual(entry["phase"], "parse")
+        self.assertGreaterEqual(entry["wall"], 0.0)
+
+    def test_phase_recorded_on_error(self):
+        profiler = profiling.PhaseProfiler()
+        with self.assertRaises(ValueError):
+            with profiler.phase("optimize"):
+                raise ValueError
+        self.assertEqual(len(profiler.summary()), 1)
+
+    def test_capture(self):
+        with profiling.capture() as result:
+            sorted(range(100))
+        self.assertIn("function calls", result["stats"])
+        with profiling.capture(False) as result:
+            pass
+        self.assertEqual(result, {})
@@ -0,0 +1,59 @@
+# Copyright (C) 2020 Juliette Regimbal
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import unicode_literals
+
+import os
+import progress
+import shutil
+import tempfile
+import unittest
+
+
+class TestProgressTracker(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = progress.create_progress_file(self.directory)
+        self.tracker = progress.ProgressTracker(
+            [
+                {"method": "maxGenerations", "parameters": {"n": 100}},
+                {"method": "maxFitnessEvals", "parameters": {"n": 1000}},
+                {"method": "steadyState",
+                 "parameters": {"minGens": 40, "noChangeGens": 10}},
+                {"method": "bestFitness", "parameters": {"optimum": 1.0}},
+            ],
+            population_size=20,
+            path=self.path,
+            start=0.0
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_eta(self):
+        record = self.tracker.update(10, 0.5, now=10.0)
+        self.assertEqual(record["evaluations"], 200)
+        self.assertEqual(record["evaluationsPerSecond"], 20.0)
+        eta = record["etaByCriterion"]
+        self.assertEqual(eta["maxGenerations"], 90.0)
+        self.assertEqual(eta["maxFitnessEvals"], 40.0)
+        self.assertEqual(eta["steadyState"], 30.0)
+        self.assertIsNone(eta["bestFitness"])
+        self.assertEqual(record["eta"], 30.0)
+
+    def test_steady_state_follows_improvement(self):
+        self.tracker.update(40, 0.5, now=40.0)
+        record = self.tracker.update(45, 0.5, now=45.0)
+        self.assertEqual(record["lastImprovement"], 40)
+        self.assertEqual(record["etaByCriterion"]["steadyState"], 5.0)
+
+    def test_read_latest(self):
+        self.assertIsNone(progress.read_latest(self.path))
+        self.tracker.update(1, 0.1, now=1.0)
+        self.tracker.update(2, 0.2, now=2.0, finished=True)
+        latest = progress.read_latest(self.path)
+        self.assertEqual(latest["generation"], 2)
+        self.assertTrue(latest["finished"])
+        self.assertIsNone(
+            progress.read_latest(os.path.join(self.directory, "missing"))
+        )
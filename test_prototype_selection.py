@@ -0,0 +1,70 @@
+# Copyright (C) 2020 Juliette Regimbal
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import division, unicode_literals
+
+import knn_fitness
+import numpy as np
+import prototype_selection
+import unittest
+
+from test_knn_fitness import make_blobs
+
+
+class TestCondensation(unittest.TestCase):
+    def setUp(self):
+        self.condensation = prototype_selection.SerializableCondensation()
+
+    def test_from_json(self):
+        self.condensation.setEditedCondensedNearestNeighbor(5, 0.02)
+        test = prototype_selection.SerializableCondensation.fromJSON(
+            self.condensation.toJSON()
+        )
+        self.assertEqual(self.condensation, test)
+
+    def test_condense_reduces(self):
+        features, labels = make_blobs(n_per_class=40)
+        features = knn_fitness.normalize(features)
+        weights = np.ones(features.shape[1])
+        self.condensation.setCondensedNearestNeighbor(0.0)
+        keep, summary = prototype_selection.condense(
+            features, labels, weights, 1, self.condensation
+        )
+        self.assertLess(len(keep), len(labels) // 2)
+        self.assertEqual(set(labels[keep]), set(labels))
+        self.assertGreaterEqual(
+            summary["accuracyAfter"], summary["accuracyBefore"]
+        )
+
+    def test_bounded_memory(self):
+        features, labels = make_blobs(n_per_class=30, seed=3)
+        features += np.random.RandomState(4).normal(0, 3.0, features.shape)
+        weights = np.ones(features.shape[1])
+        keep = np.arange(0, 90, 3)
+        for k in (1, 3):
+            np.testing.assert_array_equal(
+                prototype_selection.reduced_predictions(
+                    features, labels, weights, k, keep, max_bytes=1
+                ),
+                prototype_selection.reduced_predictions(
+                    features, labels, weights, k, keep
+                )
+            )
+        prototypes = keep[::2]
+        support = prototype_selection.supporting_samples(
+            features, labels, weights, keep, prototypes, max_bytes=1
+        )
+        self.assertEqual(len(np.intersect1d(support, keep)), 0)
+        self.assertEqual(set(labels[support]), set(labels[prototypes]))
+
+    def test_tolerance_adds_back(self):
+        features, labels = make_blobs(n_per_class=30, seed=3)
+        features += np.random.RandomState(4).normal(0, 3.0, features.shape)
+        weights = np.ones(features.shape[1])
+        self.condensation.setEditedNearestNeighbor(3, 0.0)
+        keep, summary = prototype_selection.condense(
+            features, labels, weights, 3, self.condensation
+        )
+        self.assertGreaterEqual(
+            summary["accuracyAfter"], summary["accuracyBefore"]
+        )
@@ -0,0 +1,63 @@
+# Copyright (C) 2020 Juliette Regimbal
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import unicode_literals
+
+import os
+import scheduler
+import shutil
+import tempfile
+import unittest
+
+
+class TestFairShares(unittest.TestCase):
+    def test_even_split(self):
+        shares = scheduler.fair_shares([("a", 8), ("b", 8)], 8)
+        self.assertEqual(shares, {"a": 4, "b": 4})
+
+    def test_small_request_frees_cores(self):
+        shares = scheduler.fair_shares([("a", 1), ("b", 8), ("c", 8)], 8)
+        self.assertEqual(shares, {"a": 1, "b": 4, "c": 3})
+
+    def test_queue_beyond_cores(self):
+        shares = scheduler.fair_shares([("a", 4), ("b", 4), ("c", 4)], 2)
+        self.assertEqual(shares, {"a": 1, "b": 1, "c": 0})
+
+
+class TestSplitCores(unittest.TestCase):
+    def test_split(self):
+        self.assertEqual(scheduler.split_cores(10, 4), [1, 1, 1, 1])
+        self.assertEqual(scheduler.split_cores(3, 8), [3, 3, 2])
+        self.assertEqual(scheduler.split_cores(1, 8), [8])
+        self.assertEqual(scheduler.split_cores(2, 0), [0])
+
+
+class TestCoreLease(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_shares_shrink_and_grow(self):
+        first = scheduler.CoreLease(8, self.directory, total=8)
+        self.assertEqual(first.acquire(), 8)
+        with scheduler.CoreLease(8, self.directory, total=8) as second:
+            self.assertEqual(second.cores, 4)
+            self.assertEqual(first.renew(), 4)
+            self.assertEqual(first.status()["jobs"], 2)
+        self.assertEqual(first.renew(), 8)
+        first.release()
+        self.assertEqual(
+            [f for f in os.listdir(self.directory) if f.endswith(".json")],
+            []
+        )
+
+    def test_queue_depth(self):
+        leases = [scheduler.CoreLease(1, self.directory, total=1)
+                  for i in range(2)]
+        self.assertEqual(leases[0].acquire(), 1)
+        self.assertEqual(leases[1].acquire(wait=False), 0)
+        self.assertEqual(leases[1].status()["queueDepth"], 1)
+        for lease in leases:
+            lease.release()
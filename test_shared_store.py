@@ -0,0 +1,114 @@
+# Copyright (C) 2020 Juliette Regimbal
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import unicode_literals
+
+from tempfile import NamedTemporaryFile as NTF
+from test_feature_matrix import write_training_xml
+
+import feature_matrix
+import numpy as np
+import os
+import shared_store
+import shutil
+import tempfile
+import unittest
+
+
+class TestSharedMatrixStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = shared_store.SharedMatrixStore(self.directory)
+        self.temp = NTF(suffix=".xml")
+        write_training_xml(self.temp, [
+            ("neume.punctum", 4.0, [0.1, 0.2]),
+            ("clef.c", 6.0, [0.3, 0.4]),
+        ])
+        self.key = shared_store.content_key(
+            self.temp.name, [("area", 1), ("moments", 2)], "float32"
+        )
+        self.builds = 0
+
+    def tearDown(self):
+        self.temp.close()
+        shutil.rmtree(self.directory)
+
+    def build(self):
+        self.builds += 1
+        return feature_matrix.FeatureMatrix.from_xml(
+            self.temp.name,
+            mode=feature_matrix.MODE_MMAP,
+            directory=self.directory
+        )
+
+    def test_shared_and_reference_counted(self):
+        a = self.store.attach(self.key, self.build)
+        b = self.store.attach(self.key, self.build)
+        self.assertEqual(self.builds, 1)
+        self.assertEqual(a.mode, feature_matrix.MODE_SHARED)
+        self.assertFalse(b.features.flags.writeable)
+        np.testing.assert_array_equal(a.features, b.features)
+        np.testing.assert_allclose(
+            a.features.mean(axis=0), 0.0, atol=1e-6
+        )
+        self.assertEqual(a.class_names, ["clef.c", "neume.punctum"])
+
+        a.close()
+        self.assertTrue(os.path.exists(
+            os.path.join(self.directory, self.key + ".features.npy")
+        ))
+        b.close()
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_deduplicated(self):
+        def build():
+            matrix = self.build()
+            deduplicated = feature_matrix.deduplicate(
+                matrix, 0, feature_matrix.MODE_MMAP, self.directory
+            )
+            matrix.close()
+            return deduplicated
+        matrix = self.store.attach(self.key, build)
+        self.assertEqual(matrix.counts.tolist(), [1, 1])
+        self.assertEqual(matrix.rows.tolist(), [0, 1])
+        matrix.close()
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_lock_removed_while_waiting(self):
+        # The last release removes the lock file while another
+        # process waits on it; the waiter must lock a new file.
+        path = os.path.join(self.directory, self.key + ".lock")
+        flock = shared_store.fcntl.flock
+        calls = []
+
+        def released_while_waiting(f, op):
+            flock(f, op)
+            if not calls:
+                os.remove(path)
+            calls.append(os.fstat(f.fileno()).st_ino)
+
+        shared_store.fcntl.flock = released_while_waiting
+        try:
+            lock = self.store._lock(self.key)
+        finally:
+            shared_store.fcntl.flock = flock
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(os.fstat(lock.fileno()).st_ino, os.stat(path).st_ino)
+        lock.close()
+
+    def test_key_depends_on_options(self):
+        layout = [("area", 1), ("moments", 2)]
+        self.assertNotEqual(self.key, shared_store.content_key(
+            self.temp.name, layout, "float32", {"resolution": 0.01}
+        ))
+        self.assertNotEqual(self.key, shared_store.content_key(
+            [self.temp.name, self.temp.name], layout, "float32"
+        ))
+
+    def test_key_depends_on_precision(self):
+        self.assertNotEqual(
+            self.key,
+            shared_store.content_key(
+                self.temp.name, [("area", 1), ("moments", 2)], "float16"
+            )
+        )